@@ -45,6 +45,7 @@ fi
 [ -z "${UWSGI_WORKERS}" ] && EXTRA_PARAMS="${EXTRA_PARAMS} --workers 8"
 
 #finally run the uwsgi server
+#threads are enabled for the background workers (such as the keys pool refill)
 exec uwsgi --plugin ${UWSGI_PLUGINS} --wsgi-file MgmtWebSvcApp.py --callable g_theApp --virtualenv ${WORK_DIR}/PyVenv\
- --master --cheaper-algo spare --cheaper 1 --cheaper-initial 1 -l "${MAX_LISTEN_CONN-128}" --uid $UWSGI_UID\
+ --enable-threads --master --cheaper-algo spare --cheaper 1 --cheaper-initial 1 -l "${MAX_LISTEN_CONN-128}" --uid $UWSGI_UID\
  --gid $UWSGI_GID ${EXTRA_PARAMS}
@@ -1,9 +1,11 @@
 from flask_restx import fields as FlaskRestPlusFields
 from Api import g_theApi
-from Database.Models import CasDbModel, CertsDbModel
+from Database.Models import CasDbModel, CertsDbModel, CrlsDbModel
 from marshmallow import Schema, fields, post_load, validate as mmValidate
 from Utils.ModelUtils import ModelFromSchema
 from Utils import ResourcesUtils
+from Utils.CaKeysCache import GetCaKeysCache
+from Utils.PkiJobs import g_keyProfiles
 
 #CA marshmallow schema
 from Utils.ResourcesUtils import JWTAuthResource
@@ -11,6 +13,9 @@ from Utils.ResourcesUtils import JWTAuthResource
 
 class CaSchema(Schema):
     orgId = fields.Integer(required=True, description="CA's associated org id")
+    keyProfile = fields.String(validate=mmValidate.OneOf(list(g_keyProfiles)),
+                               description="The key profile of the CA and of its certificates. If missing at creation, "
+                                           "the KEY_PROFILE setting is used")
 
 from flask_restx.model import Model
 g_casModelOut: Model = g_theApi.model("Output CA model",
@@ -24,6 +29,7 @@ g_casModel: Model = g_theApi.model("CAs model",
                     "total_items" : FlaskRestPlusFields.Integer(description="Total number of items in the collection. Missing if pagination is False"),
                     "page" : FlaskRestPlusFields.Integer(description="The page number. Missing if pagination is False"),
                     "perPage" : FlaskRestPlusFields.Integer(description="Per page items no. Missing if pagination is False"),
+                    "nextCursor" : FlaskRestPlusFields.String(description="The next page's cursor. Present only in keyset pagination mode and missing on the last page"),
                     "cas" : FlaskRestPlusFields.List(FlaskRestPlusFields.Nested(g_casModelOut),
                                                      description="CAs list")
                 })
@@ -46,6 +52,42 @@ class CasPaginated(JWTAuthResource):
             "perPage": ResourcesUtils.ReqSafeArg("perPage", 10)
         })
 
+    @g_theApi.expect(g_theApi.model("Input CA model", ModelFromSchema(CaSchema)))
+    def post(self):
+        """
+            Creates the CA of an organization, with the given key profile. The organizations' CAs are otherwise created
+            on their first use, with the default key profile (KEY_PROFILE setting)
+
+        :return: 201 http status along with the CA's id or aborts with 400/404/500 http status and an error json
+        """
+        from flask_restx import abort
+        from marshmallow import ValidationError
+        from sqlalchemy.exc import IntegrityError
+        from Database.Errors import IntegrityErrorKind
+        from Utils.CertsUtils import GenerateAndStoreCa
+        from Utils.Leases import Lease
+        from Utils.ResourcesUtils import GetOrg
+
+        try:
+            caDict = CaSchema().load(g_theApi.payload or {})
+        except ValidationError as e:
+            abort(400, f"Validation error - {e}")
+        org = GetOrg(caDict["orgId"])
+        # under the org's CA lease, so that no CA gets lazily created (with the default profile) in the meantime
+        with Lease(g_theApi.app, f"ca:{org.id}"):
+            if CasDbModel.query.filter(CasDbModel.orgId == org.id).count():
+                abort(400, f"{org.PrettyRepr()} already has a CA")
+            try:
+                caId, _, _ = GenerateAndStoreCa(g_theApi.app, org.id, {
+                    "keyProfile": caDict.get("keyProfile")
+                })
+            except IntegrityError as e: # created before the lease got acquired, but not visible to the check above
+                g_theApi.app.Db().session.rollback()
+                if IntegrityErrorKind(e) != "unique":
+                    raise
+                abort(400, f"{org.PrettyRepr()} already has a CA")
+        return {"id": caId}, 201
+
 @g_theApi.route("/cas/caId/<int:caId>", doc={"params": {"caId": "the CA's id"}})
 class CasId(JWTAuthResource):
     def delete(self, caId):
@@ -56,7 +98,11 @@ class CasId(JWTAuthResource):
             caQuery.delete(synchronize_session=False)
             # dbSession.delete(caDbObj, synchronize_session=False)
             CertsDbModel.query.filter(CertsDbModel.orgId == caDbObj.orgId).delete(synchronize_session=False)
+            CrlsDbModel.query.filter(CrlsDbModel.orgId == caDbObj.orgId).delete(synchronize_session=False)
             # dbSession.delete(CertsDbModel.query.filter(CertsDbModel.orgId == caDbObj.orgId), synchronize_session=False)
             dbSession.commit()
         except Exception as e:
-            return {"message": "Error deleting CA along its certificates - " + str(e)}, 500
\ No newline at end of file
+            return {"message": "Error deleting CA along its certificates - " + str(e)}, 500
+        caKeysCache = GetCaKeysCache()
+        if caKeysCache is not None:
+            caKeysCache.Pop(caId)
\ No newline at end of file
@@ -28,6 +28,17 @@ class CertsBatchRevoke(Schema):
     ids = fields.List(fields.Integer, required=True, description="The certificated ids to be revoked/unrevoked")
     revokeValue = fields.Boolean(default=True, missing=True, description="The certificates' revokation value")
 
+class CertsBatchIssue(Schema):
+    orgId = fields.Integer(required=True, description="The organization id")
+    entityIds = fields.List(fields.Integer, required=True, description="The entities (users or servers) ids")
+    validFrom = fields.Date(description="The certificates' validity start date. Defaults to yesterday")
+    validity = fields.Integer(validate=mmValidate.Range(min=1), description="The certificates' validity, in days")
+    reissue = fields.Boolean(missing=False, description="If true then the certificates are issued even for the entities "
+                                                        "with valid certificates")
+    renewMode = fields.String(validate=mmValidate.OneOf(["rekey", "resign"]),
+                              description="The renewal mode: rekey (new keys) or resign (the existing keys are signed "
+                                          "again). Defaults to the CERTS_RENEW_MODE setting")
+
 from flask_restx.model import Model
 g_certModelOut: Model = g_theApi.model("Output certificate model",
     {"id": FlaskRestPlusFields.Integer(description="certificate's id"),
@@ -39,7 +50,8 @@ g_certsModel: Model = g_theApi.model("Certificates model",
                     "pagination" : FlaskRestPlusFields.Boolean(required=True, description="States if pagination is enabled or not"),
                     "total_items" : FlaskRestPlusFields.Integer(description="Total number of items in the collection. Missing if pagination is False"),
                     "page" : FlaskRestPlusFields.Integer(description="The page number. Missing if pagination is False"),
-                    "per_page" : FlaskRestPlusFields.Integer(description="Per page items no. Missing if pagination is False"),
+                    "perPage" : FlaskRestPlusFields.Integer(description="Per page items no. Missing if pagination is False"),
+                    "nextCursor" : FlaskRestPlusFields.String(description="The next page's cursor. Present only in keyset pagination mode and missing on the last page"),
                     "certs" : FlaskRestPlusFields.List(FlaskRestPlusFields.Nested(g_certModelOut),
                                                                         description="certificates list")
                 })
@@ -55,12 +67,25 @@ class Certs(JWTAuthResource):
     def get(self):
         """
             Gets the certificates list
+
+            Besides the pagination query strings, it supports the following filters:
+                * orgId: the certificates' organization id
+                * entityId: the certificates' entity (user or server) id
+                * srvType: if true only the servers' certificates are returned and if false only the users' ones
+                * state: the certificates' state - "valid", "invalid", "expired", "revoked" or "na"
+                * expiresBefore: only the certificates expiring before the given date (YYYY-MM-DD) are returned
+            If the "after" query string is given, the list is paged through keyset pagination: "after" has to be empty
+            for the first page and set to the previous page's "nextCursor" for the next ones. The last page has no
+            "nextCursor"
+            The unpaged list can be streamed: with "stream=1" the regular json is written incrementally and with
+            "Accept: application/x-ndjson" header each certificate is written as a json line
+
         :return: a paged/unpaged list of certificates
         """
         # from Utils.CertsUtils import GetCertAndKey
         # cert, key = GetCertAndKey(g_theApi.app, 1, 1)
         from flask import request as req
-        from Api.OvpnConfigTemplates.Utils import ConfigFromReqArgs, DateTimeFromStr
+        from Api.OvpnConfigTemplates.Utils import ConfigFromReqArgs, DateTimeFromStr, StrictDateTimeFromStr
         from datetime import datetime
 
         config = ConfigFromReqArgs(req.args, [
@@ -77,34 +102,82 @@ class Certs(JWTAuthResource):
             {
                 "name": "includePEM",
                 "default": False
+            },
+            {
+                "name": "orgId",
+                "type": int
+            },
+            {
+                "name": "entityId",
+                "type": int
+            },
+            {
+                "name": "srvType",
+                "post": lambda srvTypeStr: srvTypeStr.lower() in ["1", "on", "true"]
+            },
+            {
+                "name": "state",
+                "post": lambda stateStr: stateStr.upper()
             }
         ])
+        if "expiresBefore" in req.args: # parsed strictly, so an invalid date isn't silently ignored
+            try:
+                config["expiresBefore"] = StrictDateTimeFromStr(req.args["expiresBefore"])
+            except ValueError as e:
+                abort(400, str(e))
 
-        from sqlalchemy import func
+        from sqlalchemy import case, exists
+        from sqlalchemy.orm import aliased
 
+        query = CertsDbModel.query
+        for filterName in ("orgId", "entityId", "srvType"):
+            if config.get(filterName) is not None:
+                query = query.filter(getattr(CertsDbModel, filterName) == config[filterName])
         if not config["all"]:
-            subq = g_theApi.app.Db().session.query(
-                CertsDbModel.id,
-                func.row_number().over(partition_by=[CertsDbModel.entityId, CertsDbModel.orgId],
-                                       order_by=CertsDbModel.id.desc()).label('rowNoWithinPartition')).\
-                subquery(name="lastCerts") #Note: "row_number" was introduced in sqlite3 3.25 so use a python newer enough
-            query = CertsDbModel.query.join(subq, CertsDbModel.id == subq.c.id).filter(subq.c.rowNoWithinPartition == 1)
-        else:
-            query = CertsDbModel.query
-        res =  ResourcesUtils.Get(CertsDbModel, {
-            "query": query
-        })
+            # keep only the last certificate of each entity - org - type, i.e. the ones without a newer certificate
+            newerCerts = aliased(CertsDbModel)
+            query = query.filter(~exists().where(newerCerts.entityId == CertsDbModel.entityId,
+                                                 newerCerts.orgId == CertsDbModel.orgId,
+                                                 newerCerts.srvType == CertsDbModel.srvType,
+                                                 newerCerts.id > CertsDbModel.id))
+        stateExpr = case((CertsDbModel.revoked == True, CertsUtils.CertState.REVOKED.value),
+                         else_=CertsUtils.CertStateSqlExpr(config["date"]))  #the state is computed by db
+        if config.get("state") is not None:
+            if config["state"] not in CertsUtils.CertState.__members__:
+                abort(400, f'Invalid state "{config["state"].lower()}"')
+            query = query.filter(stateExpr == CertsUtils.CertState[config["state"]].value)
+        if config.get("expiresBefore") is not None:
+            query = query.filter(CertsDbModel.notAfter < config["expiresBefore"])
+        query = query.add_columns(stateExpr.label("state"))
 
         from flask_restx import marshal
-        resDict = marshal(res, g_certsModel, skip_none=True)
 
-        for idx, certEntry in enumerate(resDict["certs"]):
-            certEntry["state"] = str(CertsUtils.StateFromCertDbObj(res["certs"][idx], config).name).lower() \
-                if not certEntry["revoked"] else "revoked"
-            del(certEntry["revoked"])
-        if config["includePEM"]:
-            for idx, certEntry in enumerate(resDict["certs"]):
-                certEntry["certPEM"] = res["certs"][idx].cert.decode().rstrip()
+        def CertsDicts(certsRows):
+            certsDicts = marshal([certRow[0] for certRow in certsRows], g_certModelOut, skip_none=True)
+            for idx, certEntry in enumerate(certsDicts):
+                certEntry["state"] = CertsUtils.CertState(certsRows[idx].state).name.lower()
+                del(certEntry["revoked"])
+                if config["includePEM"]:
+                    certEntry["certPEM"] = certsRows[idx][0].cert.decode().rstrip()
+            return certsDicts
+
+        listConfig = {
+            "query": query,
+            "perPage": ResourcesUtils.ReqSafeArg("perPage", 10)
+        }
+        streamFormat = ResourcesUtils.StreamFormat(listConfig)
+        if streamFormat is not None:
+            return ResourcesUtils.StreamGet(CertsDbModel, {
+                **listConfig,
+                "format": streamFormat,
+                "marshalChunk": CertsDicts
+            })
+
+        res = ResourcesUtils.Get(CertsDbModel, listConfig)
+        certsRows = res["certs"]
+        res["certs"] = []
+        resDict = marshal(res, g_certsModel, skip_none=True)
+        resDict["certs"] = CertsDicts(certsRows)
         return resDict
 
 @g_theApi.route("/certs:batchRevoke")
@@ -116,13 +189,76 @@ class CertsBatchRevoke(JWTAuthResource):
             return {"message": "No certificates ids provided"}, 400
         revokeValue = g_theApi.payload.get("value", True)
         try:
-            CertsDbModel.query.filter(CertsDbModel.id.in_(revokeCertsIds)).update({"revoked": revokeValue},
-                                                                                  synchronize_session=False)
+            certsQuery = CertsDbModel.query.filter(CertsDbModel.id.in_(revokeCertsIds))
+            CertsUtils.InvalidateCRLs([row.orgId for row in certsQuery.with_entities(CertsDbModel.orgId).distinct()])
+            certsQuery.update({"revoked": revokeValue}, synchronize_session=False)
             g_theApi.app.Db().session.commit()
             return None, 200
         except Exception as e:
             abort(500, str(e))
 
+@g_theApi.route("/certs:batchIssue")
+class CertsBatchIssueRes(JWTAuthResource):
+    @g_theApi.expect(g_theApi.model("Certificates batch issue", ModelFromSchema(CertsBatchIssue)))
+    def post(self):
+        """
+            Issues the certificates of several entities of the same organization at once. The organization's CA is
+            loaded once, the keys are generated (or drawn from the keys pool) and the certificates signed in parallel and
+            all the certificates are stored in a single transaction
+
+            The payload json fields are:
+                * orgId [required]: the organization id
+                * entityIds [required]: the entities (users or servers) ids. They must be bound to the organization
+                * validFrom [optional]: the certificates' validity start date (YYYY-MM-DD)
+                * validity [optional]: the certificates' validity, in days
+                * reissue [optional]: if true then the certificates are issued even for the entities already having a
+                valid certificate
+                * renewMode [optional]: rekey or resign - the existing keys of the expired (or reissued) certificates
+                are signed again. The revoked certificates are always renewed with new keys
+
+        :return: the per entity status ("issued", "valid" - already having a valid certificate, "notFound" or
+        "notBound" - the entity isn't bound to the organization) along with the certificate id or aborts with 4xx/5xx
+        http status and an error json
+        """
+        from marshmallow.exceptions import ValidationError
+        from Database.Models import EntityDbModel, EntityOrgBindings
+        from Utils.SettingsUtils import EnvOrSetting
+        import datetime
+
+        try:
+            batchIssue = CertsBatchIssue().load(g_theApi.payload)
+        except ValidationError as e:
+            abort(400, f"Validation error - {e}")
+        entityIds = list(dict.fromkeys(batchIssue["entityIds"]))  # unique ids, preserving the order
+        if len(entityIds) == 0:
+            abort(400, "No entities ids provided")
+        maxBatchSize = int(EnvOrSetting("CERTS_BATCH_ISSUE_MAX", defaultValue=500))
+        if len(entityIds) > maxBatchSize:
+            abort(400, f"Too many entities ids. At most {maxBatchSize} certificates can be issued at once")
+        orgId = batchIssue["orgId"]
+        org = ResourcesUtils.GetOrg(orgId)
+
+        entities = {entity.id: entity for entity in EntityDbModel.query.filter(EntityDbModel.id.in_(entityIds))}
+        boundIds = {row.entityId for row in EntityOrgBindings.query.with_entities(EntityOrgBindings.entityId).filter(
+            EntityOrgBindings.orgId == orgId, EntityOrgBindings.entityId.in_(entityIds))}
+        results = {entityId: {"entityId": entityId, "status": "notFound" if entityId not in entities else "notBound"}
+                   for entityId in entityIds if entityId not in boundIds}
+        certs = CertsUtils.BatchGetCertsAndKeys(g_theApi.app, org, [entities[entityId] for entityId in entityIds
+                                                                    if entityId not in results], {
+            "reissue": batchIssue["reissue"],
+            **({"validFrom": datetime.datetime.combine(batchIssue["validFrom"], datetime.time())}
+               if "validFrom" in batchIssue else {}),
+            **({"validity": batchIssue["validity"]} if "validity" in batchIssue else {}),
+            **({"renewMode": batchIssue["renewMode"]} if "renewMode" in batchIssue else {})
+        })
+        for entityId, (certObj, issued) in certs.items():
+            results[entityId] = {"entityId": entityId, "status": "issued" if issued else "valid", "certId": certObj.id}
+        return {
+            "orgId": orgId,
+            "issued": len([issued for certObj, issued in certs.values() if issued]),
+            "results": [results[entityId] for entityId in entityIds]
+        }, 200
+
 @g_theApi.route("/certs/<int:certId>", doc={"params": {"id": "certificate's id"}})
 class CertsId(JWTAuthResource):
     """
@@ -159,6 +295,7 @@ class CertsId(JWTAuthResource):
             certObj: CertsDbModel = CertsDbModel.query.filter(CertsDbModel.id == certId).one()
             patchData = g_theApi.payload
             certObj.revoked = patchData["value"]
+            CertsUtils.InvalidateCRLs([certObj.orgId])
             g_theApi.app.Db().session.commit()
 
             return None, 200
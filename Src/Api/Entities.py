@@ -1,4 +1,4 @@
-from flask_restx import fields as FlaskRestPlusFields
+from flask_restx import fields as FlaskRestPlusFields, abort
 from Api import g_theApi, EntityLikeSchemaBase
 from Database.Models import EntityDbModel, OrgDbModel, EntityOrgBindings, EntityTypeEnum, ServersExtraInfoDbModel
 from marshmallow import Schema, fields, post_load, validate as mmValidate, post_dump
@@ -17,6 +17,13 @@ class EntitySchema(EntityLikeSchemaBase):
     def CreateEntity(self, data, **kwargs):
         return EntityDbModel(**data)
 
+class EntitiesBatchSchema(EntitySchema):
+    orgsIds = fields.List(fields.Integer, required=True, validate=mmValidate.Length(min=1),
+                          description="The ids of the organizations the entity is bound to")
+
+    def CreateEntity(self, data, **kwargs):  # not a post_load hook - the batch records are bulk inserted as dictionaries
+        return data
+
 from flask_restx.model import Model
 
 # build flask_restx model out of marshmallow schema, for using it with @api.marshal_with decorator
@@ -40,6 +47,8 @@ g_entityModel = g_theApi.model("Entity model",
                                        description="The page number. Missing if pagination is False"),
                                    "perPage": FlaskRestPlusFields.Integer(
                                        description="Per page items no. Missing if pagination is False"),
+                                   "nextCursor": FlaskRestPlusFields.String(
+                                       description="The next page's cursor. Present only in keyset pagination mode and missing on the last page"),
                                    "entities": FlaskRestPlusFields.List(FlaskRestPlusFields.Nested(g_entityModelOut),
                                                                         description="Entities list")
                                })
@@ -54,23 +63,43 @@ class Entities(JWTAuthResource):
     def get(self):
         """
             Gets the entities list
+
+            The unpaged list can be streamed (see ResourcesUtils.StreamFormat): with "stream=1" the regular json is
+            written incrementally and with "Accept: application/x-ndjson" header each entity is written as a json line
         :return: the entities list
         """
-        res = ResourcesUtils.Get(EntityDbModel, {
+        from flask import request as req
+        from flask_restx import marshal
+
+        config = {
             "page": ResourcesUtils.ReqSafeArg("page", 0),
             "perPage": ResourcesUtils.ReqSafeArg("perPage", 10),
             "limit": EnvOrSetting("LIMIT_ENTITIES", None, 1000)
-        })
-
-        from flask_restx import marshal
+        }
+        withOrgs = "withOrgs" in req.args and req.args["withOrgs"].lower() in ["1", "on", "true"]
+
+        def EntitiesDicts(entities):
+            entitiesDicts = marshal(entities, g_entityModelOut, skip_none=True)
+            if withOrgs:  # add associated orgs ids to each user
+                orgsIds = ResourcesUtils.GetRelatedIds(EntityOrgBindings.entityId, EntityOrgBindings.orgId,
+                                                       [entity.id for entity in entities])
+                for idx, entity in enumerate(entities):
+                    entitiesDicts[idx]["orgsIds"] = orgsIds[entity.id]
+            return entitiesDicts
+
+        streamFormat = ResourcesUtils.StreamFormat(config)
+        if streamFormat is not None:
+            return ResourcesUtils.StreamGet(EntityDbModel, {
+                **config,
+                "format": streamFormat,
+                "marshalChunk": EntitiesDicts
+            })
+
+        res = ResourcesUtils.Get(EntityDbModel, config)
+        items = res["entities"]
+        res["entities"] = []
         resDict = marshal(res, g_entityModel, skip_none=True)
-
-        from flask import request as req
-
-        if "withOrgs" in req.args and req.args["withOrgs"].lower() in ["1", "on", "true"]:  # add associated orgs ids to each user
-            for idx, entity in enumerate(res["entities"]):
-                resDict["entities"][idx]["orgsIds"] = [org.id for org in entity.orgs]
-
+        resDict["entities"] = EntitiesDicts(items)
         return resDict
 
     # @g_theApi.expect(g_entityModelWithOrgsIdsIn)
@@ -128,6 +157,55 @@ class Entities(JWTAuthResource):
         })
 
 
+@g_theApi.route("/entities:batchCreate")
+class EntitiesBatchCreate(JWTAuthResource):
+    @g_theApi.expect([g_theApi.model("Entities batch create record", ModelFromSchema(EntitiesBatchSchema))])
+    def post(self):
+        """
+            Creates several entities at once. The payload is a json array of entities or, if the content type is
+            text/csv, a CSV with a header line naming the fields (the orgsIds being ";" separated). The records are
+            validated in a single pass and the entities, their organizations bindings and the servers' extra info are
+            bulk inserted in a single transaction. Either all the entities are created or none
+
+        :return: 201 http status along with the created entities' ids, in the payload order, or aborts with 400/500 http
+        status and an error json
+        """
+        records = ResourcesUtils.LoadBatch(g_theApi, EntitiesBatchSchema(unknown="EXCLUDE"), {
+            "maxItems": EnvOrSetting("BATCH_CREATE_MAX", None, 5000),
+            "listFields": ["orgsIds"]
+        })
+        invalidTypeIds = {record["typeId"] for record in records} - {entityType.value for entityType in EntityTypeEnum}
+        if len(invalidTypeIds):
+            abort(400, f"Invalid entity type id '{min(invalidTypeIds)}'")
+        orgsIds = {orgId for record in records for orgId in record["orgsIds"]}
+        invalidOrgsIds = orgsIds - {row.id for row in OrgDbModel.query.with_entities(OrgDbModel.id).filter(
+            OrgDbModel.id.in_(orgsIds))}
+        if len(invalidOrgsIds):
+            abort(400, f"Invalid organization id '{min(invalidOrgsIds)}'")
+
+        ids = ResourcesUtils.BatchInsert(g_theApi, EntityDbModel, [
+            {key: value for key, value in record.items() if key != "orgsIds"} for record in records
+        ], {
+            "limit": EnvOrSetting("LIMIT_ENTITIES", None, 100000)
+        })
+        dbSession = g_theApi.app.Db().session
+        try:
+            dbSession.execute(EntityOrgBindings.__table__.insert(), [
+                {"entityId": entityId, "orgId": orgId} for entityId, record in zip(ids, records)
+                for orgId in dict.fromkeys(record["orgsIds"])
+            ])
+            srvsIds = [entityId for entityId, record in zip(ids, records) if record["typeId"] == EntityTypeEnum.server]
+            if len(srvsIds):
+                dbSession.execute(ServersExtraInfoDbModel.__table__.insert(), [
+                    {"srvId": srvId, "tlsKey": b""} for srvId in srvsIds  # the tls key is generated on first use
+                ])
+            dbSession.commit()
+        except Exception as e:
+            dbSession.rollback()
+            abort(500, f"Error - {e}")
+        return {"ids": ids}, 201
+
+
 @g_theApi.route("/entities/<int:entityId>", doc={"params": {"entityId": "the entity id"}})
 class EntityId(JWTAuthResource):
     """
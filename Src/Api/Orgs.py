@@ -1,4 +1,4 @@
-from flask_restx import fields as FlaskRestPlusFields
+from flask_restx import fields as FlaskRestPlusFields, abort
 from Api import EntityLikeSchemaBase, g_theApi
 from Database.Models import OrgDbModel, EntityDbModel, EntityOrgBindings
 from marshmallow import Schema, fields, post_load, validate as mmValidate
@@ -18,6 +18,12 @@ class OrgSchema(EntityLikeSchemaBase):
         return OrgDbModel(**data)
 
 
+class OrgsBatchSchema(OrgSchema):
+    entitiesIds = fields.List(fields.Integer, missing=[], description="The ids of the entities bound to the organization")
+
+    def CreateOrg(self, data, **kwargs):  # not a post_load hook - the batch records are bulk inserted as dictionaries
+        return data
+
 from flask_restx.model import Model
 
 # build flask_restx model out of marshmallow schema, for using it with @api.marshal_with decorator
@@ -39,6 +45,8 @@ g_orgsModel: Model = g_theApi.model("Orgs model",
                                             description="The page number. Missing if pagination is False"),
                                         "perPage": FlaskRestPlusFields.Integer(
                                             description="Per page items no. Missing if pagination is False"),
+                                        "nextCursor": FlaskRestPlusFields.String(
+                                            description="The next page's cursor. Present only in keyset pagination mode and missing on the last page"),
                                         "orgs": FlaskRestPlusFields.List(FlaskRestPlusFields.Nested(g_orgModelOut),
                                                                          description="Organizations list")
                                     })
@@ -52,6 +60,11 @@ class Orgs(JWTAuthResource):
         Optionally, it supports pagination, through query strings, as following:
             * page: the page number
             * perPage: the items number of a page
+            * after: the keyset pagination cursor - empty for the first page and the previous page's "nextCursor" for the
+            next ones. It's cheaper than page, for walking large collections
+            * withTotal: in keyset pagination mode, if true then the (cached) total items number is returned, as well
+        The unpaged list can be streamed: with "stream=1" the regular json is written incrementally and with
+        "Accept: application/x-ndjson" header each organization is written as a json line
     """
 
     # @g_theApi.marshal_with(g_orgsModel, skip_none=True)
@@ -61,24 +74,41 @@ class Orgs(JWTAuthResource):
 
         :return: the organizations list
         """
-        res = ResourcesUtils.Get(OrgDbModel, {
+        from flask import request as req
+        from flask_restx import marshal
+
+        config = {
             "page": ResourcesUtils.ReqSafeArg("page", 0),
             "perPage": ResourcesUtils.ReqSafeArg("perPage", 10),
             "limit": EnvOrSetting("LIMIT_ORGS", None, 1000)
-        })
-
-        from flask_restx import marshal
+        }
+        withEntities = "withEntities" in req.args and req.args["withEntities"].lower() in ["1", "on", "true"]
+
+        def OrgsDicts(orgs):
+            orgsDicts = marshal(orgs, g_orgModelOut, skip_none=True)
+            if withEntities:  # add associated entities ids to each org
+                entitiesIds = ResourcesUtils.GetRelatedIds(EntityOrgBindings.orgId, EntityOrgBindings.entityId,
+                                                           [org.id for org in orgs], {
+                    "orderByColumn": getattr(EntityDbModel, req.args["entitiesOrderBy"]) if "entitiesOrderBy" in req.args
+                        and hasattr(EntityDbModel, req.args["entitiesOrderBy"]) else None
+                })
+                for idx, org in enumerate(orgs):
+                    orgsDicts[idx]["entitiesIds"] = entitiesIds[org.id]
+            return orgsDicts
+
+        streamFormat = ResourcesUtils.StreamFormat(config)
+        if streamFormat is not None:
+            return ResourcesUtils.StreamGet(OrgDbModel, {
+                **config,
+                "format": streamFormat,
+                "marshalChunk": OrgsDicts
+            })
+
+        res = ResourcesUtils.Get(OrgDbModel, config)
+        items = res["orgs"]
+        res["orgs"] = []
         resDict = marshal(res, g_orgsModel, skip_none=True)
-
-        from flask import request as req
-
-        if "withEntities" in req.args and req.args["withEntities"].lower() in ["1", "on", "true"]:  # add associated orgs ids to each user
-            for idx, org in enumerate(res["orgs"]):
-                orgQuery = org.entities
-                if "entitiesOrderBy" in req.args and hasattr(EntityDbModel, req.args["entitiesOrderBy"]):
-                    orgQuery = orgQuery.order_by(getattr(EntityDbModel, req.args["entitiesOrderBy"]))
-                resDict["orgs"][idx]["entitiesIds"] = [entity.id for entity in orgQuery]
-
+        resDict["orgs"] = OrgsDicts(items)
         return resDict
 
     @g_theApi.expect(g_orgModelIn)
@@ -132,6 +162,47 @@ class Orgs(JWTAuthResource):
         })
 
 
+@g_theApi.route("/orgs:batchCreate")
+class OrgsBatchCreate(JWTAuthResource):
+    @g_theApi.expect([g_theApi.model("Orgs batch create record", ModelFromSchema(OrgsBatchSchema))])
+    def post(self):
+        """
+            Creates several organizations at once. The payload is a json array of organizations or, if the content type
+            is text/csv, a CSV with a header line naming the fields (the entitiesIds being ";" separated). The records
+            are validated in a single pass and the organizations and their entities bindings are bulk inserted in a
+            single transaction. Either all the organizations are created or none
+
+        :return: 201 http status along with the created organizations' ids, in the payload order, or aborts with 400/500
+        http status and an error json
+        """
+        records = ResourcesUtils.LoadBatch(g_theApi, OrgsBatchSchema(unknown="EXCLUDE"), {
+            "maxItems": EnvOrSetting("BATCH_CREATE_MAX", None, 5000),
+            "listFields": ["entitiesIds"]
+        })
+        entitiesIds = {entityId for record in records for entityId in record["entitiesIds"]}
+        invalidEntitiesIds = entitiesIds - {row.id for row in EntityDbModel.query.with_entities(EntityDbModel.id).filter(
+            EntityDbModel.id.in_(entitiesIds))} if len(entitiesIds) else set()
+        if len(invalidEntitiesIds):
+            abort(400, f"Invalid entity id '{min(invalidEntitiesIds)}'")
+
+        ids = ResourcesUtils.BatchInsert(g_theApi, OrgDbModel, [
+            {key: value for key, value in record.items() if key != "entitiesIds"} for record in records
+        ], {
+            "limit": EnvOrSetting("LIMIT_ORGS", None, 1000)
+        })
+        dbSession = g_theApi.app.Db().session
+        try:
+            bindings = [{"entityId": entityId, "orgId": orgId} for orgId, record in zip(ids, records)
+                        for entityId in dict.fromkeys(record["entitiesIds"])]
+            if len(bindings):
+                dbSession.execute(EntityOrgBindings.__table__.insert(), bindings)
+            dbSession.commit()
+        except Exception as e:
+            dbSession.rollback()
+            abort(500, f"Error - {e}")
+        return {"ids": ids}, 201
+
+
 @g_theApi.route("/orgs/<int:orgId>", doc={"params": {"orgId": "the organization id"}})
 class OrgsId(JWTAuthResource):
     """
@@ -1,6 +1,11 @@
 import typing
 from Api.OvpnConfigTemplates.Common.ConfigTemplateBase import ConfigTemplateBase
 from io import BytesIO
+import os
+
+from Api.OvpnConfigTemplates.Utils import LoadSkeletonFiles
+
+g_linuxSkeletonFiles = LoadSkeletonFiles(os.path.join(os.path.dirname(__file__), "linux"))
 
 class ConfigTemplate(ConfigTemplateBase):
     @staticmethod
@@ -32,7 +37,7 @@ class ConfigTemplate(ConfigTemplateBase):
         return f'{super().BaseName()}-{self.m_configVars["os"]}-{self.m_configVars["entityName"].replace(" ", "_")}'
 
     def ArchName(self):
-        return self.BaseName() + ".tar.xz" if self.m_configVars["os"] == "linux" else None
+        return f"{self.BaseName()}.{self.ArchExt()}" if self.m_configVars["os"] == "linux" else None
 
     def InstallInstructions(self, linePrefix: str = "") -> str:
         return {
@@ -205,6 +210,11 @@ remote-cert-tls server
 # cipher AES-256-CBC
 cipher AES-256-GCM
 
+# The TLS control channel cipher suites matching
+# the certificates' key type. Keep them in sync
+# with the server config
+{self.TlsDirectives()}
+
 # Enable compression on the VPN link.
 # Don't enable this unless it is also
 # enabled in the server config file.
@@ -251,19 +261,12 @@ register-dns
         else:
             return ""
 
+    def ArchiveEntries(self):
+        configEntry = (self.Name(), self._InstanceStr().encode(), 0o600) # the config contains the inline private key
+        return g_linuxSkeletonFiles + [configEntry] if self.m_configVars["os"] == "linux" else [configEntry]
+
     def _DoInstantiateLinux(self) -> typing.Tuple[typing.IO, str]:
-        import os
-        import shutil
-
-        moduleDir = os.path.dirname(__file__)
-        configtmpDir = os.path.join(self.m_configVars["tmpDir"], "ClientConfig")
-
-        #copy the file to tmp folder
-        shutil.copytree(os.path.join(moduleDir, "linux"), configtmpDir)
-        with open(os.path.join(configtmpDir, self.Name()), "wb") as f:
-            f.write(self._InstanceStr().encode())
-        from Utils import CertsUtils
-        return CertsUtils.PackConfigTree(configtmpDir), f"{self.BaseName()}-client-conf.tar.xz"
+        return self.PackArchive(self.ArchiveEntries()), f"{self.BaseName()}-client-conf.{self.ArchExt()}"
 
     def _DoInstantiateInline(self) -> typing.Tuple[typing.IO, str]:
         return BytesIO(self._InstanceStr().encode()), self.Name()
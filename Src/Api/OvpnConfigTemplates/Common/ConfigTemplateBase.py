@@ -1,7 +1,7 @@
 import typing
 
 g_verMajor = 0
-g_verMinor = 1
+g_verMinor = 2
 
 class ConfigTemplateBase:
     @staticmethod
@@ -31,6 +31,22 @@ class ConfigTemplateBase:
     def ArchName(self): #return the archive name if the case or None otherwise
         return None
 
+    def ArchExt(self): #the archive extension, according to the compression codec
+        from Utils.CertsUtils import g_archiveCompressions
+        return g_archiveCompressions[self.m_configVars.get("compression", "xz")]
+
+    def PackArchive(self, entries):
+        from Utils.CertsUtils import PackConfigEntries
+        return PackConfigEntries(entries, self.m_configVars.get("compression", "xz"),
+                                 self.m_configVars.get("compressionLevel", None))
+
+    def ArchiveEntries(self) -> typing.List[typing.Tuple]: #the (name, data, mode) entries of the config, for packing it in a bigger archive. Must be defined by the sub-class
+        return []
+
+    def TlsDirectives(self): #the TLS directives matching the certificates' key profile
+        from Api.OvpnConfigTemplates.Utils import TlsDirectives
+        return TlsDirectives(self.m_configVars["caCert"])
+
     def BaseName(self):
         return "liny-ovpn"
 
@@ -1,12 +1,17 @@
 # import typing
 from Api.OvpnConfigTemplates.Common.ConfigTemplateBase import ConfigTemplateBase
-from io import BytesIO
+import os
+from string import Template
 
 from Api.OvpnConfigTemplates.Utils import ValidProtoStr
-from Utils import CertsUtils
 
-#available only on Linux - x64
-from Utils.CertsUtils import KeysOpener
+g_confsDir = os.path.join(os.path.dirname(__file__), "Confs")
+with open(os.path.join(g_confsDir, "dnsmasq.conf"), "rb") as f:
+    g_dnsmasqConf = f.read()
+g_ovpnConfTemplates = {}
+for protoStr in ("tcp", "udp"):
+    with open(os.path.join(g_confsDir, "Openvpn", f"server-{protoStr}.conf"), "r") as f:
+        g_ovpnConfTemplates[protoStr] = Template(f.read(100000)) #max 100000 chars to read
 
 class ConfigTemplate(ConfigTemplateBase):
     @staticmethod
@@ -22,7 +27,7 @@ class ConfigTemplate(ConfigTemplateBase):
         return super().BaseName() + "-srv-conf"
 
     def ArchName(self):
-        return self.BaseName() + ".tar.xz"
+        return f"{self.BaseName()}.{self.ArchExt()}"
 
     def _DoInstantiate(self):
         def InstantiateConfs():
@@ -56,58 +61,29 @@ class ConfigTemplate(ConfigTemplateBase):
                 abort(400, "Invalid proto - " + protoStr)
             self.m_configVars["proto"] = protoStr
             self.m_configVars["port"] = port
-            confTemplate = ""
-            with open(os.path.join(os.path.dirname(__file__), "Confs", "Openvpn", f"server-{protoStr}.conf"), 'r') as f:
-                from string import Template
-                confTemplate = Template(f.read(100000)) #max 100000 chars to read
-            with open(os.path.join(ovpnTmpConfsDir, f"server-{protoStr}-{port}.conf"), "wt", newline='\n') as f:
-                confStr = confTemplate.safe_substitute(self.m_configVars)
-                f.write(confStr)
-
-                try:
-                    import re
-                    ccd = re.search("^\s*client-config-dir\s*(\S*)", confStr, re.MULTILINE).group(1)
-                    if len(ccd):
-                        os.mkdir(os.path.join(ovpnTmpConfsDir, ccd), mode=0o755)
-                except:
-                    pass
-
-
-        import os
-        import tempfile
-
-        with tempfile.TemporaryDirectory(None, "OvpnServerConfig-", self.m_configVars["tmpDir"]) as tmpConfsDir:
-            ovpnTmpConfsDir = os.path.join(tmpConfsDir, "openvpn")
-            import shutil
-            os.mkdir(ovpnTmpConfsDir, mode=0o755)
-            #copy dnsmasq.conf file
-            shutil.copy(os.path.join(os.path.dirname(__file__), "Confs", "dnsmasq.conf"), tmpConfsDir)
-            #copy the server template skeleton tree to tmp dir
-            # shutil.copytree(os.path.join(os.path.dirname(__file__), 'Confs'), tmpConfsDir)
-            InstantiateConfs()
-
-            #copy to tmp dir the CA cert
-            certsPath = os.path.join(ovpnTmpConfsDir, "server")
-            os.mkdir(certsPath, mode=0o755) #create the certs subdir
-            with open(os.path.join(certsPath, "LinyOvpnCA.crt"),
-                      "wb") as f:
-                f.write(self.m_configVars["caCert"])
-
-            #copy to tmp dir the server's cert and key
-            with open(os.path.join(certsPath, "LinyOvpn.crt"), "wb") as f:
-                f.write(self.m_configVars["cert"])
-
-            with open(os.path.join(certsPath, "LinyOvpn.key"), "wb",
-                      opener=KeysOpener) as f:
-                f.write(self.m_configVars["key"])
-
-            #copy to tmp dir the server's specific files (such as tc.key
-            with open(os.path.join(certsPath, "tc.key"), "wb", opener=KeysOpener) \
-                    as f:
-                f.write(self.m_configVars["tlsKey"])
-
-            #copy to tmp dir the crl file
-            with open(os.path.join(certsPath, "crl.pem"), "wb") as f:
-                f.write(self.m_configVars["crl"])
-
-            return CertsUtils.PackConfigTree(tmpConfsDir), self.ArchName()
+            confStr = g_ovpnConfTemplates[protoStr].safe_substitute(self.m_configVars)
+            entries.append((f"openvpn/server-{protoStr}-{port}.conf", confStr.encode(), 0o644))
+
+            try:
+                import re
+                ccd = re.search("^\s*client-config-dir\s*(\S*)", confStr, re.MULTILINE).group(1)
+                if len(ccd):
+                    entries.append((f"openvpn/{ccd}", None, 0o755))
+            except:
+                pass
+
+        entries = [
+            ("dnsmasq.conf", g_dnsmasqConf, 0o644),
+            ("openvpn", None, 0o755)
+        ]
+        self.m_configVars["tlsDirectives"] = self.TlsDirectives()
+        InstantiateConfs()
+        entries += [
+            ("openvpn/server", None, 0o755), #the certs subdir
+            ("openvpn/server/LinyOvpnCA.crt", self.m_configVars["caCert"], 0o644), #the CA cert
+            ("openvpn/server/LinyOvpn.crt", self.m_configVars["cert"], 0o644), #the server's cert and key
+            ("openvpn/server/LinyOvpn.key", self.m_configVars["key"], 0o600),
+            ("openvpn/server/tc.key", self.m_configVars["tlsKey"], 0o600), #the server's specific files (such as tc.key)
+            ("openvpn/server/crl.pem", self.m_configVars["crl"], 0o644) #the crl file
+        ]
+        return self.PackArchive(entries), self.ArchName()
@@ -50,6 +50,36 @@ def ConfigVarsFromReqArgs(reqArgs):
     return {
         "os": osParam,
         "srvHost": reqArgs.get("srvHost", "localhost"),
+        **CompressionVarsFromReqArgs(reqArgs)
+    }
+
+
+def CompressionVarsFromReqArgs(reqArgs):
+    from Utils.CertsUtils import g_archiveCompressions
+    from Utils.SettingsUtils import EnvOrSetting
+
+    compression = reqArgs.get("compression", EnvOrSetting("CONFIGS_ARCHIVE_COMPRESSION", defaultValue="xz")).lower()
+    if compression not in g_archiveCompressions:
+        abort(400, f"Invalid compression. It must be in {list(g_archiveCompressions)} list")
+    if compression == "zst":
+        from importlib.util import find_spec
+
+        if find_spec("zstandard") is None:
+            abort(400, "zst compression is not available. The zstandard package is missing")
+    compressionLevel = reqArgs.get("compressionLevel") if "compressionLevel" in reqArgs else \
+        EnvOrSetting("CONFIGS_ARCHIVE_COMPRESSION_LEVEL", defaultValue=None)
+    if compressionLevel is not None:
+        try:
+            compressionLevel = int(compressionLevel)
+        except ValueError:
+            abort(400, f"Invalid compression level \"{compressionLevel}\". It must be an integer")
+        minLevel, maxLevel = {"xz": (0, 9), "gz": (1, 9), "zst": (1, 22)}.get(compression, (compressionLevel,
+                                                                                          compressionLevel))
+        if not minLevel <= compressionLevel <= maxLevel:
+            abort(400, f"Invalid compression level. For {compression} it must be between {minLevel} and {maxLevel}")
+    return {
+        "compression": compression,
+        "compressionLevel": compressionLevel
     }
 
 
@@ -148,5 +178,71 @@ def DateTimeFromStr(dateStr): #assumes valid date str, in the form YYYY-MM-DD
         dateComponents = dateStr.split(sep=".")
     return datetime(*[int(dateComponent) for dateComponent in dateComponents]) if len(dateComponents) >= 3 else dateStr
 
+def StrictDateTimeFromStr(dateStr):
+    """
+        The strict version of DateTimeFromStr: the date must be valid (YYYY-MM-DD or YYYY.MM.DD, optionally followed by
+        the time components)
+
+    :param dateStr: the date string
+    :return: the datetime object or raises ValueError if the date string is invalid
+    """
+    from datetime import datetime
+    try:
+        dateTime = DateTimeFromStr(dateStr)
+    except (ValueError, TypeError):
+        dateTime = None
+    if not isinstance(dateTime, datetime):
+        raise ValueError(f"Invalid date \"{dateStr}\". It must be in the YYYY-MM-DD form")
+    return dateTime
+
+def LoadSkeletonFiles(skeletonDir):
+    """
+        Reads a config template's skeleton files (the static files shipped in each generated config archive), so that
+        they're read just once, when the config template module is loaded
+
+    :param skeletonDir: the skeleton directory. Only its top level files are read
+    :return: a list of (name, data, mode) tuples, as expected by Utils.CertsUtils.PackConfigEntries. The scripts (the
+    files starting with a shebang) are executable
+    """
+    import os
+
+    skeletonFiles = []
+    for fileName in sorted(os.listdir(skeletonDir)):
+        filePath = os.path.join(skeletonDir, fileName)
+        if os.path.isfile(filePath):
+            with open(filePath, "rb") as f:
+                data = f.read()
+            skeletonFiles.append((fileName, data, 0o755 if data.startswith(b"#!") else 0o644))
+    return skeletonFiles
+
 def ValidProtoStr(protoStr):
     return protoStr in ["tcp", "udp"]
+
+
+#the OpenVPN TLS directives by key type: the control channel's cipher suite (TLS 1.2) must match the certificates' key
+# type and, for ECDSA, the ECDH curve matches the certificates' curve. The Ed25519 certificates use the ECDSA suites
+# and OpenSSL's default groups (X25519 first)
+g_tlsDirectivesByKeyType = {
+    "rsa": "tls-cipher TLS-ECDHE-RSA-WITH-AES-256-GCM-SHA384",
+    "ecdsa": "ecdh-curve {curve}\ntls-cipher TLS-ECDHE-ECDSA-WITH-AES-256-GCM-SHA384",
+    "ed25519": "tls-cipher TLS-ECDHE-ECDSA-WITH-AES-256-GCM-SHA384"
+}
+#the OpenSSL names of the ECDSA curves
+g_ecdhCurves = {
+    "ecdsa-p256": "prime256v1",
+    "ecdsa-p384": "secp384r1"
+}
+
+
+def TlsDirectives(caCert) -> str:
+    """
+        Retrieves the OpenVPN TLS directives matching the key profile of the configs' certificates
+
+    :param caCert: the CA certificate (object or PEM). The certificates have the CA's key profile
+    :return: the directives, newline separated
+    """
+    from Utils.CertsUtils import CaKeyProfile
+    from Utils.PkiJobs import g_keyProfiles
+
+    keyProfile = CaKeyProfile(caCert)
+    return g_tlsDirectivesByKeyType[g_keyProfiles[keyProfile][0]].format(curve=g_ecdhCurves.get(keyProfile))
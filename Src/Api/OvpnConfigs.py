@@ -24,6 +24,12 @@ class OvpnConfigs(JWTAuthResource):
             It creates all the needed info if missing, such as CAs, certs and private keys.
             The server info has to already exist. Otherwise a 412 http status code will be returned
 
+            The rendered configs are cached and tagged (weak ETag), so the repeated downloads are served from the cache
+            or answered with 304 http status if the If-None-Match header matches
+
+            The expired certificates are renewed according to the renewMode query string (rekey or resign), defaulting
+            to the CERTS_RENEW_MODE setting
+
         :return: the client configuration file/archive
         """
         from flask import request as req
@@ -48,7 +54,26 @@ class OvpnConfigs(JWTAuthResource):
         configTemplateClass = GetConfigTemplatesClass(req.args.get("configTemplateId", None, int),
                                                           EntityTypeToConfigTemplateType(entityType))
         if configTemplateClass is not None:
+            import flask
+            import io
+            from Utils.OvpnConfigsCache import OvpnConfigCacheKey, GetOvpnConfigsCache
+
             app = g_theApi.app
+            configVars = EntityConfigVarsFromReqArgs(req.args)
+            # the custom validity args alter the generated CRL, so such configs are neither cached nor tagged
+            cacheKey = OvpnConfigCacheKey(configTemplateClass, entity, orgId, srvId, entityType == "server",
+                                          configVars) if not any(arg in req.args for arg in (
+                "caValidFrom", "validFrom", "caValidity", "validity")) else None
+            if cacheKey is not None:
+                if req.if_none_match.contains_weak(cacheKey):
+                    notModifiedResponse = flask.Response(status=304)
+                    notModifiedResponse.set_etag(cacheKey, weak=True)
+                    return notModifiedResponse
+            configsCache = GetOvpnConfigsCache() if cacheKey is not None else None
+            cachedConfig = configsCache.Get(cacheKey) if configsCache is not None else None
+            if cachedConfig is not None:
+                return self._SendConfig(io.BytesIO(cachedConfig[0]), cachedConfig[1], cacheKey)
+
             from Api.OvpnConfigTemplates.Utils import ConfigFromReqArgs, DateTimeFromStr
             config = ConfigFromReqArgs(req.args, [
                 {
@@ -78,32 +103,153 @@ class OvpnConfigs(JWTAuthResource):
                 {
                     "name": "validity",
                     "type": int
-                }
+                },
+                "renewMode"
             ], config)
             cert, key = CertsUtils.GetCertAndKey(app, entityId, orgId, {
                 **config,
                 "srvType": entityType == "server"
             })
             configStream, configName = configTemplateClass({
-                **EntityConfigVarsFromReqArgs(req.args),
+                **configVars,
                 "entityName": entity.name,
                 "caCert": caCert,
                 "caKey": caKey,
                 "cert": cert,
                 "key": key,
                 "tlsKey": CertsUtils.GetSrvExtraInfo(app, srvId),
-                "tmpDir": app.m_tmpDir.name,
                 "crl": CertsUtils.GetCRL(app, orgId, {
                     "serialize": True,
                     **config,
                 })
             }).Instantiate()
-            # send config to the client
-            import flask
-            import io
-            if isinstance(configStream, (io.BytesIO, io.StringIO)) and "wsgi.file_wrapper" in flask.request.environ:
-                del (flask.request.environ["wsgi.file_wrapper"])  # delete the wsgi filewapper since memory stream objs can't be offloaded
-            return flask.send_file(configStream, as_attachment=True, attachment_filename=configName,
-                                   cache_timeout=-1)
+            if configsCache is not None and isinstance(configStream, io.BytesIO):
+                configBytes = configStream.getvalue()
+                configsCache.Set(cacheKey, (configBytes, configName), len(configBytes))
+            return self._SendConfig(configStream, configName, cacheKey)
         else:
             abort(400, "Invalid config template id")
+
+    @staticmethod
+    def _SendConfig(configStream, configName, etag=None):
+        # send config to the client
+        import flask
+        import io
+        if isinstance(configStream, (io.BytesIO, io.StringIO)) and "wsgi.file_wrapper" in flask.request.environ:
+            del (flask.request.environ["wsgi.file_wrapper"])  # delete the wsgi filewapper since memory stream objs can't be offloaded
+        response = flask.send_file(configStream, as_attachment=True, attachment_filename=configName, cache_timeout=-1)
+        if etag is not None:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+@g_theApi.route("/ovpnConfigs:export/orgId/<int:orgId>/srvId/<int:srvId>",
+                doc={"params": {"srvId": "the server the users' configs connect to"}})
+class OvpnConfigsExport(JWTAuthResource):
+    """
+        The bulk Ovpn client configs export rest resource
+    """
+
+    def get(self, orgId, srvId):
+        """
+            Exports, as a single archive, the Ovpn client configs of all the organization's users (or of the users given
+            by the entityId[] query strings) for connecting to server srvId. The os, ports, protocols and compression
+            query strings are the same as for the single config download
+
+            The archive is streamed: the users are processed in chunks (CONFIGS_EXPORT_CHUNK_SIZE setting), issuing the
+            missing certificates in batches, and each chunk's configs are compressed and sent before the next chunk is
+            processed, so the memory usage doesn't depend on the organization's size. The expired certificates are
+            renewed according to the renewMode query string, as for the single config download
+
+            The query strings and the requested users are validated before streaming. An error occurring afterwards
+            (e.g. while issuing the certificates) is logged and cuts the download off before the archive's end, so the
+            client doesn't take the truncated archive for a complete one
+
+        :return: the configs archive or aborts with 4xx/5xx http status and an error json
+        """
+        import flask
+        from flask import request as req
+        from Database.Models import EntityDbModel, EntityOrgBindings, EntityTypeEnum
+        from Utils.ResourcesUtils import GetEntity, GetOrg
+        from Utils.SettingsUtils import EnvOrSetting
+        from Api.OvpnConfigTemplates import GetConfigTemplatesClass
+        from Api.OvpnConfigTemplates.Utils import ClientConfigVarsFromReqArgs
+        from Api.OvpnConfigTemplates.Common.ConfigTemplateBase import ConfigTemplateBase
+
+        org = GetOrg(orgId)
+        srv, srvType = GetEntity(srvId)
+        if srvType != "server":
+            abort(400, f"Entity {srvId} is not a server")
+        configTemplateClass = GetConfigTemplatesClass(req.args.get("configTemplateId", None, int), "client")
+        if configTemplateClass is None:
+            abort(400, "Invalid config template id")
+        if configTemplateClass.ArchiveEntries is ConfigTemplateBase.ArchiveEntries:
+            abort(400, "The config template doesn't support the export")
+        configVars = ClientConfigVarsFromReqArgs(req.args)
+        if len(req.args.getlist("entityId[]", int)) != len(req.args.getlist("entityId[]")):
+            abort(400, "Invalid entityId[] - the entity ids must be integers")
+        entityIds = list(dict.fromkeys(req.args.getlist("entityId[]", int)))
+        chunkSize = max(1, int(EnvOrSetting("CONFIGS_EXPORT_CHUNK_SIZE", defaultValue=32)))
+        renewMode = CertsUtils.RenewMode({"renewMode": req.args.get("renewMode")})
+
+        # everything shared by the configs is retrieved (or generated) before the first byte is sent
+        app = g_theApi.app
+        caCert, _ = CertsUtils.GetCaCertAndKey(app, orgId)
+        tlsKey = CertsUtils.GetSrvExtraInfo(app, srvId)
+        usersQuery = EntityDbModel.query.join(EntityOrgBindings, EntityOrgBindings.entityId == EntityDbModel.id).filter(
+            EntityOrgBindings.orgId == orgId, EntityDbModel.typeId == EntityTypeEnum.user)
+        if len(entityIds):
+            usersQuery = usersQuery.filter(EntityDbModel.id.in_(entityIds))
+            # the whole input is validated before streaming, since the errors can't be reported afterwards
+            boundUserIds = {userId for userId, in usersQuery.with_entities(EntityDbModel.id).all()}
+            invalidEntityIds = [entityId for entityId in entityIds if entityId not in boundUserIds]
+            if len(invalidEntityIds):
+                abort(400, f"Entities {', '.join(map(str, invalidEntityIds))} aren't users of {org.PrettyRepr()}")
+
+        def UsersChunks(): # keyset iteration, so that only a chunk of users is loaded at once
+            lastId = 0
+            while True:
+                users = usersQuery.filter(EntityDbModel.id > lastId).order_by(EntityDbModel.id).limit(chunkSize).all()
+                if len(users) == 0:
+                    break
+                yield users
+                lastId = users[-1].id
+
+        def EntriesGroups():
+            try:
+                yield from UsersEntriesGroups()
+            except Exception as e: # the archive is left unterminated, so the truncated download is detectable
+                print(f"Error exporting the client configs of {org.PrettyRepr()} - {e}")
+                raise
+
+        def UsersEntriesGroups():
+            for users in UsersChunks():
+                certs = CertsUtils.BatchGetCertsAndKeys(app, org, users, {"renewMode": renewMode})
+                entries = []
+                for user in users:
+                    certObj, _ = certs[user.id]
+                    configTemplate = configTemplateClass({
+                        **configVars,
+                        "entityName": user.name,
+                        "caCert": caCert,
+                        "cert": certObj.cert,
+                        "key": certObj.key,
+                        "tlsKey": tlsKey
+                    })
+                    userEntries = configTemplate.ArchiveEntries()
+                    if len(userEntries) > 1: # multi-file configs get their own directory
+                        userDir = configTemplate.BaseName()
+                        entries += [(userDir, None, 0o755)] + [(f"{userDir}/{name}", data, mode)
+                                                              for name, data, mode in userEntries]
+                    else:
+                        entries += userEntries
+                yield entries
+
+        archiveName = f"liny-ovpn-{configVars['os']}-{org.name.replace(' ', '_')}-client-confs." \
+                      f"{CertsUtils.g_archiveCompressions[configVars['compression']]}"
+        response = flask.Response(flask.stream_with_context(CertsUtils.StreamConfigEntries(
+            EntriesGroups(), configVars["compression"], configVars["compressionLevel"])),
+            mimetype="application/octet-stream")
+        response.headers["Content-Disposition"] = f'attachment; filename="{archiveName}"'
+        response.headers["Cache-Control"] = "no-store"
+        return response
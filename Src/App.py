@@ -20,20 +20,25 @@ class OpenvpnRestApiApp(Flask):
         self.m_tmpDir = None
         db.init_app(self) #register the app with the database
 
-        # set the foreign_keys PRAGMA for activating foreign keys checks and to enable cascade delete and updates for parent tables
+        # set the foreign_keys PRAGMA for activating foreign keys checks and to enable cascade delete and updates for parent tables,
+        # along with the SQLite performance profile (WAL journal, busy timeout, mmap etc. - see SQLITE_* settings)
         # although not a singleton the app object is instantiated only once
         from sqlalchemy import event
 
-        @event.listens_for(db.get_engine(self), "connect")
-        def SetSqlitePragma(dbapi_connection, connection_record):
-            cursor = dbapi_connection.cursor()
-            cursor.execute("PRAGMA foreign_keys=ON")
-            cursor.close()
+        engine = db.get_engine(self)
+        if engine.dialect.name == "sqlite":
+            from Database.Sqlite import SqlitePragmas, ExecutePragmas
+
+            sqlitePragmas = SqlitePragmas()
+
+            @event.listens_for(engine, "connect")
+            def SetSqlitePragma(dbapi_connection, connection_record):
+                ExecutePragmas(dbapi_connection, sqlitePragmas)
 
         api.init_app(self)
         self._ParseArgs()
         if not self.m_args.reset_db and not self.m_args.show_certs_fingerprints and \
-                not self.m_args.init_certs:
+                not self.m_args.init_certs and not self.m_args.migrate and not self.m_args.renew_expiring:
             if self.config["USER_IDS"] is None:
                 raise RuntimeError(
                     "User id(s) is/are not set. They're fundametally needed, for proper JWT authorization")
@@ -41,6 +46,9 @@ class OpenvpnRestApiApp(Flask):
                 self.InitCerts() #might throw, in case an invalid certs configuration is found
             self.InitTmpDir()  # thoroughly init the m_tmpDir
             self._InitDb()
+            self.InitKeysPool()
+            self.InitRenewalScheduler()
+            self.PreloadConfigTemplates()
             CORS(self, origins = self.config["ALLOWED_ORIGINS"], expose_headers=["Content-Disposition"])
 
     def _ConfigInit(self):
@@ -59,10 +67,8 @@ class OpenvpnRestApiApp(Flask):
         if type(self.config["USER_IDS"]) is str:
             self.config["USER_IDS"] = [userId.strip() for userId in self.config["USER_IDS"].split(",")]
         self.config['SQLALCHEMY_DATABASE_URI'] = EnvOrSetting("DB_URL", "SQLALCHEMY_DATABASE_URI",
-                                                              'sqlite:///../db.sqlite') + \
-            ( "?check_same_thread=False"
-                if not EnvOrSetting("SQLALCHEMY_CHECK_SAME_THREAD", "SQLALCHEMY_CHECK_SAME_THREAD", True)
-                else "" )
+                                                              'sqlite:///../db.sqlite')
+        self.config['SQLALCHEMY_ENGINE_OPTIONS'] = self._EngineOptions(self.config['SQLALCHEMY_DATABASE_URI'])
         self.config['SQLALCHEMY_ECHO'] = EnvOrSetting("SQLALCHEMY_ECHO")
         self.config['SQLALCHEMY_RECORD_QUERIES'] = EnvOrSetting("SQLALCHEMY_RECORD_QUERIES")
         self.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = EnvOrSetting("SQLALCHEMY_TRACK_MODIFICATIONS")
@@ -72,12 +78,41 @@ class OpenvpnRestApiApp(Flask):
         self.config['RESTPLUS_MASK_SWAGGER'] = EnvOrSetting("REST_MASK_SWAGGER")
         self.config['ERROR_404_HELP'] = EnvOrSetting("REST_ERROR_404_HELP")
 
+    @staticmethod
+    def _EngineOptions(dbUrl):
+        """
+            Builds the SQLAlchemy engine options for the db url's dialect: the SQLite connections may be shared across
+            threads (see SQLALCHEMY_CHECK_SAME_THREAD setting), while for the client/server dbs (e.g. PostgreSQL) the
+            connections pool is configured through the DB_POOL_* settings
+
+        :param dbUrl: the db url
+        :return: the engine options dictionary
+        """
+        from sqlalchemy.engine.url import make_url
+
+        if make_url(dbUrl).get_backend_name() == "sqlite":
+            return {
+                "connect_args": {"check_same_thread": False}
+            } if not EnvOrSetting("SQLALCHEMY_CHECK_SAME_THREAD", "SQLALCHEMY_CHECK_SAME_THREAD", True) else {}
+        return {
+            "pool_size": int(EnvOrSetting("DB_POOL_SIZE", defaultValue=5)),
+            "max_overflow": int(EnvOrSetting("DB_POOL_MAX_OVERFLOW", defaultValue=10)),
+            "pool_timeout": int(EnvOrSetting("DB_POOL_TIMEOUT", defaultValue=30)),
+            "pool_recycle": int(EnvOrSetting("DB_POOL_RECYCLE", defaultValue=1800)),
+            "pool_pre_ping": str(EnvOrSetting("DB_POOL_PRE_PING", defaultValue=True)).lower() in ["1", "on", "true"]
+        }
+
     def _ParseArgs(self):
         self.m_argParser = argparse.ArgumentParser(description="Management rest api")
         self.m_argParser.add_argument("--reset-db", action="store_true", help="resets the sqlite database and exits")
+        self.m_argParser.add_argument("--migrate", action="store_true", help="applies the pending database migrations "
+                                                                              "and exits")
         self.m_argParser.add_argument("--init-certs", action="store_true",
                                       help="just generate the host's CA and ssl cert and key, if necessary, needed for "
                                            "exposing the service over https")
+        self.m_argParser.add_argument("--renew-expiring", action="store_true",
+                                      help="renews the certificates and CAs expiring within RENEWAL_HORIZON days and "
+                                           "exits")
         self.m_argParser.add_argument("--show-certs-fingerprints", action="store_true", help="shows the host cert and CA "
                                                                                           "certs' fingerprints")
         self.m_args = self.m_argParser.parse_args()
@@ -87,9 +122,14 @@ class OpenvpnRestApiApp(Flask):
             self.InitCerts()
         if self.m_args.reset_db:
             self._ResetDb()
+        if self.m_args.migrate:
+            self._MigrateDb()
+        if self.m_args.renew_expiring:
+            self.RenewExpiring()
         if self.m_args.show_certs_fingerprints:
             self.ShowCertsFingerprints()
-        if not self.m_args.reset_db and not self.m_args.show_certs_fingerprints and not self.m_args.init_certs:
+        if not self.m_args.reset_db and not self.m_args.show_certs_fingerprints and not self.m_args.init_certs and \
+                not self.m_args.migrate and not self.m_args.renew_expiring:
             #it's super important to just call the parent's run method here, since this method isn't called  by uWSGI
             super().run(debug=EnvOrSetting("FLASK_DEBUG", defaultValue=False),
                         use_reloader=EnvOrSetting("FLASK_RELOADER", defaultValue=False),
@@ -107,19 +147,85 @@ class OpenvpnRestApiApp(Flask):
             self.m_db.drop_all()
         self._InitDb()
 
-    def _InitDb(self):
+    def _MigrateDb(self):
+        print("Migrating database ...")
+        self._InitDb({"migrate": True, "verbose": True})
+
+    def _InitDb(self, configArg=None):
+        config = {
+            "migrate": str(EnvOrSetting("DB_MIGRATE_AT_STARTUP", defaultValue=True)).lower() in ["1", "on", "true"],
+            "verbose": False,
+            **(configArg if type(configArg) is dict else {})
+        }
         with self.app_context():
             self.m_db.create_all()
+            from Database.Migrations import Migrate, PendingMigrations
+            if config["migrate"]:
+                Migrate(self.m_db, config)
+            else:
+                pendingMigrations = PendingMigrations(self.m_db)
+                if len(pendingMigrations):
+                    print(f"Warning: {len(pendingMigrations)} pending database migration(s). Run with --migrate")
 
             #add entities types records
             from Database.Models import EntityTypeEnum, EntityTypeDbModel
             if EntityTypeDbModel.query.count() == 0:
+                from sqlalchemy.exc import IntegrityError
+                from Database.Errors import IntegrityErrorKind
+
                 for entityType in EntityTypeEnum:
                     entityTypeDbRec = EntityTypeDbModel()
                     entityTypeDbRec.id = entityType.value
                     entityTypeDbRec.name = entityType.name
                     self.m_db.session.add(entityTypeDbRec)
-                self.m_db.session.commit()
+                try:
+                    self.m_db.session.commit()
+                except IntegrityError as e: # another node/process initialized the shared db in the meantime
+                    self.m_db.session.rollback()
+                    if IntegrityErrorKind(e) != "unique":
+                        raise
+            # the pooled connections must not be shared with the (forked) uWSGI workers
+            self.m_db.get_engine(self).dispose()
+
+    def InitKeysPool(self):
+        from Utils.KeysPool import GetKeysPool
+
+        # the pool's refill worker (if the pool is enabled) opens db connections and forks the PKI executor, so it's
+        # started by the serving processes, on their first request, rather than by the (uWSGI master) process
+        # initializing the app
+        @self.before_request
+        def StartKeysPool():
+            GetKeysPool(self)
+
+    def InitRenewalScheduler(self):
+        from Utils.RenewalScheduler import GetRenewalScheduler
+
+        # likewise, the scheduler's worker is started by the serving processes, on their first request
+        @self.before_request
+        def StartRenewalScheduler():
+            GetRenewalScheduler(self)
+
+    def RenewExpiring(self):
+        from Utils.RenewalScheduler import RenewalScheduler
+
+        self._InitDb()
+        try:  # lower the priority of the process and of its PKI executor's processes (forked later)
+            os.nice(int(EnvOrSetting("RENEWAL_NICE", defaultValue=10)))
+        except (OSError, AttributeError) as e:
+            print("Warning: lowering the process priority failed - " + str(e))
+        print("Renewing the expiring certificates ...")
+        with self.app_context():
+            renewed = RenewalScheduler(self).Scan()
+        if renewed is None:
+            print("Another process is renewing the expiring certificates")
+        else:
+            print(f"Renewed {renewed['cas']} CA(s) and {renewed['certs']} certificate(s)")
+
+    @staticmethod
+    def PreloadConfigTemplates():
+        from Api.OvpnConfigTemplates import g_ovpnConfigTemplates
+        for configTemplateEntry in g_ovpnConfigTemplates:
+            configTemplateEntry["classObj"] #loads the template's module, along with its skeleton files
 
     def InitTmpDir(self):
         if EnvOrSetting("FLASK_CLEAN_TMP_BASE_AT_STARTUP", defaultValue=False):
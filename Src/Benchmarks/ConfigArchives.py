@@ -0,0 +1,83 @@
+"""
+    Benchmarks the config archives' compression codecs: the CPU time and the size of a server config archive, for each
+    codec and level. Run it from the Src directory:
+
+        python Benchmarks/ConfigArchives.py [--iterations N]
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+from importlib.util import find_spec
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+
+def ServerConfigVars():
+    from ipaddress import IPv4Network
+    from Utils import PkiJobs
+
+    caKey = PkiJobs.GenerateKeyJob()
+    validFrom = datetime.datetime.utcnow()
+    caCert = PkiJobs.SignCaJob(caKey, {
+        "CA": {"commonName": "Benchmark CA", "orgName": "Benchmark"},
+        "caValidFrom": validFrom,
+        "caValidity": 365
+    })
+    key = PkiJobs.GenerateKeyJob()
+    return {
+        "os": "linux",
+        "srvHost": "localhost",
+        "ports": [1194, 443],
+        "protos": ["udp", "tcp"],
+        "nets": [IPv4Network("10.113.0.0/24"), IPv4Network("10.113.1.0/24")],
+        "entityName": "srv",
+        "caCert": caCert,
+        "caKey": caKey,
+        "cert": PkiJobs.SignCertJob(caCert, caKey, key, {
+            "srvType": True,
+            "validFrom": validFrom,
+            "validity": 365,
+            "serialNo": 1,
+            "entity": {"name": "srv"},
+            "org": {"name": "Benchmark"}
+        }),
+        "key": key,
+        "tlsKey": os.urandom(256).hex().encode(), #the tls key's size, roughly
+        "crl": PkiJobs.SignCrlJob(caCert, caKey, range(1, 100), validFrom, validFrom + datetime.timedelta(days=3650))
+    }
+
+
+def main():
+    argParser = argparse.ArgumentParser(description="Config archives compression benchmark")
+    argParser.add_argument("--iterations", type=int, default=50, help="the archives number built for each codec")
+    args = argParser.parse_args()
+
+    from Api.OvpnConfigTemplates.Server.InternetAccess import ConfigTemplate
+    from Utils.CertsUtils import g_archiveCompressions
+
+    configVars = ServerConfigVars()
+    codecs = [("xz", None), ("xz", 1), ("gz", None), ("gz", 1), ("tar", None)]
+    if find_spec("zstandard") is not None:
+        codecs += [("zst", None), ("zst", 1)]
+    else:
+        print("zstandard package is missing. Skipping zst")
+    print(f"{'codec':<8}{'level':<8}{'CPU ms/archive':>16}{'size (bytes)':>14}")
+    for compression, compressionLevel in codecs:
+        assert compression in g_archiveCompressions
+        configTemplate = ConfigTemplate({
+            **configVars,
+            "compression": compression,
+            "compressionLevel": compressionLevel
+        })
+        startTime = time.process_time()
+        for _ in range(args.iterations):
+            archive, _ = configTemplate.Instantiate()
+        cpuTime = (time.process_time() - startTime) / args.iterations
+        print(f"{compression:<8}{'default' if compressionLevel is None else compressionLevel:<8}"
+              f"{cpuTime * 1000:>16.2f}{len(archive.getvalue()):>14}")
+
+
+if __name__ == "__main__":
+    main()
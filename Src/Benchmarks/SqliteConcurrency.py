@@ -0,0 +1,148 @@
+"""
+    Benchmarks the SQLite profiles under concurrent load: several reader processes (the uWSGI workers serving the
+    certificates listings) query the certificates table while a writer process stores batches of issued certificates,
+    as the batch issuance and the keys pool refill do. For each profile it reports the reads throughput, the reads
+    latency and the "database is locked" errors. Run it from the Src directory:
+
+        python Benchmarks/SqliteConcurrency.py [--readers N] [--duration SECONDS] [--batch N]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+#the profile before tuning (just the foreign keys) versus the settings' profile
+g_profiles = {
+    "rollback journal": {
+        "SQLITE_JOURNAL_MODE": "DELETE",
+        "SQLITE_SYNCHRONOUS": "FULL",
+        "SQLITE_BUSY_TIMEOUT": None,
+        "SQLITE_MMAP_SIZE": None,
+        "SQLITE_CACHE_SIZE": None,
+        "SQLITE_TEMP_STORE": None
+    },
+    "settings (WAL)": {}
+}
+g_fakePem = b"-----BEGIN CERTIFICATE-----\n" + b"A" * 1600 + b"\n-----END CERTIFICATE-----\n"
+
+
+def Engine(dbPath, profile):
+    from sqlalchemy import create_engine, event
+    from Database.Sqlite import SqlitePragmas, ExecutePragmas
+
+    # pysqlite waits 5 seconds for the locks by default, regardless of the busy_timeout PRAGMA
+    engine = create_engine(f"sqlite:///{dbPath}", connect_args={"timeout": 5})
+    pragmas = SqlitePragmas(profile)
+    event.listen(engine, "connect", lambda dbapiConnection, connectionRecord: ExecutePragmas(dbapiConnection, pragmas))
+    return engine
+
+
+def InitDb(dbPath, entitiesNo):
+    from sqlalchemy import create_engine
+    from Database.Models import db, OrgDbModel, CasDbModel, CertsDbModel
+
+    engine = create_engine(f"sqlite:///{dbPath}")
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(OrgDbModel.__table__.insert(), {"id": 1, "name": "Benchmark", "country": "RO"})
+        conn.execute(CasDbModel.__table__.insert(), {"orgId": 1, "cert": g_fakePem, "key": g_fakePem})
+        conn.execute(CertsDbModel.__table__.insert(), [
+            {"entityId": entityId, "orgId": 1, "srvType": False, "revoked": False, "cert": g_fakePem, "key": g_fakePem}
+            for entityId in range(1, entitiesNo + 1)
+        ])
+    engine.dispose()
+
+
+def Reader(dbPath, profile, stopAt, results):
+    from sqlalchemy import text
+
+    engine = Engine(dbPath, profile)
+    latencies = []
+    lockedErrors = 0
+    while time.time() < stopAt:
+        startTime = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT id, entityId, orgId, srvType, revoked FROM certs c WHERE NOT EXISTS ("
+                                  "SELECT 1 FROM certs n WHERE n.entityId = c.entityId AND n.orgId = c.orgId AND "
+                                  "n.srvType = c.srvType AND n.id > c.id) ORDER BY id LIMIT 100")).fetchall()
+            latencies.append(time.perf_counter() - startTime)
+        except Exception as e:
+            if "locked" not in str(e):
+                raise
+            lockedErrors += 1
+    results.put((latencies, lockedErrors))
+
+
+def Writer(dbPath, profile, stopAt, batchSize, entitiesNo, results):
+    from Database.Models import CertsDbModel
+
+    engine = Engine(dbPath, profile)
+    batchesNo = 0
+    lockedErrors = 0
+    while time.time() < stopAt:
+        try:
+            with engine.begin() as conn:
+                conn.execute(CertsDbModel.__table__.insert(), [
+                    {"entityId": (batchesNo * batchSize + idx) % entitiesNo + 1, "orgId": 1, "srvType": False,
+                     "revoked": False, "cert": g_fakePem, "key": g_fakePem} for idx in range(batchSize)
+                ])
+            batchesNo += 1
+        except Exception as e:
+            if "locked" not in str(e):
+                raise
+            lockedErrors += 1
+    results.put((batchesNo, lockedErrors))
+
+
+def RunProfile(profileName, profile, args):
+    with tempfile.TemporaryDirectory() as tmpDir:
+        dbPath = os.path.join(tmpDir, "benchmark.sqlite")
+        InitDb(dbPath, args.entities)
+        readersResults = multiprocessing.Queue()
+        writerResults = multiprocessing.Queue()
+        stopAt = time.time() + args.duration
+        processes = [multiprocessing.Process(target=Reader, args=(dbPath, profile, stopAt, readersResults))
+                     for _ in range(args.readers)]
+        processes.append(multiprocessing.Process(target=Writer, args=(dbPath, profile, stopAt, args.batch,
+                                                                      args.entities, writerResults)))
+        for process in processes:
+            process.start()
+        readersStats = [readersResults.get() for _ in range(args.readers)]
+        writtenBatches, writerLockedErrors = writerResults.get()
+        for process in processes:
+            process.join()
+
+    latencies = sorted(latency for readerLatencies, _ in readersStats for latency in readerLatencies)
+    readsNo = len(latencies)
+
+    def Percentile(percent):
+        return latencies[min(readsNo - 1, int(readsNo * percent / 100))] * 1000 if readsNo else float("nan")
+
+    print(f"{profileName:<18}{readsNo / args.duration:>10.0f}{Percentile(50):>10.2f}{Percentile(99):>10.2f}"
+          f"{(latencies[-1] * 1000 if readsNo else float('nan')):>10.2f}"
+          f"{sum(lockedErrors for _, lockedErrors in readersStats):>10}{writtenBatches:>10}{writerLockedErrors:>10}")
+
+
+def main():
+    argParser = argparse.ArgumentParser(description="SQLite profiles concurrency benchmark")
+    argParser.add_argument("--readers", type=int, default=7, help="the reader processes number")
+    argParser.add_argument("--duration", type=float, default=10, help="the duration of each profile's run, in seconds")
+    argParser.add_argument("--batch", type=int, default=500, help="the certificates stored by a write transaction")
+    argParser.add_argument("--entities", type=int, default=2000, help="the initial certificates number")
+    args = argParser.parse_args()
+
+    print(f"{args.readers} readers, 1 writer storing {args.batch} certificates per transaction, {args.duration}s per "
+          f"profile")
+    print(f"{'profile':<18}{'reads/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'locked':>10}{'batches':>10}"
+          f"{'w locked':>10}")
+    for profileName, profile in g_profiles.items():
+        RunProfile(profileName, profile, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+from sqlalchemy.exc import IntegrityError
+
+#the SQLSTATE integrity constraint violation codes (PostgreSQL and other standard compliant dbs)
+g_sqlStateKinds = {
+    "23505": "unique",
+    "23503": "foreignKey",
+    "23502": "notNull",
+    "23514": "check"
+}
+#the SQLite error messages' prefixes
+g_sqliteMessageKinds = {
+    "UNIQUE constraint failed": "unique",
+    "FOREIGN KEY constraint failed": "foreignKey",
+    "NOT NULL constraint failed": "notNull",
+    "CHECK constraint failed": "check"
+}
+#the MySQL error codes
+g_mysqlErrorCodeKinds = {
+    1062: "unique",
+    1451: "foreignKey",
+    1452: "foreignKey",
+    1048: "notNull",
+    3819: "check"
+}
+
+
+def IntegrityErrorKind(e: IntegrityError):
+    """
+        Maps an integrity error to the violated constraint kind, regardless of the db dialect (the drivers report the
+        violations differently: SQLSTATE codes, error codes or just messages)
+
+    :param e: the SQLAlchemy integrity error
+    :return: "unique", "foreignKey", "notNull", "check" or None if the violation kind is unknown
+    """
+    origError = e.orig
+    sqlState = getattr(origError, "pgcode", None) or getattr(origError, "sqlstate", None) #psycopg2 or psycopg 3
+    if sqlState is not None:
+        return g_sqlStateKinds.get(sqlState)
+    origArgs = getattr(origError, "args", ())
+    if len(origArgs) and type(origArgs[0]) is int: #MySQL drivers: (errorCode, message)
+        return g_mysqlErrorCodeKinds.get(origArgs[0])
+    message = str(origError)
+    for messagePrefix, kind in g_sqliteMessageKinds.items():
+        if message.startswith(messagePrefix):
+            return kind
+    return None
@@ -0,0 +1,10 @@
+"""
+    Adds the certificates' metadata columns (serial, notBefore, notAfter, subjectCN, fingerprint) along with the
+    certificates' lookup indexes and fills the metadata of the certificates issued before they existed
+"""
+from Database.Migrations import UpgradeSchema, BackfillCertsMetadata
+
+
+def Upgrade(db):
+    UpgradeSchema(db, ["certs"])
+    BackfillCertsMetadata(db)
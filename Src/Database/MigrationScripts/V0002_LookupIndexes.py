@@ -0,0 +1,9 @@
+"""
+    Adds the indexes of the hot lookups: the org's certificates (by type) and the org's entities. The entity's
+    certificates lookups are served by the leading column of the ix_certs_entityId_orgId_srvType_id index
+"""
+from Database.Migrations import CreateIndexes
+
+
+def Upgrade(db):
+    CreateIndexes(db, ["ix_certs_orgId_srvType", "ix_entityOrgBindings_orgId_entityId"])
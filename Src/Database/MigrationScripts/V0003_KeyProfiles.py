@@ -0,0 +1,9 @@
+"""
+    Adds the key profile of the CAs and of the pooled keys and fills it for the existing ones
+"""
+from Database.Migrations import UpgradeSchema, BackfillKeyProfiles
+
+
+def Upgrade(db):
+    UpgradeSchema(db, ["cas", "keysPool"])
+    BackfillKeyProfiles(db)
@@ -0,0 +1,2 @@
+#the versioned schema migrations, applied by Database.Migrations.Migrate. Each module is named V<version>_<Name>.py
+# (i.e. V0003_AddCertsProfile.py), defines an idempotent Upgrade(db) function and must never change once released
@@ -0,0 +1,156 @@
+from sqlalchemy import inspect
+
+
+def Migrate(db, configArg=None):
+    """
+        Applies the pending schema migrations, in their version order. The migrations are the Database.MigrationScripts
+        package's modules named V<version>_<Name>.py, each defining an Upgrade(db) function. The applied versions are
+        recorded in the schemaMigrations table, so each migration runs once. The missing tables are created (by
+        db.create_all()) before migrating, so the migrations have to be idempotent: a fresh db already has the current
+        models' columns and indexes
+
+    :param db: the flask_sqlalchemy db object
+    :param configArg: config. "verbose" - if True then the applied migrations are printed
+    :return: the applied migrations' versions
+    """
+    import datetime
+    from sqlalchemy.exc import IntegrityError
+    from Database.Errors import IntegrityErrorKind
+    from Database.Models import SchemaMigrationsDbModel
+
+    config = {
+        "verbose": False,
+        **(configArg if type(configArg) is dict else {})
+    }
+    appliedVersions = []
+    for version, name, upgradeFn in PendingMigrations(db):
+        if config["verbose"]:
+            print(f"Applying migration {version} - {name} ...")
+        upgradeFn(db)
+        db.session.add(SchemaMigrationsDbModel(version=version, name=name, appliedAt=datetime.datetime.utcnow()))
+        try:
+            db.session.commit()
+        except IntegrityError as e: # another node/process applied the same (idempotent) migration in the meantime
+            db.session.rollback()
+            if IntegrityErrorKind(e) != "unique":
+                raise
+        appliedVersions.append(version)
+    return appliedVersions
+
+
+def Migrations() -> list:
+    """
+        Discovers the migration scripts
+
+    :return: the (version, name, upgrade function) tuples list, sorted by version
+    """
+    import importlib
+    import pkgutil
+    import re
+    from Database import MigrationScripts
+
+    migrations = []
+    for moduleInfo in pkgutil.iter_modules(MigrationScripts.__path__):
+        match = re.fullmatch(r"V(\d+)_(\w+)", moduleInfo.name)
+        if match is None:
+            continue
+        module = importlib.import_module(f"{MigrationScripts.__name__}.{moduleInfo.name}")
+        migrations.append((int(match.group(1)), match.group(2), module.Upgrade))
+    migrations.sort(key=lambda migration: migration[0])
+    versions = [migration[0] for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"Duplicate migration versions - {versions}")
+    return migrations
+
+
+def PendingMigrations(db) -> list:
+    """
+        Retrieves the migrations not applied yet
+
+    :param db: the flask_sqlalchemy db object
+    :return: the pending (version, name, upgrade function) tuples list, sorted by version
+    """
+    from Database.Models import SchemaMigrationsDbModel
+
+    appliedVersions = {row.version for row in SchemaMigrationsDbModel.query.with_entities(
+        SchemaMigrationsDbModel.version)}
+    return [migration for migration in Migrations() if migration[0] not in appliedVersions]
+
+
+def UpgradeSchema(db, tablesNames=None):
+    """
+        Upgrades the existing tables to the current models, without dropping any data: adds the missing columns (which
+        must be nullable or have a server default) and creates the missing indexes. The missing tables are created by
+        db.create_all()
+
+    :param db: the flask_sqlalchemy db object
+    :param tablesNames: the names of the tables to be upgraded. If None, all the tables are upgraded
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existingTables = inspector.get_table_names()
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existingTables or (tablesNames is not None and table.name not in tablesNames):
+                continue
+            existingColumns = [column["name"] for column in inspector.get_columns(table.name)]
+            for column in table.columns:
+                if column.name not in existingColumns:
+                    conn.exec_driver_sql(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} "
+                                         f"{column.type.compile(dialect=engine.dialect)}")
+            existingIndexes = [index["name"] for index in inspector.get_indexes(table.name)]
+            for index in table.indexes:
+                if index.name not in existingIndexes:
+                    index.create(conn)
+
+
+def CreateIndexes(db, indexesNames):
+    """
+        Creates the given models' indexes, if missing
+
+    :param db: the flask_sqlalchemy db object
+    :param indexesNames: the indexes names, as declared by the models
+    """
+    indexes = {index.name: index for table in db.metadata.sorted_tables for index in table.indexes}
+    with db.engine.begin() as conn:
+        for indexName in indexesNames:
+            indexes[indexName].create(conn, checkfirst=True)
+
+
+def BackfillCertsMetadata(db):
+    """
+        Fills the certificates' metadata columns for the certificates issued before they existed. Subsequent runs only
+        query the certificates without metadata
+
+    :param db: the flask_sqlalchemy db object
+    """
+    from Database.Models import CertsDbModel
+    from Utils.CertsUtils import CertMetadata
+
+    for certObj in CertsDbModel.query.filter(CertsDbModel.notAfter.is_(None)):
+        try:
+            certMetadata = CertMetadata(certObj.cert)
+        except Exception:  # invalid certificate. Its state will be reported as invalid
+            continue
+        for name, value in certMetadata.items():
+            setattr(certObj, name, value)
+    db.session.commit()
+
+
+def BackfillKeyProfiles(db):
+    """
+        Fills the key profile of the CAs and of the pooled keys created before the key profiles existed. The CAs' profiles
+        are read from their certificates, while the pooled keys were all RSA-4096 ones
+
+    :param db: the flask_sqlalchemy db object
+    """
+    from Database.Models import CasDbModel, KeysPoolDbModel
+    from Utils.CertsUtils import CaKeyProfile
+
+    for caObj in CasDbModel.query.filter(CasDbModel.keyProfile.is_(None)):
+        caObj.keyProfile = CaKeyProfile(caObj.cert)
+    KeysPoolDbModel.query.filter(KeysPoolDbModel.keyProfile.is_(None)).update({
+        "keyProfile": "rsa-4096"
+    }, synchronize_session=False)
+    db.session.commit()
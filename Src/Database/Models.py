@@ -91,7 +91,8 @@ class EntityOrgBindings(db.Model):
     entityId = db.Column(db.Integer, db.ForeignKey("entities.id", ondelete="CASCADE", onupdate="CASCADE"), primary_key=True)
     orgId = db.Column(db.Integer, db.ForeignKey("orgs.id", ondelete="CASCADE", onupdate="CASCADE"), primary_key=True)
 
-    __table_args__ = (UniqueConstraint("entityId", "orgId"),)  # the <entityId>-<orgId> pair must be unique
+    __table_args__ = (UniqueConstraint("entityId", "orgId"),  # the <entityId>-<orgId> pair must be unique
+                      db.Index("ix_entityOrgBindings_orgId_entityId", "orgId", "entityId"))  # the org's entities lookups
 
 #model for PKI CA table
 class CasDbModel(db.Model):
@@ -99,8 +100,9 @@ class CasDbModel(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     orgId = db.Column(db.Integer, db.ForeignKey('orgs.id', ondelete="CASCADE", onupdate="CASCADE"), unique=True,
                       nullable=False) #the org id is stored, for knowing for which org this CA was generated
-    cert = db.Column(db.String, nullable=False) #PEM format
-    key = db.Column(db.String, nullable=False) #PEM format
+    keyProfile = db.Column(db.String) #the CA's and its certificates' key profile (see Utils.PkiJobs.g_keyProfiles)
+    cert = db.Column(db.LargeBinary, nullable=False) #PEM format
+    key = db.Column(db.LargeBinary, nullable=False) #PEM format
     # certs = db.relationship("CertsDbModel", lazy="dynamic", backref="ca", passive_deletes=True) #Todo: enable it if needed
 
     def __repr__(self):
@@ -109,13 +111,24 @@ class CasDbModel(db.Model):
 #PKI Certs table for both users and servers
 class CertsDbModel(db.Model):
     __tablename__ = "certs" # users and servers certificates
-    id = db.Column(db.Integer, primary_key=True, autoincrement=True) # it's also the certificate's serial number
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     entityId = db.Column(db.Integer, nullable=False)
     orgId = db.Column(db.Integer, db.ForeignKey('cas.orgId', ondelete="CASCADE", onupdate="CASCADE"), nullable=False) #useful for easy regenerating the certificate
     srvType = db.Column(db.Boolean) #true if the certificate identifies a server rather than an user
     revoked = db.Column(db.Boolean, default=False) # true if the certificate is revoked and false otherwise
-    cert = db.Column(db.String, nullable=False)
-    key = db.Column(db.String, nullable=False)
+    cert = db.Column(db.LargeBinary, nullable=False)
+    key = db.Column(db.LargeBinary, nullable=False)
+    #certificate's metadata, stored at issuance for avoiding parsing the certificate (see Utils.CertsUtils.CertMetadata)
+    serial = db.Column(db.String) #the serial number, as decimal string
+    notBefore = db.Column(db.DateTime)
+    notAfter = db.Column(db.DateTime, index=True)
+    subjectCN = db.Column(db.String)
+    fingerprint = db.Column(db.String) #SHA1 fingerprint
+
+    #the first index is used for both the entity's certificates lookups and for finding the last certificate of each
+    # entity - org - type. The second one for the org's certificates lookups (i.e. the CRLs and the filtered listings)
+    __table_args__ = (db.Index("ix_certs_entityId_orgId_srvType_id", "entityId", "orgId", "srvType", "id"),
+                      db.Index("ix_certs_orgId_srvType", "orgId", "srvType"))
 
     def __repr__(self):
         return f"Id: {self.id}, EntityId: {self.entityId}, orgId: {self.orgId}, Server type:{self.srvType}, " \
@@ -128,7 +141,63 @@ class ServersExtraInfoDbModel(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     srvId = db.Column(db.Integer, db.ForeignKey('entities.id', ondelete="CASCADE", onupdate="CASCADE"), nullable=False,
                       unique=True) #must be an entity id, with type server
-    tlsKey = db.Column(db.String, nullable=False) # openvpn's tls crypt key. See openvpn's "--tls-crypt file" option
+    tlsKey = db.Column(db.LargeBinary, nullable=False) # openvpn's tls crypt key. See openvpn's "--tls-crypt file" option
 
     def __repr__(self):
         return f"Id: {self.id}, ServerId: {self.srvId}"
+
+#pool of pre-generated private keys. The keys are drawn when certificates are issued and the pool is refilled by a
+# background worker (see Utils.KeysPool)
+class KeysPoolDbModel(db.Model):
+    __tablename__ = "keysPool"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    keyProfile = db.Column(db.String) #see Utils.PkiJobs.g_keyProfiles
+    key = db.Column(db.LargeBinary, nullable=False) #PEM format, PKCS8 encrypted
+
+    def __repr__(self):
+        return f"Id: {self.id}"
+
+#cached CRLs, one per organization. The revocation version gets incremented on each revocation change (see
+# Utils.CertsUtils.InvalidateCRLs), so the cached CRL is rebuilt only if it was built for an older revocation version
+class CrlsDbModel(db.Model):
+    __tablename__ = "crls"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    orgId = db.Column(db.Integer, db.ForeignKey('cas.orgId', ondelete="CASCADE", onupdate="CASCADE"), unique=True,
+                      nullable=False)
+    revocationVersion = db.Column(db.Integer, nullable=False, default=0)
+    crlRevocationVersion = db.Column(db.Integer) #the revocation version for which the cached CRL was built
+    crl = db.Column(db.LargeBinary) #PEM format
+
+    def __repr__(self):
+        return f"Id: {self.id}, OrgId: {self.orgId}, Revocation version: {self.revocationVersion}"
+
+#the serial numbers sequences. The processes reserve ranges of serial numbers by advancing nextSerial (see
+# Utils.SerialsAllocator)
+class SerialsDbModel(db.Model):
+    __tablename__ = "serials"
+    name = db.Column(db.String, primary_key=True) #the sequence name
+    nextSerial = db.Column(db.BigInteger, nullable=False) #the first serial number not reserved yet
+
+    def __repr__(self):
+        return f"Name: {self.name}, Next serial: {self.nextSerial}"
+
+#the cross process leases, held while generating something (a CA, a certificate, a TLS key) or while running a
+# background job, so that the other processes wait for it rather than duplicate it (see Utils.Leases)
+class LeasesDbModel(db.Model):
+    __tablename__ = "leases"
+    name = db.Column(db.String, primary_key=True) #the leased resource, e.g. "ca:<orgId>"
+    owner = db.Column(db.String, nullable=False) #the holder's unique id
+    expiresAt = db.Column(db.DateTime, nullable=False) #UTC. Past it the lease can be taken over
+
+    def __repr__(self):
+        return f"Name: {self.name}, Owner: {self.owner}, Expires at: {self.expiresAt}"
+
+#the applied schema migrations (see Database.Migrations)
+class SchemaMigrationsDbModel(db.Model):
+    __tablename__ = "schemaMigrations"
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String, nullable=False)
+    appliedAt = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"Version: {self.version}, Name: {self.name}, Applied at: {self.appliedAt}"
@@ -0,0 +1,67 @@
+from Utils.SettingsUtils import EnvOrSetting
+
+g_journalModes = ["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"]
+g_synchronousModes = ["OFF", "NORMAL", "FULL", "EXTRA"]
+g_tempStores = ["DEFAULT", "FILE", "MEMORY"]
+
+
+def SqlitePragmas(configArg=None) -> list:
+    """
+        Builds the SQLite performance profile, as PRAGMA statements executed on each new connection. The profile is
+        read from the SQLITE_* settings. A setting set to None (or to an empty string) leaves the SQLite default in place
+
+    :param configArg: config overriding the settings, with the settings names as keys (e.g. {"SQLITE_JOURNAL_MODE":
+    "DELETE"}). Used by the benchmarks for comparing profiles
+    :return: the PRAGMA statements list. The foreign keys PRAGMA is always the first one
+    """
+    config = {
+        **{settingName: EnvOrSetting(settingName, defaultValue=defaultValue) for settingName, defaultValue in [
+            ("SQLITE_JOURNAL_MODE", "WAL"),
+            ("SQLITE_SYNCHRONOUS", "NORMAL"),
+            ("SQLITE_BUSY_TIMEOUT", 5000),
+            ("SQLITE_MMAP_SIZE", 256 * 1024 * 1024),
+            ("SQLITE_CACHE_SIZE", -16000),
+            ("SQLITE_TEMP_STORE", "MEMORY")
+        ]},
+        **(configArg if type(configArg) is dict else {})
+    }
+
+    def Setting(settingName, validValues=None):
+        value = config[settingName]
+        if value is None or (type(value) is str and len(value) == 0):
+            return None
+        if validValues is None:
+            return int(value)
+        value = str(value).upper()
+        if value not in validValues:
+            raise RuntimeError(f"Invalid {settingName} setting \"{value}\". It must be in {validValues} list")
+        return value
+
+    # the foreign_keys PRAGMA activates the foreign keys checks and enables the cascade deletes and updates
+    pragmas = ["PRAGMA foreign_keys=ON"]
+    for pragmaName, value in [
+        ("journal_mode", Setting("SQLITE_JOURNAL_MODE", g_journalModes)),
+        ("synchronous", Setting("SQLITE_SYNCHRONOUS", g_synchronousModes)),
+        ("busy_timeout", Setting("SQLITE_BUSY_TIMEOUT")),
+        ("mmap_size", Setting("SQLITE_MMAP_SIZE")),
+        ("cache_size", Setting("SQLITE_CACHE_SIZE")),
+        ("temp_store", Setting("SQLITE_TEMP_STORE", g_tempStores))
+    ]:
+        if value is not None:
+            pragmas.append(f"PRAGMA {pragmaName}={value}")
+    return pragmas
+
+
+def ExecutePragmas(dbapiConnection, pragmas):
+    """
+        Executes the PRAGMA statements on a new (DBAPI) connection
+
+    :param dbapiConnection: the sqlite3 connection
+    :param pragmas: the PRAGMA statements, as returned by SqlitePragmas
+    """
+    cursor = dbapiConnection.cursor()
+    try:
+        for pragma in pragmas:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
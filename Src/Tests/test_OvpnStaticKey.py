@@ -0,0 +1,65 @@
+"""
+    Checks the in process OpenVPN static (tls-crypt) keys against the format written by "openvpn --genkey --secret".
+    Run it from the Src directory:
+
+        python -m unittest discover -s Tests
+
+    The fixture can be regenerated by running "openvpn --genkey --secret Tests/Fixtures/OvpnStaticKey.key". When the
+    OpenVPN binary (OVPN_PATH) is available, the keys it generates are checked as well
+"""
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from Utils.CertsUtils import OvpnStaticKey, g_ovpnStaticKeyBytes
+
+g_fixturePath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "Fixtures", "OvpnStaticKey.key")
+g_keyFileRegex = re.compile(rb"#\n# 2048 bit OpenVPN static key\n#\n-----BEGIN OpenVPN Static key V1-----\n"
+                            rb"((?:[0-9a-f]{32}\n){16})-----END OpenVPN Static key V1-----\n")
+
+
+def KeyBytes(keyFile):
+    """
+        Extracts the key bytes out of a static key file's content
+
+    :return: the key bytes or None if the content doesn't have the static key format
+    """
+    match = g_keyFileRegex.fullmatch(keyFile)
+    return bytes.fromhex(match.group(1).replace(b"\n", b"").decode()) if match is not None else None
+
+
+class OvpnStaticKeyTest(unittest.TestCase):
+    def setUp(self):
+        with open(g_fixturePath, "rb") as fixtureFile:
+            self.m_fixture = fixtureFile.read()
+
+    def testFixtureFormat(self):
+        self.assertEqual(len(KeyBytes(self.m_fixture)), g_ovpnStaticKeyBytes)
+
+    def testReproducesFixture(self):
+        self.assertEqual(OvpnStaticKey(KeyBytes(self.m_fixture)), self.m_fixture)
+
+    def testRandomKeys(self):
+        key = OvpnStaticKey()
+        self.assertIsNotNone(KeyBytes(key))
+        self.assertNotEqual(KeyBytes(key), KeyBytes(OvpnStaticKey()))
+
+    @unittest.skipUnless(shutil.which(os.getenv("OVPN_PATH", "openvpn")), "the OpenVPN binary is missing")
+    def testMatchesOpenvpnKeys(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            keyPath = os.path.join(tmpDir, "ta.key")
+            subprocess.run([shutil.which(os.getenv("OVPN_PATH", "openvpn")), "--genkey", "--secret", keyPath],
+                           check=True, capture_output=True)
+            with open(keyPath, "rb") as keyFile:
+                openvpnKey = keyFile.read()
+        self.assertEqual(OvpnStaticKey(KeyBytes(openvpnKey)), openvpnKey)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+    Cache of the loaded CAs' certificates and (decrypted) private keys, keyed by the CA id, so that signing a certificate
+    or a CRL doesn't decrypt and load the CA key each time. Each process has its own cache, bounded by CA_KEYS_CACHE_SIZE
+    entries, each one living at most CA_KEYS_CACHE_TTL seconds.
+
+    The entries are validated against the CA certificate read from the db, so a CA recreated under the same id (SQLite
+    reuses the ids of the deleted rows) is never served from a stale entry. The CA deletion drops the current process'
+    entry right away; the other processes' entries are dropped by the same validation or when they expire.
+
+    The key objects' memory is owned by OpenSSL, which clears the private key numbers when the objects are freed, so
+    the expired and evicted entries are purged eagerly on each cache access rather than left to linger. When
+    CA_KEYS_CACHE_LOCK_MEMORY is set, the process' memory is additionally locked (mlockall), so the decrypted keys are
+    never swapped out to disk
+"""
+import os
+import threading
+
+from Utils.Cache import TtlCache
+from Utils.SettingsUtils import EnvOrSetting
+
+#mlockall flags (Linux)
+g_mclCurrent = 1
+g_mclFuture = 2
+
+
+class CaKeysCache:
+    def __init__(self, maxSize, ttl):
+        """
+        :param maxSize: the maximum number of cached CAs
+        :param ttl: the entries' time to live, in seconds
+        """
+        self.m_entries = TtlCache(maxSize, ttl)
+
+    def Get(self, caId, serializedCaCert):
+        """
+            Retrieves a CA's loaded certificate and key
+
+        :param caId: the CA id
+        :param serializedCaCert: the CA certificate, as stored in the db (PEM), for validating the cached entry
+        :return: the (certificate, private key) tuple or None if the CA isn't cached
+        """
+        self.m_entries.Purge()
+        entry = self.m_entries.Get(caId)
+        if entry is None:
+            return None
+        cachedCaCert, caCert, caKey = entry
+        if cachedCaCert != bytes(serializedCaCert):
+            self.m_entries.Pop(caId)
+            return None
+        return caCert, caKey
+
+    def Set(self, caId, serializedCaCert, caCert, caKey):
+        self.m_entries.Set(caId, (bytes(serializedCaCert), caCert, caKey))
+
+    def Pop(self, caId):
+        self.m_entries.Pop(caId)
+
+    def Clear(self):
+        self.m_entries.Clear()
+
+    def __len__(self):
+        return len(self.m_entries)
+
+
+def LockProcessMemory() -> bool:
+    """
+        Locks the process' current and future memory pages in RAM (best effort, Linux only)
+
+    :return: True if the memory got locked and False otherwise (e.g. RLIMIT_MEMLOCK too low or CAP_IPC_LOCK missing)
+    """
+    import ctypes
+    import ctypes.util
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if libc.mlockall(g_mclCurrent | g_mclFuture) == 0:
+            return True
+        errno = ctypes.get_errno()
+        print(f"Warning: locking the process memory failed - {os.strerror(errno)}")
+    except (OSError, AttributeError) as e:
+        print("Warning: locking the process memory is not supported - " + str(e))
+    return False
+
+
+g_caKeysCache = None
+g_caKeysCachePid = None
+g_caKeysCacheLock = threading.Lock()
+
+
+def GetCaKeysCache():
+    """
+        Retrieves the process' CA keys cache, creating it if needed. The cache is recreated in forked processes, so the
+        decrypted keys are never inherited
+
+    :return: the cache object or None if the cache is disabled (CA_KEYS_CACHE_SIZE set to 0)
+    """
+    global g_caKeysCache, g_caKeysCachePid
+    maxSize = int(EnvOrSetting("CA_KEYS_CACHE_SIZE", defaultValue=64))
+    if maxSize <= 0:
+        return None
+    with g_caKeysCacheLock:
+        if g_caKeysCache is None or g_caKeysCachePid != os.getpid():
+            if str(EnvOrSetting("CA_KEYS_CACHE_LOCK_MEMORY", defaultValue=False)).lower() in ["1", "on", "true"]:
+                LockProcessMemory()
+            g_caKeysCache = CaKeysCache(maxSize, int(EnvOrSetting("CA_KEYS_CACHE_TTL", defaultValue=300)))
+            g_caKeysCachePid = os.getpid()
+        return g_caKeysCache
@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TtlCache:
+    """
+        Thread safe, size bounded, in-memory cache with per entry time to live. When full, the least recently used entry
+        is evicted. Each process has its own cache instances
+    """
+
+    def __init__(self, maxSize, ttl):
+        """
+        :param maxSize: the maximum number of entries
+        :param ttl: the entries' time to live, in seconds
+        """
+        self.m_maxSize = maxSize
+        self.m_ttl = ttl
+        self.m_entries = OrderedDict()
+        self.m_lock = threading.Lock()
+
+    def Get(self, key, defaultValue=None):
+        """
+            Retrieves a cached value
+
+        :param key: the entry key
+        :param defaultValue: the value returned if the entry is missing or expired
+        :return: the cached value or defaultValue
+        """
+        with self.m_lock:
+            entry = self.m_entries.get(key)
+            if entry is None:
+                return defaultValue
+            value, expiresAt = entry
+            if expiresAt <= time.monotonic():
+                del self.m_entries[key]
+                return defaultValue
+            self.m_entries.move_to_end(key)
+            return value
+
+    def Set(self, key, value, ttl=None):
+        """
+            Adds or replaces a cache entry
+
+        :param key: the entry key
+        :param value: the value to be cached
+        :param ttl: the entry's time to live, in seconds. If None, the cache's time to live is used
+        """
+        if self.m_maxSize <= 0:
+            return
+        with self.m_lock:
+            self.m_entries[key] = (value, time.monotonic() + (self.m_ttl if ttl is None else ttl))
+            self.m_entries.move_to_end(key)
+            while len(self.m_entries) > self.m_maxSize:
+                self.m_entries.popitem(last=False)
+
+    def Pop(self, key, defaultValue=None):
+        with self.m_lock:
+            entry = self.m_entries.pop(key, None)
+        return defaultValue if entry is None or entry[1] <= time.monotonic() else entry[0]
+
+    def Purge(self):
+        """
+            Drops the expired entries. The expired entries are otherwise only dropped when looked up or evicted
+
+        :return: the number of dropped entries
+        """
+        now = time.monotonic()
+        with self.m_lock:
+            expiredKeys = [key for key, (_, expiresAt) in self.m_entries.items() if expiresAt <= now]
+            for key in expiredKeys:
+                del self.m_entries[key]
+        return len(expiredKeys)
+
+    def Clear(self):
+        with self.m_lock:
+            self.m_entries.clear()
+
+    def __len__(self):
+        return len(self.m_entries)
+
+
+class LruBytesCache:
+    """
+        Thread safe, in-memory LRU cache bounded by the total size (in bytes) of its entries. When over budget, the least
+        recently used entries are evicted. Each process has its own cache instances
+    """
+
+    def __init__(self, maxBytes):
+        """
+        :param maxBytes: the byte budget. If 0 then nothing gets cached
+        """
+        self.m_maxBytes = maxBytes
+        self.m_bytes = 0
+        self.m_entries = OrderedDict()
+        self.m_lock = threading.Lock()
+
+    def Get(self, key, defaultValue=None):
+        with self.m_lock:
+            entry = self.m_entries.get(key)
+            if entry is None:
+                return defaultValue
+            self.m_entries.move_to_end(key)
+            return entry[0]
+
+    def Set(self, key, value, size):
+        """
+            Adds or replaces a cache entry
+
+        :param key: the entry key
+        :param value: the value to be cached
+        :param size: the value's size, in bytes. Values larger than the whole budget are not cached
+        """
+        if size > self.m_maxBytes:
+            return
+        with self.m_lock:
+            oldEntry = self.m_entries.pop(key, None)
+            if oldEntry is not None:
+                self.m_bytes -= oldEntry[1]
+            self.m_entries[key] = (value, size)
+            self.m_bytes += size
+            while self.m_bytes > self.m_maxBytes:
+                _, (_, evictedSize) = self.m_entries.popitem(last=False)
+                self.m_bytes -= evictedSize
+
+    def Clear(self):
+        with self.m_lock:
+            self.m_entries.clear()
+            self.m_bytes = 0
+
+    def Size(self):
+        return self.m_bytes
+
+    def __len__(self):
+        return len(self.m_entries)
@@ -1,4 +1,3 @@
-from sqlalchemy.orm.exc import NoResultFound
 from flask_restx import abort
 from Database.Models import EntityDbModel, CasDbModel, CertsDbModel, EntityTypeEnum
 from Utils.ResourcesUtils import GetSingle, GetOrg
@@ -23,11 +22,123 @@ def GeOvpnUser(userId):
 
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.backends import default_backend
-from cryptography.x509 import NameOID
 from cryptography import x509
 from cryptography.hazmat.primitives import serialization, hashes
 import datetime
 
+from Utils import PkiJobs
+from Utils.PkiExecutor import GetPkiExecutor, RunPkiJob
+from Utils.SerialsAllocator import AllocateSerials
+
+g_keysPasswd = b'ToBeSetPasswd'
+
+
+def DefaultKeyProfile() -> str:
+    """
+        Retrieves the key profile of the new CAs (KEY_PROFILE setting), unless one is explicitly given at CA creation
+    """
+    keyProfile = EnvOrSetting("KEY_PROFILE", defaultValue=PkiJobs.g_defaultKeyProfile)
+    if keyProfile not in PkiJobs.g_keyProfiles:
+        raise RuntimeError(f"Invalid KEY_PROFILE setting \"{keyProfile}\". It must be in {list(PkiJobs.g_keyProfiles)} "
+                           f"list")
+    return keyProfile
+
+
+def CaKeyProfile(caCert) -> str:
+    """
+        Retrieves the key profile of a CA, from its certificate. The certificates' keys issued by the CA have the same
+        profile
+
+    :param caCert: the CA certificate object or its PEM serialization
+    :return: the key profile name. For keys not matching any profile, the default profile name
+    """
+    return PkiJobs.KeyProfile(PkiJobs.ToCert(caCert)) or PkiJobs.g_defaultKeyProfile
+
+
+def PooledKeyProfile(keyProfile) -> bool:
+    """
+        States if the keys of a profile are drawn from the keys pool. Only the RSA keys are, since the ECDSA and Ed25519
+        keys are generated faster than a pool round-trip
+    """
+    return PkiJobs.g_keyProfiles[keyProfile][0] == "rsa"
+
+
+def GeneratePrivateKey(keyProfile=PkiJobs.g_defaultKeyProfile):
+    """
+        Generates a private key. If the PKI executor is enabled the key is generated by the executor and returned in
+        PEM format (unencrypted), otherwise the key object is returned
+    """
+    return RunPkiJob(PkiJobs.GenerateKeyJob, None, keyProfile) if GetPkiExecutor() is not None else \
+        PkiJobs.NewKey(keyProfile)
+
+
+def SerializePrivateKey(key, passwd=g_keysPasswd) -> bytes:
+    if isinstance(key, bytes):
+        return key if passwd is None else RunPkiJob(PkiJobs.SerializeKeyJob, key, passwd)
+    return PkiJobs.SerializeKeyJob(key, passwd)
+
+
+def LoadPrivateKey(serializedKey, passwd=g_keysPasswd):
+    return serialization.load_pem_private_key(serializedKey, passwd, default_backend())
+
+
+def DecryptPrivateKey(serializedKey, passwd=g_keysPasswd):
+    """
+        Decrypts a PEM serialized private key. If the PKI executor is enabled the key is decrypted by the executor and
+        returned in PEM format (unencrypted), otherwise the key object is returned
+    """
+    return RunPkiJob(PkiJobs.DecryptKeyJob, serializedKey, passwd) if GetPkiExecutor() is not None else \
+        LoadPrivateKey(serializedKey, passwd)
+
+
+def NewPrivateKey(app, config):
+    """
+        Retrieves a new private key of the config["keyProfile"] profile (the default one if missing), either drawn from
+        the keys pool, if config["keysPool"] is set and the pool is enabled, or freshly generated otherwise (including
+        the case when the pool is empty)
+    """
+    keyProfile = config.get("keyProfile") or DefaultKeyProfile()
+    if config.get("keysPool", False) and PooledKeyProfile(keyProfile):
+        from Utils.KeysPool import GetKeysPool
+
+        keysPool = GetKeysPool(app)
+        serializedKey = keysPool.Pop(keyProfile) if keysPool is not None else None
+        if serializedKey is not None:
+            return DecryptPrivateKey(serializedKey)
+    return GeneratePrivateKey(keyProfile)
+
+
+g_renewModes = ["rekey", "resign"]
+
+
+def RenewMode(config) -> str:
+    """
+        Retrieves the certificates' renewal mode: config["renewMode"] if given, the CERTS_RENEW_MODE setting otherwise.
+        "rekey" renews the certificates with new keys and "resign" by signing their existing keys again
+    """
+    if config.get("renewMode") is not None:
+        if config["renewMode"] not in g_renewModes:
+            abort(400, f"Invalid renew mode \"{config['renewMode']}\". It must be in {g_renewModes} list")
+        return config["renewMode"]
+    renewMode = EnvOrSetting("CERTS_RENEW_MODE", defaultValue="rekey")
+    if renewMode not in g_renewModes:
+        raise RuntimeError(f"Invalid CERTS_RENEW_MODE setting \"{renewMode}\". It must be in {g_renewModes} list")
+    return renewMode
+
+
+def RenewableKey(certObj, config):
+    """
+        Retrieves the key to be signed again when renewing a certificate in the "resign" mode
+
+    :param certObj: the entity's last certificate db object or None if the entity has none
+    :param config: config, with the "renewMode" entry (see RenewMode)
+    :return: the certificate's PEM serialized key or None if the renewal needs a new key: "rekey" mode, no previous
+    certificate, or a revoked or invalid one
+    """
+    if certObj is None or RenewMode(config) != "resign" or len(certObj.key) == 0 or certObj.revoked:
+        return None
+    return certObj.key if StateFromCertDbObj(certObj, config) in [CertState.VALID, CertState.EXPIRED] else None
+
 
 def GenerateCaByOrgId(app, orgId, configArg=None):
     return GenerateCaByOrg(app, GetOrg(orgId), configArg)
@@ -43,6 +154,7 @@ def GenerateCaByOrg(app, org, configArg=None):
             "orgName": org.name,
             "email": org.email
         },
+        "keysPool": True,
         **(configArg if type(configArg) is dict else {})
     }
     return GenerateCa(app, config)
@@ -50,6 +162,7 @@ def GenerateCaByOrg(app, org, configArg=None):
 def GenerateCa(app, configArg=None):
     config = {
         "serializedKeys": True,
+        "keyProfile": None,  # if None, the default key profile is used
         "caValidFrom": datetime.datetime.now() - datetime.timedelta(days=1),
         "caValidity": 30 * 365,  # if not specified the validity will be 30 years
         **(configArg if type(configArg) is dict else {}),
@@ -60,56 +173,44 @@ def GenerateCa(app, configArg=None):
         },
     }
 
-    caKey: rsa.RSAPrivateKeyWithSerialization = rsa.generate_private_key(65537, 4096, default_backend())
-
-    subject = issuer = x509.Name([
-        x509.NameAttribute(entry["nameOID"], config["CA"][entry["name"]]) for entry in (caConfigEntry for caConfigEntry in [{
-            "name": "commonName",
-            "nameOID": NameOID.COMMON_NAME
-        }, {
-            "name": "country",
-            "nameOID": NameOID.COUNTRY_NAME
-        }, {
-            "name": "state",
-            "nameOID": NameOID.STATE_OR_PROVINCE_NAME
-        }, {
-            "name": "location",
-            "nameOID": NameOID.LOCALITY_NAME
-        }, {
-            "name": "orgName",
-            "nameOID": NameOID.ORGANIZATION_NAME
-        }, {
-            "name": "email",
-            "nameOID": NameOID.EMAIL_ADDRESS
-        }, {
-            "name": "orgUnitName",
-            "nameOID": NameOID.ORGANIZATIONAL_UNIT_NAME
-        }
-        ] if caConfigEntry["name"] in config["CA"])
-    ])
-    subjectKeyIdentifier = x509.SubjectKeyIdentifier.from_public_key(caKey.public_key())
-    serialNumber = x509.random_serial_number()
-    validUntil = config["caValidFrom"] + datetime.timedelta(days=config["caValidity"])
-    caCert = x509.CertificateBuilder().subject_name(subject).issuer_name(issuer).public_key(caKey.public_key()). \
-        serial_number(serialNumber). \
-        not_valid_before(config["caValidFrom"]). \
-        not_valid_after(validUntil). \
-        add_extension(subjectKeyIdentifier, critical=False). \
-        add_extension(x509.AuthorityKeyIdentifier(subjectKeyIdentifier.digest, [x509.DirectoryName(issuer)],
-                                                  serialNumber), critical=False). \
-        add_extension(x509.BasicConstraints(True, 0  # CA true and for now we'll not use intermediate CAs
-                                            ), critical=False). \
-        sign(caKey, hashes.SHA512(), default_backend())  # Sign our certificate with our private key
-    return (caCert.public_bytes(encoding=serialization.Encoding.PEM),
-            caKey.private_bytes(encoding=serialization.Encoding.PEM,
-                                format=serialization.PrivateFormat.PKCS8,
-                                encryption_algorithm=serialization.BestAvailableEncryption(b'ToBeSetPasswd'))) if \
-        config["serializedKeys"] else (caCert, caKey)
+    caKey = NewPrivateKey(app, config)
+    caCert = RunPkiJob(PkiJobs.SignCaJob, caKey, {
+        key: config[key] for key in ("CA", "caValidFrom", "caValidity")
+    })
+    return (caCert, SerializePrivateKey(caKey)) if config["serializedKeys"] else \
+        (PkiJobs.ToCert(caCert), PkiJobs.ToPrivateKey(caKey))
 
 
 from typing import Tuple, Union
 
 
+def GenerateAndStoreCa(app, orgId, configArg=None) -> tuple:
+    """
+        Generates an organization's CA and stores it. The caller must hold the org's CA lease ("ca:<orgId>") and make
+        sure the org has no CA yet
+
+    :param app: the app object
+    :param orgId: the organization id
+    :param configArg: config (see GenerateCa)
+    :return: the (CA id, PEM serialized CA certificate, PEM serialized encrypted CA key) tuple
+    """
+    serializedCaCert, serializedCaKey = GenerateCaByOrgId(app, orgId, {
+        **(configArg if type(configArg) is dict else {}),
+        "serializedKeys": True  # the CA is stored serialized regardless of the returned form
+    })
+    # add the CA to db
+    db = app.Db()
+    caObj = CasDbModel(
+        orgId=orgId,
+        keyProfile=CaKeyProfile(serializedCaCert),
+        cert=serializedCaCert,
+        key=serializedCaKey
+    )
+    db.session.add(caObj)
+    db.session.commit()
+    return caObj.id, serializedCaCert, serializedCaKey
+
+
 def GetCaCertAndKey(app, orgId, configArg=None) -> Tuple[
     Union[x509.Certificate, bytes], Union[rsa.RSAPrivateKey, bytes]]:
     config = {
@@ -117,34 +218,72 @@ def GetCaCertAndKey(app, orgId, configArg=None) -> Tuple[
         **(configArg if type(configArg) is dict else {})
     }
 
-    def GetCaCertAndKeySerialized() -> tuple:
-        try:
-            caObj = CasDbModel.query.filter(CasDbModel.orgId == orgId).one()
-            return caObj.cert, caObj.key  # the certs and keys are stored in PEM format (serialized)
-        except NoResultFound:
-            innerSerializedCaCert, innerSerializedCaKey = GenerateCaByOrgId(app, orgId, configArg)
-            # add the CA to db
-            db = app.Db()
-            db.session.add(CasDbModel(
-                orgId=orgId,
-                cert=innerSerializedCaCert,
-                key=innerSerializedCaKey
-            ))
-            db.session.commit()
-            return innerSerializedCaCert, innerSerializedCaKey
+    def LookupCaCertAndKeySerialized():
+        caObj = CasDbModel.query.filter(CasDbModel.orgId == orgId).first()
+        # the certs and keys are stored in PEM format (serialized)
+        return (caObj.id, caObj.cert, caObj.key) if caObj is not None else None
+
+    def GenerateCaCertAndKeySerialized() -> tuple:
+        return GenerateAndStoreCa(app, orgId, config)
+
+    from Utils.Leases import SingleFlight
 
-    serializedCaCert, serializedCaKey = GetCaCertAndKeySerialized()
+    # the concurrent requests of an org without CA wait for a single CA generation
+    caId, serializedCaCert, serializedCaKey = SingleFlight(app, f"ca:{orgId}", LookupCaCertAndKeySerialized,
+                                                           GenerateCaCertAndKeySerialized)
     if config["serializedKeys"]:
         return serializedCaCert, serializedCaKey
     else:
-        caKey = serialization.load_pem_private_key(serializedCaKey, b'ToBeSetPasswd', default_backend())  # the CA key
+        from Utils.CaKeysCache import GetCaKeysCache
+
+        caKeysCache = GetCaKeysCache()
+        cachedCaCertAndKey = caKeysCache.Get(caId, serializedCaCert) if caKeysCache is not None else None
+        if cachedCaCertAndKey is not None:
+            return cachedCaCertAndKey
+        # the cached keys are loaded in process (once per CA and cache TTL), since the key objects are what the jobs use
+        caKey = LoadPrivateKey(serializedCaKey) if caKeysCache is not None else DecryptPrivateKey(serializedCaKey)
         caCert = x509.load_pem_x509_certificate(serializedCaCert, default_backend())
+        if caKeysCache is not None:
+            caKeysCache.Set(caId, serializedCaCert, caCert, caKey)
         return caCert, caKey
 
 
-def GetLastCertificateId():
-    lastCertDbObj = CertsDbModel.query.order_by(CertsDbModel.id.desc()).first()
-    return 0 if lastCertDbObj is None else lastCertDbObj.id
+def RenewCaCert(app, orgId, configArg=None) -> bool:
+    """
+        Renews an organization's CA certificate (see PkiJobs.RenewCaJob), unless it was renewed in the meantime. The
+        CA's certificates and CRL stay valid, while the cached CRL and configs get rebuilt with the renewed certificate
+
+    :param app: the app object
+    :param orgId: the organization id
+    :param configArg: config. "renewBefore" - the CA certificate is renewed only if it expires before this date,
+    "caValidFrom" and "caValidity" - the renewed certificate's validity
+    :return: True if the CA certificate got renewed and False otherwise
+    """
+    from Utils.Leases import Lease
+
+    config = {
+        "renewBefore": None,
+        "caValidFrom": datetime.datetime.now() - datetime.timedelta(days=1),
+        "caValidity": 30 * 365,
+        **(configArg if type(configArg) is dict else {})
+    }
+    with Lease(app, f"ca:{orgId}"):  # the CA's generation lease
+        caObj = CasDbModel.query.filter(CasDbModel.orgId == orgId).first()
+        if caObj is None or (config["renewBefore"] is not None and
+                             CertFromSerializedCert(caObj.cert).not_valid_after >= config["renewBefore"]):
+            return False
+        dbSession = app.Db().session
+        caObj.cert = RunPkiJob(PkiJobs.RenewCaJob, caObj.cert, DecryptPrivateKey(caObj.key), config["caValidFrom"],
+                               config["caValidity"])
+        InvalidateCRLs([orgId])
+        dbSession.commit()
+    from Utils.CaKeysCache import GetCaKeysCache
+
+    caKeysCache = GetCaKeysCache()
+    if caKeysCache is not None:
+        caKeysCache.Pop(caObj.id)
+    return True
+
 
 def CountryCode(countryName):
     from iso3166 import countries
@@ -168,9 +307,15 @@ def GenerateCertAndKeyByEntitiyAndOrgIds(app, entityId, orgId, configArg=None):
     return GenerateCertAndKeyByEntityAndOrg(app, entity, org, caCert, caKey, config)
 
 def GenerateCertAndKeyByEntityAndOrg(app, entity, org, caCert, caKey, configArg=None):
-    config = {
+    return GenerateCertAndKey(app, caCert, caKey, CertConfigByEntityAndOrg(entity, org, {
+        "serialNo": AllocateSerials(app)[0],
+        "keysPool": True,
+        **(configArg if type(configArg) == dict else {})
+    }))
+
+def CertConfigByEntityAndOrg(entity, org, configArg=None):
+    return {
         "srvType": False,
-        "serialNo": GetLastCertificateId() + 1,
         "entity": {
             "name": entity.name,
             "country": CountryCode(entity.country),
@@ -185,10 +330,9 @@ def GenerateCertAndKeyByEntityAndOrg(app, entity, org, caCert, caKey, configArg=
         },
         **(configArg if type(configArg) == dict else {})
     }
-    return GenerateCertAndKey(app, caCert, caKey, config)
 
-def GenerateCertAndKey(app, caCert, caKey, configArg=None):
-    config = {
+def CertConfig(configArg=None):
+    return {
         "srvType": False,
         "serializedKeys": True,
         # minus one day, for having valid certs regardless server's timezone
@@ -207,62 +351,164 @@ def GenerateCertAndKey(app, caCert, caKey, configArg=None):
             **(configArg["org"] if type(configArg) == dict and "org" in configArg else {})
         },
     }
-    key = rsa.generate_private_key(65537, 4096,
-                                   default_backend())  # the server's key. Can retrieve the public key out of it
-    serialNumber = config["serialNo"]
-    pubKey = key.public_key()
-    subjectKeyIdentifier = x509.SubjectKeyIdentifier.from_public_key(pubKey)
-    subjectAttrs = [ x509.NameAttribute(entry["nameOID"], config["entity"][entry["name"]]) for entry in [{
-        "name": "country",
-        "nameOID": NameOID.COUNTRY_NAME
-    }, {
-        "name": "state",
-        "nameOID": NameOID.STATE_OR_PROVINCE_NAME
-    }, {
-        "name": "location",
-        "nameOID": NameOID.LOCALITY_NAME
-    }, {
-        "name": "name",
-        "nameOID": NameOID.COMMON_NAME
-    }] if entry["name"] in config["entity"]
-    ] + [ x509.NameAttribute(entry["nameOID"], config["org"][entry["name"]]) for entry in [{
-        "name": "name",
-        "nameOID": NameOID.ORGANIZATION_NAME
-    }, {
-        "name": "unitName",
-        "nameOID": NameOID.ORGANIZATIONAL_UNIT_NAME
-    }] if entry["name"] in config["org"]
-    ]
-    srvType = config["srvType"]
-    if not srvType and "email" in config["entity"]:
-        subjectAttrs.append(x509.NameAttribute(NameOID.EMAIL_ADDRESS,
-                                               config["entity"]["email"]))  # user certificate also have email address in its subject
-
-    certBuilder = x509.CertificateBuilder(). \
-        subject_name(x509.Name(subjectAttrs)). \
-        issuer_name(caCert.subject). \
-        public_key(pubKey). \
-        serial_number(serialNumber). \
-        not_valid_before(config["validFrom"]). \
-        not_valid_after(config["validFrom"] + datetime.timedelta(days=config["validity"])). \
-        add_extension(x509.BasicConstraints(False, None), critical=True). \
-        add_extension(subjectKeyIdentifier, critical=False). \
-        add_extension(x509.AuthorityKeyIdentifier(caCert.extensions.get_extension_for_class(x509.SubjectKeyIdentifier).
-                                                  value.digest, [x509.DirectoryName(caCert.subject)],
-                                                  caCert.serial_number), critical=False)
-    if srvType:  # server certificate
-        certBuilder = certBuilder.add_extension(x509.ExtendedKeyUsage([x509.OID_SERVER_AUTH]), critical=False)
-    certBuilder = certBuilder.add_extension(
-        x509.KeyUsage(digital_signature=True, content_commitment=False, key_encipherment=True,
-                      data_encipherment=False, key_agreement=False, key_cert_sign=False,
-                      crl_sign=False, encipher_only=False, decipher_only=False), critical=True). \
-        add_extension(x509.SubjectAlternativeName([x509.DNSName(config["entity"]["name"])]), critical=False)
-    cert = certBuilder.sign(caKey, hashes.SHA512(), default_backend())  # Sign our certificate with CA's private key
-    return (cert.public_bytes(serialization.Encoding.PEM),
-            key.private_bytes(encoding=serialization.Encoding.PEM,
-                              format=serialization.PrivateFormat.PKCS8,
-                              encryption_algorithm=serialization.NoEncryption())) if config["serializedKeys"] \
-        else (cert, key)
+
+def SignCertJobConfig(config):
+    return {
+        configKey: config[configKey] for configKey in ("srvType", "validFrom", "validity", "serialNo", "entity", "org")
+    }
+
+def GenerateCertAndKey(app, caCert, caKey, configArg=None):
+    config = CertConfig(configArg)
+    config["keyProfile"] = config.get("keyProfile") or CaKeyProfile(caCert)  # the CA's profile, unless given
+    # the server's key. Can retrieve the public key out of it. A renewed certificate's key is signed again, if given
+    key = config["existingKey"] if config.get("existingKey") is not None else NewPrivateKey(app, config)
+    cert = RunPkiJob(PkiJobs.SignCertJob, caCert, caKey, key, SignCertJobConfig(config))
+    return (cert, SerializePrivateKey(key, None)) if config["serializedKeys"] \
+        else (PkiJobs.ToCert(cert), PkiJobs.ToPrivateKey(key))
+
+def BatchGenerateCertsAndKeys(app, org, entities, configArg=None):
+    """
+        Generates the certificates and keys of several entities of the same organization at once: the CA is loaded and
+        decrypted once, the keys are drawn from the keys pool (the missing ones being generated) and both the keys'
+        decryption/generation and the certificates' signing run in parallel on the PKI executor
+
+    :param app: the app object
+    :param org: the organization db object
+    :param entities: the entities db objects
+    :param configArg: config. "srvTypes" - a list with the entities' server type flags (all False if missing),
+    "existingKeys" - a list with the PEM serialized (unencrypted) keys to be signed again, None for the entities needing
+    new keys (all None if missing), besides the GenerateCertAndKey's config entries
+    :return: a list of (certificate, private key) tuples, PEM serialized (the keys unencrypted), in the entities order
+    """
+    from Utils.PkiExecutor import RunPkiJobs
+
+    config = {
+        "srvTypes": [False] * len(entities),
+        "existingKeys": [None] * len(entities),
+        **(configArg if type(configArg) == dict else {})
+    }
+    if len(entities) == 0:
+        return []
+    caCert, caKey = GetCaCertAndKey(app, org.id, {
+        **config,
+        "serializedKeys": False
+    })
+    keyProfile = config.get("keyProfile") or CaKeyProfile(caCert)
+    # serialize the CA once, rather than for each job
+    caCert = caCert.public_bytes(serialization.Encoding.PEM) if isinstance(caCert, x509.Certificate) else caCert
+    caKey = SerializePrivateKey(caKey, None)
+
+    newKeysNo = config["existingKeys"].count(None)
+    pooledKeys = []
+    from Utils.KeysPool import GetKeysPool
+    keysPool = GetKeysPool(app) if PooledKeyProfile(keyProfile) and newKeysNo else None
+    while keysPool is not None and len(pooledKeys) < newKeysNo:
+        serializedKey = keysPool.Pop(keyProfile)
+        if serializedKey is None:
+            break
+        pooledKeys.append(serializedKey)
+    newKeys = iter(RunPkiJobs(PkiJobs.DecryptKeyJob, [(serializedKey, g_keysPasswd) for serializedKey in pooledKeys]) +
+                   RunPkiJobs(PkiJobs.GenerateKeyJob, [(None, keyProfile) for _ in range(newKeysNo - len(pooledKeys))]))
+    keys = [existingKey if existingKey is not None else next(newKeys) for existingKey in config["existingKeys"]]
+
+    serials = AllocateSerials(app, len(entities))
+    certs = RunPkiJobs(PkiJobs.SignCertJob, [
+        (caCert, caKey, keys[idx], SignCertJobConfig(CertConfig(CertConfigByEntityAndOrg(entity, org, {
+            **config,
+            "srvType": config["srvTypes"][idx],
+            "serialNo": serials[idx]
+        })))) for idx, entity in enumerate(entities)
+    ])
+    return list(zip(certs, keys))
+
+
+def BatchGetCertsAndKeys(app, org, entities, configArg=None):
+    """
+        Batch version of GetCertAndKey: retrieves the entities' valid certificates and keys and issues (through
+        BatchGenerateCertsAndKeys) the missing ones, storing them in a single transaction. The expired (or reissued)
+        certificates are renewed according to the renew mode (see RenewMode). The missing certificates are issued under
+        the entities' certificate leases, as GetCertAndKey does, so the ones issued meanwhile by others are returned
+        instead of being issued again
+
+    :param app: the app object
+    :param org: the organization db object
+    :param entities: the entities (users or servers) db objects
+    :param configArg: config. "reissue" - if True then new certificates are issued even for the entities having valid
+    certificates, "renewBefore" - if given, the valid certificates expiring before this date are renewed as well,
+    "renewMode" - the renew mode, besides the BatchGenerateCertsAndKeys' config entries
+    :return: a dictionary mapping the entities' ids to certificates db objects along with a flag telling if the
+    certificate was just issued: {entityId: (certObj, issued)}
+    """
+    from sqlalchemy import exists
+    from sqlalchemy.orm import aliased
+    from Utils.Leases import Lease
+
+    config = {
+        "reissue": False,
+        **(configArg if type(configArg) == dict else {})
+    }
+    entities = list(entities)
+    srvTypes = {entity.id: entity.typeId == EntityTypeEnum.server for entity in entities}
+    res = {}
+    lastCerts = {}
+    renewMode = RenewMode(config)
+
+    def CollectLastCerts(entitiesIds):
+        # the entities' last certificates: returned if still valid, otherwise renewed
+        if not len(entitiesIds) or (config["reissue"] and renewMode != "resign"):
+            return
+        newerCerts = aliased(CertsDbModel)
+        query = CertsDbModel.query.filter(
+                CertsDbModel.orgId == org.id, CertsDbModel.entityId.in_(entitiesIds),
+                ~exists().where(newerCerts.entityId == CertsDbModel.entityId, newerCerts.orgId == CertsDbModel.orgId,
+                                newerCerts.srvType == CertsDbModel.srvType, newerCerts.id > CertsDbModel.id))
+        if renewMode != "resign":  # only the valid ones are of interest
+            query = query.filter(CertStateSqlExpr() == CertState.VALID.value)
+        for certObj in query:
+            if certObj.srvType == srvTypes[certObj.entityId]:
+                lastCerts[certObj.entityId] = certObj
+                if not config["reissue"] and StateFromCertDbObj(certObj, config) == CertState.VALID and \
+                        (config.get("renewBefore") is None or certObj.notAfter >= config["renewBefore"]):
+                    res[certObj.entityId] = (certObj, False)
+
+    CollectLastCerts(list(srvTypes.keys()))
+    issueEntities = sorted([entity for entity in entities if entity.id not in res], key=lambda entity: entity.id)
+    if not len(issueEntities):
+        return res
+    # the issued entities' certificate leases, the same as GetCertAndKey's, so that the concurrent issuances (single
+    # downloads, exports, batches, renewal scans) don't issue duplicates. They're acquired in the entities' ids order,
+    # so that the overlapping batches don't wait for each other's leases forever
+    leases = []
+    try:
+        for entity in issueEntities:
+            leases.append(Lease(app, f"cert:{entity.id}:{org.id}:{int(srvTypes[entity.id])}").Acquire())
+        CollectLastCerts([entity.id for entity in issueEntities])  # the previous leases holders might have issued them
+        issueEntities = [entity for entity in issueEntities if entity.id not in res]
+        issueSrvTypes = [srvTypes[entity.id] for entity in issueEntities]
+        certsAndKeys = BatchGenerateCertsAndKeys(app, org, issueEntities, {
+            **config,
+            "renewMode": renewMode,
+            "srvTypes": issueSrvTypes,
+            "existingKeys": [RenewableKey(lastCerts.get(entity.id), {**config, "renewMode": renewMode})
+                             for entity in issueEntities]
+        })
+        if len(certsAndKeys):
+            dbSession = app.Db().session
+            try:
+                certsObjs = [CertsDbModel(entityId=entity.id, orgId=org.id, srvType=issueSrvTypes[idx], cert=cert,
+                                          key=key, **CertMetadata(cert))
+                             for idx, (entity, (cert, key)) in enumerate(zip(issueEntities, certsAndKeys))]
+                dbSession.add_all(certsObjs)
+                dbSession.commit()
+            except Exception as e:
+                dbSession.rollback()
+                abort(500, f"Error storing the certificates - {e}")
+            for certObj in certsObjs:
+                res[certObj.entityId] = (certObj, True)
+    finally:
+        for lease in leases:
+            lease.Release()
+    return res
 
 
 def GetCertAndKey(app, entityId, orgId, configArg=None):
@@ -272,28 +518,74 @@ def GetCertAndKey(app, entityId, orgId, configArg=None):
     }
 
     def GenerateAndCommitCertKey():
-        serializedCaCert, serializedCaKey = GenerateCertAndKeyByEntitiyAndOrgIds(app, entityId, orgId, configArg)
+        # the entity's last certificate (expired, revoked or missing), read under the lease, for renewing it
+        existingKey = RenewableKey(CertDbObj(entityId, orgId, srvType=config["srvType"]), config)
+        serializedCaCert, serializedCaKey = GenerateCertAndKeyByEntitiyAndOrgIds(app, entityId, orgId, {
+            **config,
+            "existingKey": existingKey
+        })
         dbSession = app.Db().session
         dbSession.add(CertsDbModel(
             entityId=entityId,
             orgId=orgId,
             srvType=config["srvType"],
             cert=serializedCaCert,
-            key=serializedCaKey))
+            key=serializedCaKey,
+            **CertMetadata(serializedCaCert)))
         dbSession.commit()
         return serializedCaCert, serializedCaKey
 
-    certObj = CertDbObj(entityId, orgId, srvType=config["srvType"])
-    if certObj is not None:
-        if StateFromCertDbObj(certObj, config) != CertState.VALID:
-            return GenerateAndCommitCertKey()
-        else:  # the certificate is valid. Just return it from the db
+    def LookupValidCertKey():
+        certObj = CertDbObj(entityId, orgId, srvType=config["srvType"])
+        if certObj is not None and StateFromCertDbObj(certObj, config) == CertState.VALID:
             return certObj.cert, certObj.key  # the certs and keys are stored in PEM format (serialized)
-    else:
-        return GenerateAndCommitCertKey()
+        return None
+
+    from Utils.Leases import SingleFlight
+
+    # the concurrent requests for the same entity's certificate (e.g. repeated downloads) wait for a single issuance
+    return SingleFlight(app, f"cert:{entityId}:{orgId}:{int(bool(config['srvType']))}", LookupValidCertKey,
+                        GenerateAndCommitCertKey)
+
+
+#the OpenVPN static key (V1) format, as written by "openvpn --genkey": 2048 random bits, hex encoded, 16 bytes per line
+g_ovpnStaticKeyBytes = 256
+g_ovpnStaticKeyLineBytes = 16
+g_ovpnStaticKeyHeader = "#\n# 2048 bit OpenVPN static key\n#\n-----BEGIN OpenVPN Static key V1-----\n"
+g_ovpnStaticKeyFooter = "-----END OpenVPN Static key V1-----\n"
+
+
+def OvpnStaticKey(keyBytes=None) -> bytes:
+    """
+        Formats an OpenVPN static key (the "--tls-crypt" key), byte for byte as "openvpn --genkey --secret" does
+
+    :param keyBytes: the 256 key bytes. If None, random bytes are used (os.urandom)
+    :return: the key file content
+    """
+    if keyBytes is None:
+        keyBytes = os.urandom(g_ovpnStaticKeyBytes)
+    assert len(keyBytes) == g_ovpnStaticKeyBytes
+    return (g_ovpnStaticKeyHeader + "".join(keyBytes[idx : idx + g_ovpnStaticKeyLineBytes].hex() + "\n" for idx in range(
+        0, g_ovpnStaticKeyBytes, g_ovpnStaticKeyLineBytes)) + g_ovpnStaticKeyFooter).encode()
 
 
 def GenerateTlsKey(app):
+    """
+        Generates an OpenVPN tls-crypt key. The key is generated in process, unless the TLS_KEY_GENERATOR setting is
+        "openvpn", in which case the OpenVPN binary (OVPN_PATH setting) generates it
+
+    :param app: the app object
+    :return: the key file content or None if the generation failed
+    """
+    generator = EnvOrSetting("TLS_KEY_GENERATOR", defaultValue="native")
+    if generator == "openvpn":
+        return GenerateTlsKeyByOpenvpn(app)
+    elif generator != "native":
+        raise RuntimeError(f"Invalid TLS_KEY_GENERATOR setting \"{generator}\". It must be native or openvpn")
+    return OvpnStaticKey()
+
+
+def GenerateTlsKeyByOpenvpn(app):
     # generate the openvpn's tls key
     import subprocess
 
@@ -325,33 +617,33 @@ def GenerateTlsKey(app):
 
 def GetSrvExtraInfo(app, srvId):
     from Database.Models import ServersExtraInfoDbModel
+    from Utils.Leases import SingleFlight
 
     dbSession = app.Db().session
-    try:
-        query = ServersExtraInfoDbModel.query.filter(ServersExtraInfoDbModel.srvId == srvId)
-        srvExtraInfoObj: ServersExtraInfoDbModel = query.one()
-        if len(srvExtraInfoObj.tlsKey) == 0:
-            tlsKey = GenerateTlsKey(app)
-            if tlsKey is None:
-                abort(500, "Error generating OpenVPN tc key")
-            query.update({
-                "tlsKey": tlsKey
-            })
-            dbSession.commit()
-            return srvExtraInfoObj.tlsKey
-        return srvExtraInfoObj.tlsKey
-    except NoResultFound:
+    query = ServersExtraInfoDbModel.query.filter(ServersExtraInfoDbModel.srvId == srvId)
+
+    def LookupTlsKey():
+        # just the column, so that a server extra info object already loaded by the session doesn't hide the key
+        # generated by another process
+        tlsKey = query.with_entities(ServersExtraInfoDbModel.tlsKey).scalar()
+        return tlsKey if tlsKey else None
+
+    def GenerateAndCommitTlsKey():
         tlsKey = GenerateTlsKey(app)
         if tlsKey is None:
             abort(500, "Error generating OpenVPN tc key")
-        # add the keys to db
-        dbSession.add(ServersExtraInfoDbModel(
-            srvId=srvId,
-            tlsKey=tlsKey,
-        ))
+        if query.update({"tlsKey": tlsKey}, synchronize_session=False) == 0:
+            # add the keys to db
+            dbSession.add(ServersExtraInfoDbModel(
+                srvId=srvId,
+                tlsKey=tlsKey,
+            ))
         dbSession.commit()
         return tlsKey
 
+    # the concurrent requests for the same server wait for a single key generation
+    return SingleFlight(app, f"tlsKey:{srvId}", LookupTlsKey, GenerateAndCommitTlsKey)
+
 
 from enum import Enum, unique
 
@@ -388,37 +680,126 @@ def StateFromCertDbObj(certObj: CertsDbModel, configArg = None):
         config["date"] = datetime.datetime.now()
 
     try:
-        cert: x509.Certificate = CertFromCertObj(certObj)
+        if certObj.notBefore is not None and certObj.notAfter is not None:
+            notBefore, notAfter = certObj.notBefore, certObj.notAfter
+        else: # no metadata stored for the certificate, so parse it
+            cert: x509.Certificate = CertFromCertObj(certObj)
+            notBefore, notAfter = cert.not_valid_before, cert.not_valid_after
         now = config["date"]
-        return CertState.INVALID if now < cert.not_valid_before else \
-            CertState.EXPIRED if now > cert.not_valid_after else \
+        return CertState.INVALID if now < notBefore else \
+            CertState.EXPIRED if now > notAfter else \
                 CertState.REVOKED if certObj.revoked else \
                     CertState.VALID
     except:
         return CertState.INVALID
 
+
+def CertStateSqlExpr(date=None):
+    """
+        The sql equivalent of StateFromCertDbObj, based on the certificates' metadata columns. The certificates without
+        metadata are considered invalid
+
+    :param date: the date the state is computed for. Defaults to now
+    :return: a sql expression evaluating to the CertState value
+    """
+    from sqlalchemy import case, func
+
+    if not isinstance(date, datetime.datetime):
+        date = datetime.datetime.now()
+    return case(
+        (func.length(CertsDbModel.cert) == 0, CertState.NA.value),
+        (CertsDbModel.notBefore.is_(None) | CertsDbModel.notAfter.is_(None), CertState.INVALID.value),
+        (CertsDbModel.notBefore > date, CertState.INVALID.value),
+        (CertsDbModel.notAfter < date, CertState.EXPIRED.value),
+        (CertsDbModel.revoked == True, CertState.REVOKED.value),
+        else_=CertState.VALID.value)
+
+
+def CertMetadata(serializedCert) -> dict:
+    """
+        Extracts the certificate's metadata stored along the certificate, in the certs table
+
+    :param serializedCert: the PEM serialized certificate
+    :return: the metadata dictionary, with the CertsDbModel columns names as keys
+    """
+    cert = CertFromSerializedCert(serializedCert)
+    commonNames = cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+    return {
+        "serial": str(cert.serial_number),
+        "notBefore": cert.not_valid_before,
+        "notAfter": cert.not_valid_after,
+        "subjectCN": commonNames[0].value if len(commonNames) else None,
+        "fingerprint": CertFingerprint(cert)
+    }
+
 def GetCRL(app, orgId, configArg=None):
+    """
+        Retrieves the organization's CRL. Unless a custom CA, validity or validity start is given, the CRL is served from
+        the crls table and rebuilt only if the revocations changed since it was built
+
+    :param app: the app object
+    :param orgId: the organization id
+    :param configArg: config
+    :return: the CRL object or its PEM serialization if config["serialize"] is set
+    """
+    from Database.Models import CrlsDbModel
+    from sqlalchemy.exc import IntegrityError
+
     config = {
         "serialize": False,
         **(configArg if type(configArg) == dict else {})
     }
-    caCert, caKey = GetCaCertAndKey(app, orgId, {
-        "serializedKeys": False
-    }) if "caCert" not in config or "caKey" not in config else (config["caCert"], config["caKey"])
-    validFrom = datetime.datetime.now() - datetime.timedelta(days=1) if "validFrom" not in config else config["validFrom"]
-    crlBuilder = x509.CertificateRevocationListBuilder().issuer_name(caCert.issuer).last_update(validFrom).next_update(
-        validFrom + datetime.timedelta(days = 3650 if "validity" not in config else config["validity"])
-    )
-    # add the revoked certificates
-    certsQuery = CertsDbModel.query.filter(CertsDbModel.orgId == orgId)
-    for certObj in certsQuery:
-        if StateFromCertDbObj(certObj) == CertState.REVOKED:
-            # add revoked certificate to crlBuilder
-            cert = CertFromCertObj(certObj)
-            crlBuilder = crlBuilder.add_revoked_certificate(x509.RevokedCertificateBuilder().serial_number(
-                cert.serial_number).revocation_date(validFrom).build(default_backend()))
-    crl: x509.CertificateRevocationList = crlBuilder.sign(caKey, hashes.SHA512(), default_backend())
-    return crl.public_bytes(serialization.Encoding.PEM) if config["serialize"] else crl
+    cached = "caCert" not in config and "caKey" not in config and "validFrom" not in config and \
+        "validity" not in config
+    crlObj = CrlsDbModel.query.filter(CrlsDbModel.orgId == orgId).first() if cached else None
+    if crlObj is not None and crlObj.crl is not None and crlObj.crlRevocationVersion == crlObj.revocationVersion:
+        crl = crlObj.crl
+    else:
+        caCert, caKey = GetCaCertAndKey(app, orgId, {
+            "serializedKeys": False
+        }) if "caCert" not in config or "caKey" not in config else (config["caCert"], config["caKey"])
+        if cached and crlObj is None:
+            # the org's row is created (without CRL) before collecting the revoked serials, since InvalidateCRLs updates
+            # only the existing rows: the revocations committed in the meantime then prevent storing a stale CRL
+            dbSession = app.Db().session
+            try:
+                dbSession.add(CrlsDbModel(orgId=orgId, revocationVersion=0))
+                dbSession.commit()
+            except IntegrityError: # another worker created it in the meantime
+                dbSession.rollback()
+            crlObj = CrlsDbModel.query.filter(CrlsDbModel.orgId == orgId).first()
+        revocationVersion = crlObj.revocationVersion if crlObj is not None else 0
+        validFrom = datetime.datetime.now() - datetime.timedelta(days=1) if "validFrom" not in config else config["validFrom"]
+        # collect the revoked certificates' serial numbers
+        revokedSerials = [int(row.serial) for row in CertsDbModel.query.with_entities(CertsDbModel.serial).filter(
+            CertsDbModel.orgId == orgId, CertStateSqlExpr() == CertState.REVOKED.value)]
+        crl = RunPkiJob(PkiJobs.SignCrlJob, caCert, caKey, revokedSerials, validFrom,
+                        validFrom + datetime.timedelta(days = 3650 if "validity" not in config else config["validity"]))
+        if cached:
+            dbSession = app.Db().session
+            # store it only if no revocation happened in the meantime
+            CrlsDbModel.query.filter(CrlsDbModel.orgId == orgId,
+                                     CrlsDbModel.revocationVersion == revocationVersion).update({
+                "crl": crl,
+                "crlRevocationVersion": revocationVersion
+            }, synchronize_session=False)
+            dbSession.commit()
+    return crl if config["serialize"] else x509.load_pem_x509_crl(crl, default_backend())
+
+
+def InvalidateCRLs(orgsIds):
+    """
+        Invalidates the cached CRLs of the given organizations, by incrementing their revocation version. It must be
+        called whenever certificates get revoked/unrevoked. The changes are committed by the caller. The organizations
+        without a crls row need none, since GetCRL creates the row before collecting the revoked serials
+
+    :param orgsIds: the organizations ids
+    """
+    from Database.Models import CrlsDbModel
+
+    CrlsDbModel.query.filter(CrlsDbModel.orgId.in_(orgsIds)).update({
+        "revocationVersion": CrlsDbModel.revocationVersion + 1
+    }, synchronize_session=False)
 
 
 def CertDbObj(entityId, orgId, srvType=False) -> CertsDbModel:
@@ -429,20 +810,113 @@ def CertDbObj(entityId, orgId, srvType=False) -> CertsDbModel:
 from io import BytesIO
 
 
-def PackConfigTree(treePath) -> BytesIO:
+#the config archives' compression codecs and their archive extensions. "tar" stands for uncompressed archives
+g_archiveCompressions = {
+    "xz": "tar.xz",
+    "gz": "tar.gz",
+    "zst": "tar.zst",
+    "tar": "tar"
+}
+
+
+def PackConfigEntries(entries, compression="xz", compressionLevel=None) -> BytesIO:
+    """
+        Packs a config archive in memory, without touching the disk
+
+    :param entries: the archive entries, as (name, data, mode) tuples. The name is the path inside the archive, the data
+    is the file content (bytes) or None for directories and the mode is the entry's permissions (i.e. 0o755)
+    :param compression: the compression codec - one of g_archiveCompressions keys. zst needs the zstandard package
+    :param compressionLevel: the codec's compression level (xz: 0-9, gz: 1-9, zst: 1-22). If None, the codec's default
+    level is used
+    :return: the archive stream, rewound
+    """
     import tarfile
+    import time
 
     tarFile = BytesIO()
-    with tarfile.open(fileobj=tarFile, mode="w:xz") as confTar:
-        for root, dirs, files in os.walk(treePath):
-            for fileItem in files:
-                confTar.add(os.path.join(root, fileItem), fileItem)
-            for dirItem in dirs:
-                confTar.add(os.path.join(root, dirItem), dirItem)
-            break
+    tarOpenArgs = {
+        "xz": {"mode": "w:xz", **({"preset": compressionLevel} if compressionLevel is not None else {})},
+        "gz": {"mode": "w:gz", **({"compresslevel": compressionLevel} if compressionLevel is not None else {})}
+    }.get(compression, {"mode": "w"}) #zst compresses the whole uncompressed tar
+    with tarfile.open(fileobj=tarFile, **tarOpenArgs) as confTar:
+        _AddConfigEntries(confTar, entries, time.time())
+    if compression == "zst":
+        import zstandard
+        tarFile = BytesIO(zstandard.ZstdCompressor(**({"level": compressionLevel} if compressionLevel is not None
+                                                      else {})).compress(tarFile.getvalue()))
     tarFile.seek(0)
     return tarFile
 
+
+def StreamConfigEntries(entriesGroups, compression="xz", compressionLevel=None):
+    """
+        Streaming version of PackConfigEntries: packs the archive incrementally, as a generator, so that the archive is
+        never entirely held in memory and its first chunks are sent while the next entries are still being produced
+
+    :param entriesGroups: iterable (usually a generator) of entries lists, as expected by PackConfigEntries. The
+    compressed data is yielded after each group
+    :param compression: the compression codec - one of g_archiveCompressions keys
+    :param compressionLevel: the codec's compression level. If None, the codec's default level is used
+    :return: generator of the archive's chunks
+    """
+    import tarfile
+    import time
+
+    class ChunksSink: #file like object collecting the tar stream's chunks
+        def __init__(self):
+            self.m_chunks = []
+
+        def write(self, data):
+            self.m_chunks.append(bytes(data))
+            return len(data)
+
+        def Drain(self):
+            data = b"".join(self.m_chunks)
+            self.m_chunks = []
+            return data
+
+    if compression == "xz":
+        import lzma
+        compressor = lzma.LZMACompressor(preset=compressionLevel)
+    elif compression == "gz":
+        import zlib
+        compressor = zlib.compressobj(compressionLevel if compressionLevel is not None else 9, zlib.DEFLATED,
+                                      31) #gzip container
+    elif compression == "zst":
+        import zstandard
+        compressor = zstandard.ZstdCompressor(**({"level": compressionLevel} if compressionLevel is not None
+                                                 else {})).compressobj()
+    else:
+        compressor = None
+
+    sink = ChunksSink()
+    mtime = time.time()
+    with tarfile.open(fileobj=sink, mode="w|") as confTar:
+        for entries in entriesGroups:
+            _AddConfigEntries(confTar, entries, mtime)
+            data = sink.Drain()
+            data = compressor.compress(data) if compressor is not None else data
+            if len(data):
+                yield data
+    data = sink.Drain() #the end of archive blocks
+    yield compressor.compress(data) + compressor.flush() if compressor is not None else data
+
+
+def _AddConfigEntries(confTar, entries, mtime):
+    import tarfile
+
+    for name, data, mode in entries:
+        tarInfo = tarfile.TarInfo(name)
+        tarInfo.mtime = mtime
+        tarInfo.mode = mode
+        if data is None:
+            tarInfo.type = tarfile.DIRTYPE
+            confTar.addfile(tarInfo)
+        else:
+            tarInfo.size = len(data)
+            confTar.addfile(tarInfo, BytesIO(data))
+
+
 def GenerateHostCACertAndKey(app, caCertDir, caCommonName):
     caCert, caKey = GenerateCa(app, {
         "serializedKeys": True,
@@ -460,7 +934,7 @@ def GenerateHostCertAndKey(app, certsDir, caCertPath, caKeyPath):
     with open(caCertPath, mode="rb") as f:
         caCert = x509.load_pem_x509_certificate(f.read(100000), default_backend())
     with open(caKeyPath, mode="rb") as f:
-        caKey = serialization.load_pem_private_key(f.read(100000), b'ToBeSetPasswd', default_backend())
+        caKey = LoadPrivateKey(f.read(100000))
     cert, key = GenerateCertAndKey(app, caCert, caKey, {
         "srvType": True,
         "serializedKeys": True,
@@ -0,0 +1,119 @@
+import threading
+
+from flask_restx import abort
+
+from Utils.SettingsUtils import EnvOrSetting
+
+#the Liny's auth server JWT signing public key
+g_defaultKeyId = "lxTkvONAr97dOiitHFVP4-6KHxZIqGfXNC11c6Q-OIU"
+g_defaultPublicKey = """-----BEGIN PUBLIC KEY-----
+MIGbMBAGByqGSM49AgEGBSuBBAAjA4GGAAQBbt1qDq8dkPg2KAyDW6eiI0kxotiFukwN3x6lfzPCRXkgk00qzExAlu60f6dS9Rn8B3Dz91LoFtxm++z+W7ztI7cALJao3yVGqhZ/Q6xxPy7HOA1u2qn2YZOinf6HYDydLeoGbaeKJgBGqu/FmImlDOsz/R5xABlNZyJtjlQklNa/nho=
+-----END PUBLIC KEY-----
+"""
+g_defaultAlgorithm = "ES512"
+
+
+class JwtVerifier:
+    """
+        JWT verifier holding the already loaded verification keys: the default (Liny's auth server) public key and,
+        optionally, the keys of a JWKS file (JWT_JWKS_FILE setting), looked up by the tokens' "kid" header.
+
+        The already verified tokens are cached (by their hash) until they expire, but no longer than JWT_TOKENS_CACHE_TTL
+        seconds, so the repeated requests carrying the same token skip the signature verification
+    """
+
+    def __init__(self):
+        import jwt
+        from Utils.Cache import TtlCache
+
+        self.m_issuer = EnvOrSetting("JWT_ISSUER", defaultValue="https://www.liny.io/auth/realms/liny")
+        self.m_keys = {
+            g_defaultKeyId: (jwt.algorithms.ECAlgorithm(jwt.algorithms.ECAlgorithm.SHA512).prepare_key(
+                g_defaultPublicKey), g_defaultAlgorithm)
+        }
+        jwksFile = EnvOrSetting("JWT_JWKS_FILE", defaultValue=None)
+        self.m_jwksLoaded = jwksFile is not None and len(jwksFile) > 0
+        if self.m_jwksLoaded:
+            self.m_keys.update(self.LoadJwks(jwksFile))
+        self.m_tokensCacheTtl = int(EnvOrSetting("JWT_TOKENS_CACHE_TTL", defaultValue=300))
+        self.m_tokensCache = TtlCache(int(EnvOrSetting("JWT_TOKENS_CACHE_SIZE", defaultValue=1024)),
+                                      self.m_tokensCacheTtl)
+
+    @staticmethod
+    def LoadJwks(jwksFile):
+        """
+            Loads the signing keys of a JWKS file
+
+        :param jwksFile: the JWKS (json) file path
+        :return: a dictionary mapping the keys ids to (key, algorithm) tuples
+        """
+        import json
+        import jwt
+
+        with open(jwksFile, "r") as f:
+            jwks = json.load(f)
+        keys = {}
+        for jwk in jwks.get("keys", []):
+            if "kid" not in jwk or jwk.get("use", "sig") != "sig":
+                continue
+            pyJwk = jwt.PyJWK(jwk, jwk.get("alg", g_defaultAlgorithm))
+            keys[jwk["kid"]] = (pyJwk.key, jwk.get("alg", g_defaultAlgorithm))
+        return keys
+
+    def Verify(self, encodedJwt) -> dict:
+        """
+            Verifies a JWT
+
+        :param encodedJwt: the encoded JWT
+        :return: the JWT claims or aborts with 401 http status if the JWT is invalid
+        """
+        import jwt
+        import time
+        from hashlib import sha256
+
+        tokenHash = sha256(encodedJwt.encode()).digest()
+        claims = self.m_tokensCache.Get(tokenHash)
+        if claims is not None:
+            return claims
+
+        try:
+            jwtHeaders = jwt.get_unverified_header(encodedJwt)
+        except Exception as e:
+            abort(401, "Error decoding/authenticating JWT - " + str(e))
+        if jwtHeaders.get("typ", "JWT") != "JWT":
+            abort(401, "Invalid JWT headers")
+        keyId = jwtHeaders.get("kid", g_defaultKeyId)
+        if keyId not in self.m_keys:
+            if self.m_jwksLoaded:
+                abort(401, "Invalid JWT headers - unknown key id")
+            keyId = g_defaultKeyId
+        key, algorithm = self.m_keys[keyId]
+        try:
+            claims = jwt.decode(encodedJwt, key, [algorithm], {
+                "verify_signature": True,
+                "verify_aud": False,
+                "require": ["exp", "iat", "sub"]
+            }, issuer=self.m_issuer)
+        except Exception as e:
+            abort(401, "Error decoding/authenticating JWT - " + str(e))
+        ttl = min(claims["exp"] - time.time(), self.m_tokensCacheTtl)
+        if ttl > 0:
+            self.m_tokensCache.Set(tokenHash, claims, ttl)
+        return claims
+
+
+g_jwtVerifier = None
+g_jwtVerifierLock = threading.Lock()
+
+
+def GetJwtVerifier() -> JwtVerifier:
+    """
+        Retrieves the process' JWT verifier, creating it if needed
+
+    :return: the JWT verifier
+    """
+    global g_jwtVerifier
+    with g_jwtVerifierLock:
+        if g_jwtVerifier is None:
+            g_jwtVerifier = JwtVerifier()
+        return g_jwtVerifier
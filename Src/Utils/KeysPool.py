@@ -0,0 +1,115 @@
+import os
+import threading
+
+from Utils.SettingsUtils import EnvOrSetting
+
+
+class KeysPool:
+    """
+        Pool of pre-generated private keys, stored encrypted in the keysPool table.
+
+        The keys are drawn by the certificates issuance code and the pool is refilled by a background worker thread,
+        whenever the keys number drops under the low-water mark. Each process has its own worker (see GetKeysPool), but
+        all of them share the same db table.
+
+        The pool is refilled with keys of the default key profile (KEY_PROFILE setting), when it's an RSA one. The keys
+        of the other profiles left in the pool (e.g. after changing the setting) are still drawn, by profile
+    """
+
+    def __init__(self, app):
+        from Utils.CertsUtils import DefaultKeyProfile
+
+        self.m_app = app
+        self.m_keyProfile = DefaultKeyProfile()
+        self.m_depth = int(EnvOrSetting("KEYS_POOL_DEPTH", defaultValue=32))
+        self.m_lowWaterMark = int(EnvOrSetting("KEYS_POOL_LOW_WATER_MARK", defaultValue=8))
+        self.m_checkInterval = int(EnvOrSetting("KEYS_POOL_CHECK_INTERVAL", defaultValue=60))
+        self.m_refillEvent = threading.Event()
+        self.m_refillEvent.set()  # check the pool level right away
+        self.m_worker = threading.Thread(target=self._Worker, name="KeysPoolWorker", daemon=True)
+        self.m_worker.start()
+
+    def Pop(self, keyProfile=None):
+        """
+            Draws a key from the pool
+
+        :param keyProfile: the key profile. If None, the pool's (default) key profile
+        :return: the PEM serialized (encrypted) private key or None if the pool has no key of the given profile
+        """
+        from Database.Models import KeysPoolDbModel
+
+        dbSession = self.m_app.Db().session
+        keysQuery = KeysPoolDbModel.query.filter(KeysPoolDbModel.keyProfile == (keyProfile or self.m_keyProfile))
+        serializedKey = None
+        while serializedKey is None:
+            keyObj = keysQuery.order_by(KeysPoolDbModel.id).first()
+            if keyObj is None:
+                break
+            candidateKey = keyObj.key
+            # claim the key. Another process might have claimed it in the meantime, so check the deleted rows number
+            claimed = KeysPoolDbModel.query.filter(KeysPoolDbModel.id == keyObj.id).delete(synchronize_session=False)
+            dbSession.commit()
+            if claimed == 1:
+                serializedKey = candidateKey
+        self.m_refillEvent.set()  # let the worker check the pool level
+        return serializedKey
+
+    def Refill(self):
+        """
+            Refills the pool up to its depth, if the keys number is under the low-water mark
+
+        :return: the number of generated keys
+        """
+        from Database.Models import KeysPoolDbModel
+        from Utils import PkiJobs
+        from Utils.CertsUtils import g_keysPasswd, PooledKeyProfile
+        from Utils.PkiExecutor import RunPkiJob
+
+        if not PooledKeyProfile(self.m_keyProfile):
+            return 0
+        keysQuery = KeysPoolDbModel.query.filter(KeysPoolDbModel.keyProfile == self.m_keyProfile)
+        keysNo = keysQuery.count()
+        if keysNo >= self.m_lowWaterMark:
+            return 0
+        dbSession = self.m_app.Db().session
+        generatedKeysNo = 0
+        while keysNo < self.m_depth:
+            dbSession.add(KeysPoolDbModel(keyProfile=self.m_keyProfile, key=RunPkiJob(
+                PkiJobs.GenerateKeyJob, g_keysPasswd, self.m_keyProfile)))
+            dbSession.commit()  # commit each key, so that it's available right away
+            generatedKeysNo += 1
+            keysNo = keysQuery.count()  # the other processes might refill the pool, as well
+        return generatedKeysNo
+
+    def _Worker(self):
+        while True:
+            self.m_refillEvent.wait(self.m_checkInterval)
+            self.m_refillEvent.clear()
+            try:
+                with self.m_app.app_context():
+                    self.Refill()
+            except Exception as e:
+                print("Error refilling the keys pool - " + str(e))
+
+
+g_keysPool = None
+g_keysPoolPid = None
+g_keysPoolLock = threading.Lock()
+
+
+def GetKeysPool(app):
+    """
+        Retrieves the process' keys pool, creating it (along with its worker) if needed. The pool is recreated in forked
+        processes, since the worker thread doesn't survive the fork
+
+    :param app: the app object
+    :return: the keys pool object or None if the keys pool is disabled
+    """
+    global g_keysPool, g_keysPoolPid
+    if not EnvOrSetting("KEYS_POOL", defaultValue=True):
+        return None
+    with g_keysPoolLock:
+        if g_keysPool is None or g_keysPoolPid != os.getpid():
+            g_keysPool = KeysPool(app)
+            g_keysPoolPid = os.getpid()
+        return g_keysPool
@@ -0,0 +1,137 @@
+"""
+    Cross process leases, stored in the leases table, and the single-flight helper built on them.
+
+    A lease is a row named after the leased resource, inserted by its holder: the primary key makes sure a single
+    process (or thread) holds it at once, regardless of the uWSGI workers or the nodes sharing the db. The leases expire
+    (LEASES_TTL seconds), so the ones left behind by crashed holders are taken over. The leases rows are inserted and
+    deleted on their own connections, leaving the callers' session transactions untouched
+"""
+import datetime
+import os
+import socket
+import threading
+import time
+import uuid
+
+from Utils.SettingsUtils import EnvOrSetting
+
+
+class Lease:
+    def __init__(self, app, name, configArg=None):
+        """
+        :param app: the app object
+        :param name: the leased resource name
+        :param configArg: config:
+            * "ttl" - the lease's time to live, in seconds. The holder must release (or renew) the lease before it
+            expires
+            * "waitTimeout" - the maximum number of seconds Acquire waits for the lease
+        """
+        ttl = int(EnvOrSetting("LEASES_TTL", defaultValue=120))
+        self.m_config = {
+            "ttl": ttl,
+            "waitTimeout": ttl + 10,  # long enough for taking over an abandoned lease
+            **(configArg if type(configArg) is dict else {})
+        }
+        self.m_app = app
+        self.m_name = name
+        self.m_owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex}"
+        self.m_held = False
+
+    def TryAcquire(self) -> bool:
+        """
+            Acquires the lease if it's free or expired, without waiting
+
+        :return: True if the lease was acquired and False if another holder has it
+        """
+        from sqlalchemy.exc import IntegrityError
+        from Database.Errors import IntegrityErrorKind
+        from Database.Models import LeasesDbModel
+
+        leasesTable = LeasesDbModel.__table__
+        engine = self.m_app.Db().engine
+        for _ in range(2):  # the second attempt follows the expired lease's removal
+            now = datetime.datetime.utcnow()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(leasesTable.insert(), {"name": self.m_name, "owner": self.m_owner,
+                                                        "expiresAt": now + datetime.timedelta(seconds=self.m_config["ttl"])})
+                self.m_held = True
+                return True
+            except IntegrityError as e:
+                if IntegrityErrorKind(e) != "unique":
+                    raise
+            with engine.begin() as conn:
+                if conn.execute(leasesTable.delete().where(leasesTable.c.name == self.m_name,
+                                                           leasesTable.c.expiresAt < now)).rowcount == 0:
+                    return False
+        return False
+
+    def Acquire(self):
+        """
+            Acquires the lease, waiting for the current holder to release it (or for the lease to expire)
+
+        :return: the lease object or aborts with 503 http status if the lease couldn't be acquired in time
+        """
+        from flask_restx import abort
+
+        giveUpAt = time.monotonic() + self.m_config["waitTimeout"]
+        pollInterval = 0.05
+        while not self.TryAcquire():
+            if time.monotonic() >= giveUpAt:
+                abort(503, f"Timeout waiting for \"{self.m_name}\" lease")
+            time.sleep(pollInterval)
+            pollInterval = min(pollInterval * 2, 1)
+        return self
+
+    def Renew(self) -> bool:
+        """
+            Extends the held lease by its time to live
+
+        :return: True if the lease is still held and False if it expired and got taken over
+        """
+        from Database.Models import LeasesDbModel
+
+        leasesTable = LeasesDbModel.__table__
+        with self.m_app.Db().engine.begin() as conn:
+            self.m_held = conn.execute(leasesTable.update().where(
+                leasesTable.c.name == self.m_name, leasesTable.c.owner == self.m_owner).values(
+                expiresAt=datetime.datetime.utcnow() + datetime.timedelta(seconds=self.m_config["ttl"]))).rowcount == 1
+        return self.m_held
+
+    def Release(self):
+        from Database.Models import LeasesDbModel
+
+        if not self.m_held:
+            return
+        leasesTable = LeasesDbModel.__table__
+        with self.m_app.Db().engine.begin() as conn:
+            conn.execute(leasesTable.delete().where(leasesTable.c.name == self.m_name,
+                                                    leasesTable.c.owner == self.m_owner))
+        self.m_held = False
+
+    def __enter__(self):
+        return self.Acquire()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.Release()
+
+
+def SingleFlight(app, name, lookupFn, generateFn):
+    """
+        Retrieves something generated at most once, even when requested concurrently by several processes: if the
+        lookup finds nothing, the generation runs under the name's lease. The concurrent callers wait for the lease and
+        then find the generated result, instead of generating it again
+
+    :param app: the app object
+    :param name: the generated resource's lease name, e.g. "ca:<orgId>"
+    :param lookupFn: function retrieving the already generated result, or None if missing. It must read the committed
+    db state (no stale session objects)
+    :param generateFn: function generating (and committing) the result
+    :return: the looked up or the generated result
+    """
+    result = lookupFn()
+    if result is not None:
+        return result
+    with Lease(app, name):
+        result = lookupFn()  # the previous lease holder might have generated it
+        return result if result is not None else generateFn()
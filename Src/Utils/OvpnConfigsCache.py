@@ -0,0 +1,81 @@
+"""
+    Cache of the rendered OpenVPN configs (the final files/archives), keyed by a hash of everything a config is built
+    from: the config template and its version, the request's config vars (os, ports, protos, nets, srvHost), the entity
+    name, the certificate's fingerprint, the CA certificate, the CRL revocation version and the TLS key. Any change of
+    these inputs yields a different key, so the cache entries never need explicit invalidation - the stale ones just age
+    out of the LRU. The certificate and the CA are identified by their content rather than by their rows ids, since the
+    ids of the deleted rows might be reused (SQLite) by the recreated CA and certificates.
+
+    The same key is used as the configs' (weak) ETag
+"""
+import os
+import threading
+
+from Utils.Cache import LruBytesCache
+from Utils.SettingsUtils import EnvOrSetting
+
+
+def OvpnConfigCacheKey(configTemplateClass, entity, orgId, srvId, srvType, configVars):
+    """
+        Computes the cache key of a config, without decrypting or generating anything
+
+    :param configTemplateClass: the config template class
+    :param entity: the entity (user or server) db object
+    :param orgId: the organization id
+    :param srvId: the server id (the entity id for server configs)
+    :param srvType: True if the config is for a server and False otherwise
+    :param configVars: the config vars retrieved from the request
+    :return: the cache key or None if the config can't be cached yet, since some of its parts (CA, certificate or TLS
+    key) are about to be (re)generated
+    """
+    from hashlib import sha256
+    import json
+    from Database.Models import CasDbModel, CrlsDbModel, ServersExtraInfoDbModel
+    from Utils.CertsUtils import CertDbObj, StateFromCertDbObj, CertState
+
+    caCert = CasDbModel.query.with_entities(CasDbModel.cert).filter(CasDbModel.orgId == orgId).scalar()
+    if caCert is None:
+        return None
+    certObj = CertDbObj(entity.id, orgId, srvType)
+    if certObj is None or StateFromCertDbObj(certObj) != CertState.VALID:
+        return None
+    tlsKey = ServersExtraInfoDbModel.query.with_entities(ServersExtraInfoDbModel.tlsKey).\
+        filter(ServersExtraInfoDbModel.srvId == srvId).scalar()
+    if not tlsKey:
+        return None
+    # the CRL gets (re)built for the current revocation version, if needed, while rendering the config
+    crlVersion = CrlsDbModel.query.with_entities(CrlsDbModel.revocationVersion).\
+        filter(CrlsDbModel.orgId == orgId).scalar()
+    keyComponents = {
+        "template": configTemplateClass.__module__,
+        "templateVersion": configTemplateClass.Info()["version"],
+        "configVars": configVars,
+        "entityName": entity.name,
+        "certFingerprint": certObj.fingerprint or sha256(bytes(certObj.cert)).hexdigest(),
+        "caCert": sha256(bytes(caCert)).hexdigest(),
+        "crlVersion": crlVersion or 0,
+        "tlsKey": sha256(tlsKey if isinstance(tlsKey, bytes) else tlsKey.encode()).hexdigest()
+    }
+    return sha256(json.dumps(keyComponents, sort_keys=True, default=str).encode()).hexdigest()
+
+
+g_ovpnConfigsCache = None
+g_ovpnConfigsCachePid = None
+g_ovpnConfigsCacheLock = threading.Lock()
+
+
+def GetOvpnConfigsCache():
+    """
+        Retrieves the process' rendered configs cache, creating it if needed
+
+    :return: the cache object or None if the cache is disabled (OVPN_CONFIGS_CACHE_MAX_BYTES set to 0)
+    """
+    global g_ovpnConfigsCache, g_ovpnConfigsCachePid
+    maxBytes = int(EnvOrSetting("OVPN_CONFIGS_CACHE_MAX_BYTES", defaultValue=32 * 1024 * 1024))
+    if maxBytes <= 0:
+        return None
+    with g_ovpnConfigsCacheLock:
+        if g_ovpnConfigsCache is None or g_ovpnConfigsCachePid != os.getpid():
+            g_ovpnConfigsCache = LruBytesCache(maxBytes)
+            g_ovpnConfigsCachePid = os.getpid()
+        return g_ovpnConfigsCache
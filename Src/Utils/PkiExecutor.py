@@ -0,0 +1,141 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask_restx import abort
+
+from Utils.SettingsUtils import EnvOrSetting
+
+
+class PkiExecutor:
+    """
+        Process pool based executor for the CPU bound PKI jobs (see Utils.PkiJobs), so that the web service workers keep
+        serving the cheap requests while the heavy crypto operations run on the other cores.
+
+        The number of the in-flight jobs (running and queued) is bounded and each job has a timeout
+    """
+
+    def __init__(self, workersNo, maxQueuedJobs, jobTimeout):
+        import multiprocessing
+        from sys import platform
+
+        # fork is the only start method which doesn't depend on sys.executable, which is the uWSGI binary when running
+        # under uWSGI
+        self.m_executor = ProcessPoolExecutor(workersNo, None if platform.startswith('win32') else
+                                              multiprocessing.get_context("fork"))
+        self.m_slots = threading.BoundedSemaphore(workersNo + maxQueuedJobs)
+        self.m_jobTimeout = jobTimeout
+
+    def Run(self, jobFn, *jobArgs):
+        """
+            Runs a job on the process pool and waits for its result
+
+        :param jobFn: the job function. It must be a module level function
+        :param jobArgs: the job arguments. The x509 certificates and private keys objects are sent PEM serialized
+        :return: the job's result or aborts with 503 http status if the executor is busy or 504 if the job timed out
+        """
+        return self.Map(jobFn, [jobArgs])[0]
+
+    def Map(self, jobFn, jobsArgs):
+        """
+            Runs a job for each of the given arguments tuples, in parallel, and waits for all of them
+
+        :param jobFn: the job function. It must be a module level function
+        :param jobsArgs: the jobs' arguments tuples
+        :return: the jobs' results, in the jobsArgs order, or aborts with 503 http status if the executor is busy or 504
+        if any of the jobs timed out
+        """
+        futures = []
+        try:
+            for jobArgs in jobsArgs:
+                # when all slots are taken, wait for the previously submitted jobs to free some
+                if not self.m_slots.acquire(timeout=self.m_jobTimeout):
+                    abort(503, "PKI executor is busy")
+                try:
+                    future = self.m_executor.submit(jobFn, *[_PicklableJobArg(jobArg) for jobArg in jobArgs])
+                except:
+                    self.m_slots.release()
+                    raise
+                future.add_done_callback(lambda doneFuture: self.m_slots.release())
+                futures.append(future)
+            return [future.result(timeout=self.m_jobTimeout) for future in futures]
+        except FutureTimeoutError:
+            abort(504, "PKI job timed out")
+        finally:
+            for future in futures: # no-op for the completed jobs
+                future.cancel()
+
+    def Shutdown(self):
+        self.m_executor.shutdown(wait=False)
+
+
+def _PicklableJobArg(jobArg):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import serialization
+
+    if isinstance(jobArg, x509.Certificate):
+        return jobArg.public_bytes(serialization.Encoding.PEM)
+    elif hasattr(jobArg, "private_bytes"):
+        from Utils.PkiJobs import SerializeKeyJob
+        return SerializeKeyJob(jobArg)
+    return jobArg
+
+
+g_pkiExecutor = None
+g_pkiExecutorPid = None
+g_pkiExecutorLock = threading.Lock()
+
+
+def GetPkiExecutor():
+    """
+        Retrieves the process' PKI executor, creating it if needed. The executor is recreated in forked processes, since
+        its pool belongs to the parent process
+
+    :return: the PKI executor or None if it's disabled (PKI_EXECUTOR_WORKERS set to 0)
+    """
+    global g_pkiExecutor, g_pkiExecutorPid
+    workersNo = int(EnvOrSetting("PKI_EXECUTOR_WORKERS", defaultValue=2))
+    if workersNo <= 0:
+        return None
+    with g_pkiExecutorLock:
+        if g_pkiExecutor is None or g_pkiExecutorPid != os.getpid():
+            g_pkiExecutor = PkiExecutor(workersNo, int(EnvOrSetting("PKI_EXECUTOR_MAX_QUEUED_JOBS", defaultValue=16)),
+                                        int(EnvOrSetting("PKI_EXECUTOR_JOB_TIMEOUT", defaultValue=120)))
+            g_pkiExecutorPid = os.getpid()
+        return g_pkiExecutor
+
+
+def RunPkiJob(jobFn, *jobArgs):
+    """
+        Runs a PKI job on the process' PKI executor or inline, if the executor is disabled
+
+    :param jobFn: the job function (see Utils.PkiJobs)
+    :param jobArgs: the job arguments
+    :return: the job's result
+    """
+    return RunPkiJobs(jobFn, [jobArgs])[0]
+
+
+def RunPkiJobs(jobFn, jobsArgs):
+    """
+        Runs a PKI job for each of the given arguments tuples, in parallel on the process' PKI executor, or inline, one
+        after another, if the executor is disabled
+
+    :param jobFn: the job function (see Utils.PkiJobs)
+    :param jobsArgs: the jobs' arguments tuples
+    :return: the jobs' results, in the jobsArgs order
+    """
+    global g_pkiExecutor
+    pkiExecutor = GetPkiExecutor()
+    if pkiExecutor is None:
+        return [jobFn(*jobArgs) for jobArgs in jobsArgs]
+    try:
+        return pkiExecutor.Map(jobFn, jobsArgs)
+    except BrokenProcessPool:
+        # one of the pool's processes died abruptly. Drop the executor, so that a new one gets created on the next job
+        with g_pkiExecutorLock:
+            if g_pkiExecutor is pkiExecutor:
+                g_pkiExecutor = None
+        pkiExecutor.Shutdown()
+        abort(500, "PKI executor failure")
@@ -0,0 +1,221 @@
+"""
+    CPU bound PKI jobs (keys generation, certificates and CRLs signing, keys decryption).
+
+    The jobs are submitted to the PKI executor (see Utils.PkiExecutor) so they must stay top level functions, with
+    picklable arguments and results. The certificates and keys are accepted either as objects (when the jobs run inline)
+    or in PEM format and the results are always PEM serialized. The module must only depend on cryptography, for
+    keeping the executor's processes light
+"""
+import datetime
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization, hashes
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+from cryptography.x509 import NameOID
+
+#the keys profiles: the key type and its size (RSA) or curve (ECDSA)
+g_keyProfiles = {
+    "rsa-2048": ("rsa", 2048),
+    "rsa-3072": ("rsa", 3072),
+    "rsa-4096": ("rsa", 4096),
+    "ecdsa-p256": ("ecdsa", ec.SECP256R1),
+    "ecdsa-p384": ("ecdsa", ec.SECP384R1),
+    "ed25519": ("ed25519", None)
+}
+g_defaultKeyProfile = "rsa-4096"
+
+
+def ToPrivateKey(key):
+    return serialization.load_pem_private_key(key, None, default_backend()) if isinstance(key, bytes) else key
+
+
+def ToCert(cert) -> x509.Certificate:
+    return x509.load_pem_x509_certificate(cert, default_backend()) if isinstance(cert, bytes) else cert
+
+
+def SerializeKeyJob(key, passwd=None) -> bytes:
+    return ToPrivateKey(key).private_bytes(encoding=serialization.Encoding.PEM,
+                                           format=serialization.PrivateFormat.PKCS8,
+                                           encryption_algorithm=serialization.BestAvailableEncryption(passwd)
+                                           if passwd is not None else serialization.NoEncryption())
+
+
+def NewKey(keyProfile=g_defaultKeyProfile):
+    keyType, keyParam = g_keyProfiles[keyProfile]
+    if keyType == "rsa":
+        return rsa.generate_private_key(65537, keyParam, default_backend())
+    elif keyType == "ecdsa":
+        return ec.generate_private_key(keyParam(), default_backend())
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+def KeyProfile(key) -> str:
+    """
+        Retrieves the profile of a key
+
+    :param key: the private or public key object, or a certificate (its public key's profile is retrieved)
+    :return: the key profile name or None if the key doesn't match any profile
+    """
+    if isinstance(key, x509.Certificate):
+        key = key.public_key()
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        profile = ("rsa", key.key_size)
+    elif isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        profile = ("ecdsa", type(key.curve))
+    elif isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        profile = ("ed25519", None)
+    else:
+        return None
+    return next((name for name, keyProfile in g_keyProfiles.items() if keyProfile == profile), None)
+
+
+def SignatureHash(signingKey):
+    """
+        Retrieves the hash algorithm used for signing with the given key: SHA-512 for the RSA keys, the hash matching
+        the curve size for the ECDSA keys and None (the algorithm's own) for the Ed25519 keys
+    """
+    if isinstance(signingKey, ec.EllipticCurvePrivateKey):
+        return hashes.SHA256() if signingKey.curve.key_size <= 256 else hashes.SHA384()
+    elif isinstance(signingKey, ed25519.Ed25519PrivateKey):
+        return None
+    return hashes.SHA512()
+
+
+def GenerateKeyJob(passwd=None, keyProfile=g_defaultKeyProfile) -> bytes:
+    return SerializeKeyJob(NewKey(keyProfile), passwd)
+
+
+def DecryptKeyJob(serializedKey, passwd) -> bytes:
+    return SerializeKeyJob(serialization.load_pem_private_key(serializedKey, passwd, default_backend()))
+
+
+def SignCaJob(caKey, config) -> bytes:
+    caKey = ToPrivateKey(caKey)
+    subject = issuer = x509.Name([
+        x509.NameAttribute(entry["nameOID"], config["CA"][entry["name"]]) for entry in (caConfigEntry for caConfigEntry in [{
+            "name": "commonName",
+            "nameOID": NameOID.COMMON_NAME
+        }, {
+            "name": "country",
+            "nameOID": NameOID.COUNTRY_NAME
+        }, {
+            "name": "state",
+            "nameOID": NameOID.STATE_OR_PROVINCE_NAME
+        }, {
+            "name": "location",
+            "nameOID": NameOID.LOCALITY_NAME
+        }, {
+            "name": "orgName",
+            "nameOID": NameOID.ORGANIZATION_NAME
+        }, {
+            "name": "email",
+            "nameOID": NameOID.EMAIL_ADDRESS
+        }, {
+            "name": "orgUnitName",
+            "nameOID": NameOID.ORGANIZATIONAL_UNIT_NAME
+        }
+        ] if caConfigEntry["name"] in config["CA"])
+    ])
+    subjectKeyIdentifier = x509.SubjectKeyIdentifier.from_public_key(caKey.public_key())
+    serialNumber = x509.random_serial_number()
+    validUntil = config["caValidFrom"] + datetime.timedelta(days=config["caValidity"])
+    caCert = x509.CertificateBuilder().subject_name(subject).issuer_name(issuer).public_key(caKey.public_key()). \
+        serial_number(serialNumber). \
+        not_valid_before(config["caValidFrom"]). \
+        not_valid_after(validUntil). \
+        add_extension(subjectKeyIdentifier, critical=False). \
+        add_extension(x509.AuthorityKeyIdentifier(subjectKeyIdentifier.digest, [x509.DirectoryName(issuer)],
+                                                  serialNumber), critical=False). \
+        add_extension(x509.BasicConstraints(True, 0  # CA true and for now we'll not use intermediate CAs
+                                            ), critical=False). \
+        sign(caKey, SignatureHash(caKey), default_backend())  # Sign our certificate with our private key
+    return caCert.public_bytes(encoding=serialization.Encoding.PEM)
+
+
+def RenewCaJob(caCert, caKey, validFrom, validity) -> bytes:
+    """
+        Signs again a CA certificate, for a new validity window. The subject, the key, the serial number and the
+        extensions are kept, so the certificates issued by the CA (whose authority key identifier holds the CA's serial
+        number) and its CRLs still chain up to the renewed certificate
+
+    :return: the renewed CA certificate, PEM serialized
+    """
+    caCert = ToCert(caCert)
+    caKey = ToPrivateKey(caKey)
+    caCertBuilder = x509.CertificateBuilder().subject_name(caCert.subject).issuer_name(caCert.issuer). \
+        public_key(caCert.public_key()). \
+        serial_number(caCert.serial_number). \
+        not_valid_before(validFrom). \
+        not_valid_after(validFrom + datetime.timedelta(days=validity))
+    for extension in caCert.extensions:
+        caCertBuilder = caCertBuilder.add_extension(extension.value, extension.critical)
+    return caCertBuilder.sign(caKey, SignatureHash(caKey), default_backend()).public_bytes(serialization.Encoding.PEM)
+
+
+def SignCertJob(caCert, caKey, key, config) -> bytes:
+    caCert = ToCert(caCert)
+    pubKey = ToPrivateKey(key).public_key()
+    serialNumber = config["serialNo"]
+    subjectKeyIdentifier = x509.SubjectKeyIdentifier.from_public_key(pubKey)
+    subjectAttrs = [ x509.NameAttribute(entry["nameOID"], config["entity"][entry["name"]]) for entry in [{
+        "name": "country",
+        "nameOID": NameOID.COUNTRY_NAME
+    }, {
+        "name": "state",
+        "nameOID": NameOID.STATE_OR_PROVINCE_NAME
+    }, {
+        "name": "location",
+        "nameOID": NameOID.LOCALITY_NAME
+    }, {
+        "name": "name",
+        "nameOID": NameOID.COMMON_NAME
+    }] if entry["name"] in config["entity"]
+    ] + [ x509.NameAttribute(entry["nameOID"], config["org"][entry["name"]]) for entry in [{
+        "name": "name",
+        "nameOID": NameOID.ORGANIZATION_NAME
+    }, {
+        "name": "unitName",
+        "nameOID": NameOID.ORGANIZATIONAL_UNIT_NAME
+    }] if entry["name"] in config["org"]
+    ]
+    srvType = config["srvType"]
+    if not srvType and "email" in config["entity"]:
+        subjectAttrs.append(x509.NameAttribute(NameOID.EMAIL_ADDRESS,
+                                               config["entity"]["email"]))  # user certificate also have email address in its subject
+
+    certBuilder = x509.CertificateBuilder(). \
+        subject_name(x509.Name(subjectAttrs)). \
+        issuer_name(caCert.subject). \
+        public_key(pubKey). \
+        serial_number(serialNumber). \
+        not_valid_before(config["validFrom"]). \
+        not_valid_after(config["validFrom"] + datetime.timedelta(days=config["validity"])). \
+        add_extension(x509.BasicConstraints(False, None), critical=True). \
+        add_extension(subjectKeyIdentifier, critical=False). \
+        add_extension(x509.AuthorityKeyIdentifier(caCert.extensions.get_extension_for_class(x509.SubjectKeyIdentifier).
+                                                  value.digest, [x509.DirectoryName(caCert.subject)],
+                                                  caCert.serial_number), critical=False)
+    if srvType:  # server certificate
+        certBuilder = certBuilder.add_extension(x509.ExtendedKeyUsage([x509.OID_SERVER_AUTH]), critical=False)
+    # the key encipherment is meaningful just for the RSA keys (RSA key exchange). The ECDSA and Ed25519 keys only sign
+    certBuilder = certBuilder.add_extension(
+        x509.KeyUsage(digital_signature=True, content_commitment=False,
+                      key_encipherment=isinstance(pubKey, rsa.RSAPublicKey),
+                      data_encipherment=False, key_agreement=False, key_cert_sign=False,
+                      crl_sign=False, encipher_only=False, decipher_only=False), critical=True). \
+        add_extension(x509.SubjectAlternativeName([x509.DNSName(config["entity"]["name"])]), critical=False)
+    caKey = ToPrivateKey(caKey)
+    cert = certBuilder.sign(caKey, SignatureHash(caKey), default_backend())  # Sign our certificate with CA's private key
+    return cert.public_bytes(serialization.Encoding.PEM)
+
+
+def SignCrlJob(caCert, caKey, revokedSerials, lastUpdate, nextUpdate) -> bytes:
+    crlBuilder = x509.CertificateRevocationListBuilder().issuer_name(ToCert(caCert).issuer).last_update(lastUpdate).\
+        next_update(nextUpdate)
+    for serialNumber in revokedSerials:
+        crlBuilder = crlBuilder.add_revoked_certificate(x509.RevokedCertificateBuilder().serial_number(
+            serialNumber).revocation_date(lastUpdate).build(default_backend()))
+    caKey = ToPrivateKey(caKey)
+    crl: x509.CertificateRevocationList = crlBuilder.sign(caKey, SignatureHash(caKey), default_backend())
+    return crl.public_bytes(serialization.Encoding.PEM)
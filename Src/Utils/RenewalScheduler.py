@@ -0,0 +1,183 @@
+"""
+    Proactive renewal of the certificates and CAs about to expire, so that the config downloads find valid certificates
+    rather than paying for the issuance of the expired ones.
+
+    A scan renews the CAs and the (last, not revoked) certificates of the bound entities expiring within the next
+    RENEWAL_HORIZON days. The certificates are renewed in small batches (RENEWAL_BATCH_SIZE), with pauses in between
+    (RENEWAL_BATCH_PAUSE) and at most RENEWAL_MAX_PER_SCAN per scan, so the PKI executor is mostly left to the requests.
+    They're renewed according to the CERTS_RENEW_MODE setting. The already expired certificates are left to the lazy
+    renewal, on download.
+
+    The scans run under the "renewal" lease, so a single process scans at once: either the background worker of one of
+    the web service processes (RENEWAL_SCHEDULER setting), every RENEWAL_SCAN_INTERVAL seconds, or a one-off process
+    started with --renew-expiring (e.g. from cron)
+"""
+import datetime
+import os
+import threading
+import time
+
+from Utils.SettingsUtils import EnvOrSetting
+
+g_renewalLeaseName = "renewal"
+
+
+class RenewalScheduler:
+    def __init__(self, app, configArg=None):
+        """
+        :param app: the app object
+        :param configArg: config, defaulting to the RENEWAL_* settings:
+            * "horizon" - the certificates and CAs expiring within this number of days are renewed
+            * "batchSize" - the number of certificates renewed at once
+            * "batchPause" - the seconds waited between two batches
+            * "maxPerScan" - the maximum number of certificates renewed by a scan. The rest are left to the next scans
+            * "scanInterval" - the seconds between two background scans
+        """
+        self.m_app = app
+        self.m_config = {
+            "horizon": int(EnvOrSetting("RENEWAL_HORIZON", defaultValue=30)),
+            "batchSize": max(1, int(EnvOrSetting("RENEWAL_BATCH_SIZE", defaultValue=16))),
+            "batchPause": float(EnvOrSetting("RENEWAL_BATCH_PAUSE", defaultValue=5)),
+            "maxPerScan": int(EnvOrSetting("RENEWAL_MAX_PER_SCAN", defaultValue=1000)),
+            "scanInterval": int(EnvOrSetting("RENEWAL_SCAN_INTERVAL", defaultValue=3600)),
+            **(configArg if type(configArg) is dict else {})
+        }
+        self.m_worker = None
+
+    def Start(self):
+        """
+            Starts the background worker, which scans right away and then every scanInterval seconds
+        """
+        self.m_worker = threading.Thread(target=self._Worker, name="RenewalScheduler", daemon=True)
+        self.m_worker.start()
+
+    def Scan(self):
+        """
+            Renews the CAs and then the certificates expiring within the horizon. It must run within an app context
+
+        :return: the renewed CAs and certificates numbers, {"cas": casNo, "certs": certsNo}, or None if another process
+        is scanning (holds the renewal lease)
+        """
+        from Utils.Leases import Lease
+
+        lease = Lease(self.m_app, g_renewalLeaseName)
+        if not lease.TryAcquire():
+            return None
+        try:
+            renewBefore = datetime.datetime.now() + datetime.timedelta(days=self.m_config["horizon"])
+            renewed = {"cas": self.RenewCas(renewBefore), "certs": 0}
+            for renewedCertsNo in self._RenewCertsBatches(renewBefore):
+                renewed["certs"] += renewedCertsNo
+                if not lease.Renew():  # expired and taken over, so the new holder carries on
+                    break
+                time.sleep(self.m_config["batchPause"])
+            return renewed
+        finally:
+            lease.Release()
+
+    def RenewCas(self, renewBefore) -> int:
+        """
+            Renews the CAs certificates expiring before the given date
+
+        :param renewBefore: the date
+        :return: the number of renewed CAs
+        """
+        from Database.Models import CasDbModel
+        from Utils.CertsUtils import CertFromSerializedCert, RenewCaCert
+
+        renewedCasNo = 0
+        for orgId, serializedCaCert in CasDbModel.query.with_entities(CasDbModel.orgId, CasDbModel.cert).all():
+            if CertFromSerializedCert(serializedCaCert).not_valid_after >= renewBefore:
+                continue
+            try:
+                renewedCasNo += int(RenewCaCert(self.m_app, orgId, {"renewBefore": renewBefore}))
+            except Exception as e:
+                self.m_app.Db().session.rollback()
+                print(f"Error renewing the CA of organization {orgId} - {e}")
+        return renewedCasNo
+
+    def _RenewCertsBatches(self, renewBefore):
+        """
+            Renews the certificates expiring before the given date, one batch at a time. The certificates are iterated
+            by id (keyset), up to the last id at the scan's start, so neither the ones failing to renew nor the renewed
+            ones (which get higher ids and might expire within the horizon as well) are retried by the same scan
+
+        :param renewBefore: the date
+        :return: generator yielding the number of certificates renewed by each batch
+        """
+        from itertools import groupby
+        from sqlalchemy import exists, func
+        from sqlalchemy.orm import aliased
+        from Database.Models import CertsDbModel, EntityDbModel, EntityOrgBindings, OrgDbModel
+        from Utils.CertsUtils import BatchGetCertsAndKeys
+
+        newerCerts = aliased(CertsDbModel)
+        # the entities' last certificates, still valid but expiring within the horizon
+        certsQuery = CertsDbModel.query.with_entities(CertsDbModel.id, CertsDbModel.entityId, CertsDbModel.orgId).join(
+            EntityOrgBindings, (EntityOrgBindings.entityId == CertsDbModel.entityId) &
+                               (EntityOrgBindings.orgId == CertsDbModel.orgId)).filter(
+            CertsDbModel.revoked.isnot(True), CertsDbModel.notAfter >= datetime.datetime.now(),
+            CertsDbModel.notAfter < renewBefore,
+            ~exists().where(newerCerts.entityId == CertsDbModel.entityId, newerCerts.orgId == CertsDbModel.orgId,
+                            newerCerts.srvType == CertsDbModel.srvType, newerCerts.id > CertsDbModel.id))
+        dbSession = self.m_app.Db().session
+        maxId = CertsDbModel.query.with_entities(func.max(CertsDbModel.id)).scalar() or 0
+        lastId = 0
+        renewedCertsNo = 0
+        while renewedCertsNo < self.m_config["maxPerScan"]:
+            batchSize = min(self.m_config["batchSize"], self.m_config["maxPerScan"] - renewedCertsNo)
+            rows = certsQuery.filter(CertsDbModel.id > lastId, CertsDbModel.id <= maxId).order_by(
+                CertsDbModel.id).limit(batchSize).all()
+            if len(rows) == 0:
+                break
+            lastId = rows[-1].id
+            batchRenewedNo = 0
+            for orgId, orgRows in groupby(sorted(rows, key=lambda row: row.orgId), key=lambda row: row.orgId):
+                try:
+                    entities = EntityDbModel.query.filter(EntityDbModel.id.in_([row.entityId for row in orgRows])).all()
+                    certs = BatchGetCertsAndKeys(self.m_app, OrgDbModel.query.get(orgId), entities, {
+                        "renewBefore": renewBefore
+                    })
+                    batchRenewedNo += len([issued for _, issued in certs.values() if issued])
+                except Exception as e:
+                    dbSession.rollback()
+                    print(f"Error renewing the certificates of organization {orgId} - {e}")
+            renewedCertsNo += batchRenewedNo
+            dbSession.expunge_all()  # the renewed certificates aren't needed anymore
+            yield batchRenewedNo
+
+    def _Worker(self):
+        while True:
+            try:
+                with self.m_app.app_context():
+                    renewed = self.Scan()
+                if renewed is not None and (renewed["cas"] or renewed["certs"]):
+                    print(f"Renewed {renewed['cas']} CA(s) and {renewed['certs']} certificate(s) expiring within "
+                          f"{self.m_config['horizon']} days")
+            except Exception as e:
+                print("Error renewing the expiring certificates - " + str(e))
+            time.sleep(self.m_config["scanInterval"])
+
+
+g_renewalScheduler = None
+g_renewalSchedulerPid = None
+g_renewalSchedulerLock = threading.Lock()
+
+
+def GetRenewalScheduler(app):
+    """
+        Retrieves the process' renewal scheduler, creating it (along with its worker) if needed. The scheduler is
+        recreated in forked processes, since the worker thread doesn't survive the fork
+
+    :param app: the app object
+    :return: the renewal scheduler or None if the background renewal is disabled (RENEWAL_SCHEDULER setting)
+    """
+    global g_renewalScheduler, g_renewalSchedulerPid
+    if str(EnvOrSetting("RENEWAL_SCHEDULER", defaultValue=False)).lower() not in ["1", "on", "true"]:
+        return None
+    with g_renewalSchedulerLock:
+        if g_renewalScheduler is None or g_renewalSchedulerPid != os.getpid():
+            g_renewalScheduler = RenewalScheduler(app)
+            g_renewalScheduler.Start()
+            g_renewalSchedulerPid = os.getpid()
+        return g_renewalScheduler
@@ -14,10 +14,27 @@ def ReqSafeArg(arg, defaultValue):
 _getListDefaultConfig = {
     "page": 0, #if set to a negative value then there will be no pagination reference in the output object
     "perPage": 10,
-    "orderByColumn": "orderBy" #if string then the column name is retrieved from http request object, otherwise it must
+    "orderByColumn": "orderBy", #if string then the column name is retrieved from http request object, otherwise it must
                                 # represent a flask column object
+    "cursor": "after", #keyset pagination cursor. If string then the cursor is retrieved from the http request object
+                       # argument with this name (if the argument is present, but empty, then the first page is returned)
+    "cursorColumn": None, #the keyset pagination column. If None then the id column of the query's first entity is used
+    "withTotal": "withTotal" #if string then the flag (include the total items number in the keyset pagination mode) is
+                             # retrieved from http request object argument with this name
 }
 
+g_totalsCache = None
+
+def _TotalsCache():
+    global g_totalsCache
+    if g_totalsCache is None:
+        from Utils.Cache import TtlCache
+        from Utils.SettingsUtils import EnvOrSetting
+
+        g_totalsCache = TtlCache(int(EnvOrSetting("CURSOR_TOTALS_CACHE_SIZE", defaultValue=256)),
+                                 int(EnvOrSetting("CURSOR_TOTALS_CACHE_TTL", defaultValue=30)))
+    return g_totalsCache
+
 def Get(model, config = None):
     """
         Helper function for retrieving the entire or a page of a list of objects as result of a get resource
@@ -27,6 +44,9 @@ def Get(model, config = None):
     :return: a dictionary of objects reflecting the model
     """
     config = MergeConfigs(config, _getListDefaultConfig)
+    return GetFromQuery(_OrderedQuery(model, config), config)
+
+def _OrderedQuery(model, config):
     orderByColumn = config["orderByColumn"]
     if type(orderByColumn) is str :
         from flask import request as req
@@ -35,29 +55,213 @@ def Get(model, config = None):
     query = config.get("query" ,model.query)
     if not orderByColumn is None:
         query = query.order_by(orderByColumn)
-    if "limit" in config and type(config["limit"] is int):
-        query = query.limit(config["limit"])
-    return GetFromQuery(query, config)
+    return query
+
+def StreamFormat(config = None):
+    """
+        Checks if the http request asks for a streamed (unpaged) collection. The streaming is opt-in: either through the
+        "stream" query string or by accepting application/x-ndjson. The paged requests are never streamed
+
+    :param config: config, as for Get. "stream" - the request argument enabling the streaming
+    :return: "ndjson" (one json object per line), "json" (a regular collection json, written incrementally) or None if
+    the collection shouldn't be streamed
+    """
+    from flask import request as req
+
+    config = MergeConfigs(config, {**_getListDefaultConfig, "stream": "stream"})
+    cursor = config["cursor"]
+    if config["page"] != 0 or (req.args.get(cursor) if type(cursor) is str else cursor) is not None:
+        return None
+    if req.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson":
+        return "ndjson"
+    return "json" if req.args.get(config["stream"], "").lower() in ["1", "on", "true"] else None
+
+def StreamGet(model, config = None):
+    """
+        Streaming counterpart of Get, for the unpaged collections: the query results are fetched in chunks (yield_per)
+        and each chunk is serialized and written before the next one is fetched, so the whole collection is never held
+        in memory
+
+    :param model: the model used for query
+    :param config: config, as for Get, besides:
+        * "format" - "json" or "ndjson" (see StreamFormat)
+        * "chunkSize" - the number of rows fetched at once. Defaults to STREAM_CHUNK_SIZE setting
+        * "marshalChunk" - callable receiving a chunk of query results and returning their dictionaries. Mandatory
+    :return: the flask streamed response
+    """
+    import json
+    from itertools import islice
+    from flask import Response, stream_with_context
+    from Utils.SettingsUtils import EnvOrSetting
+
+    config = MergeConfigs(config, {
+        **_getListDefaultConfig,
+        "format": "json",
+        "chunkSize": int(EnvOrSetting("STREAM_CHUNK_SIZE", defaultValue=1000))
+    })
+    query = _OrderedQuery(model, config)
+    collectionName = config["collectionName"] if "collectionName" in config else \
+        query.column_descriptions[0]['type'].__tablename__
+    if "columns" in config and type(config["columns"]) == list:
+        query = query.with_entities(*config["columns"])
+    if config.get("limit") is not None:
+        query = query.limit(int(config["limit"]))
+    ndjson = config["format"] == "ndjson"
+
+    def Generate():
+        results = iter(query.yield_per(config["chunkSize"]))
+        separator = ""
+        if not ndjson:
+            yield f'{{"{collectionName}": ['
+        while True:
+            chunk = list(islice(results, config["chunkSize"]))
+            if len(chunk) == 0:
+                break
+            itemsDicts = config["marshalChunk"](chunk)
+            if ndjson:
+                yield "".join(json.dumps(itemDict) + "\n" for itemDict in itemsDicts)
+            else:
+                yield separator + ",".join(json.dumps(itemDict) for itemDict in itemsDicts)
+                separator = ","
+        if not ndjson:
+            yield "]}\n"
+
+    return Response(stream_with_context(Generate()),
+                    mimetype="application/x-ndjson" if ndjson else "application/json")
+
+def EncodeCursor(lastId) -> str:
+    """
+        Encodes the opaque cursor used by the keyset pagination
+
+    :param lastId: the id of the last item from the current page
+    :return: the cursor string
+    """
+    from base64 import urlsafe_b64encode
+    import json
+
+    return urlsafe_b64encode(json.dumps({"id": lastId}).encode()).decode().rstrip("=")
+
+def DecodeCursor(cursor) -> int:
+    """
+        Decodes a cursor encoded by EncodeCursor
+
+    :param cursor: the cursor string
+    :return: the id of the last item from the previous page or aborts with 400 http status if the cursor is invalid
+    """
+    from base64 import urlsafe_b64decode
+    import json
+
+    try:
+        return int(json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))["id"])
+    except Exception:
+        abort(400, "Invalid cursor")
 
 def GetFromQuery(query, config = None):
+    """
+        Helper function for retrieving the entire or a page of a query's results. It supports two pagination modes:
+            * offset based - when config's "page" is positive. It returns the total items number, as well, so each page
+            costs a COUNT query besides the LIMIT/OFFSET one
+            * keyset (cursor) based - when the config's "cursor" is set. Each page is retrieved through an index seek
+            after the previous page's last item and it contains a "nextCursor" (missing on the last page) for retrieving
+            the next one. The total items number is returned only on demand ("withTotal") and it's cached
+        The "limit" config entry, if int, caps the number of returned items
+
+    :param query: the query
+    :param config: config
+    :return: a dictionary with the collection and the pagination info
+    """
     config = MergeConfigs(config, _getListDefaultConfig)
     page = config["page"]
     perPage = config["perPage"]
-    collectionName = config["collectionName"] if "collectionName" in config else \
-        query.column_descriptions[0]['type'].__tablename__
+    limit = int(config["limit"]) if config.get("limit") is not None else None
+    entityDesc = query.column_descriptions[0]
+    collectionName = config["collectionName"] if "collectionName" in config else entityDesc['type'].__tablename__
+
+    from flask import request as req
+    cursor = config["cursor"]
+    if type(cursor) is str:
+        cursor = req.args.get(cursor)
+    if cursor is not None:
+        cursorColumn = config["cursorColumn"] if config["cursorColumn"] is not None else entityDesc['entity'].id
+        withTotal = config["withTotal"]
+        if type(withTotal) is str:
+            withTotal = req.args.get(withTotal, "").lower() in ["1", "on", "true"]
+        perPage = max(1, perPage if limit is None else min(perPage, limit))
+        res = {"pagination": True, "perPage": perPage}
+        if withTotal:
+            res["total_items"] = _CachedTotal(query.order_by(None))
+        if "columns" in config and type(config["columns"]) == list:
+            query = query.with_entities(*config["columns"])
+        if len(cursor):
+            query = query.filter(cursorColumn > DecodeCursor(cursor))
+        items = query.order_by(None).order_by(cursorColumn).limit(perPage + 1).all()
+        if len(items) > perPage:
+            items = items[:perPage]
+            lastItem = items[-1]
+            from sqlalchemy.engine import Row
+            res["nextCursor"] = EncodeCursor(getattr(lastItem[0] if isinstance(lastItem, Row) and
+                                                     not hasattr(lastItem, cursorColumn.key) else lastItem,
+                                                     cursorColumn.key))
+        res[collectionName] = items
+        return res
+
     if "columns" in config and type (config["columns"]) == list:
         query = query.with_entities(*config["columns"])
     if page != 0:
         from flask_sqlalchemy import Pagination
-        pagObj: Pagination = query.paginate(page, perPage, error_out=False)
+        pagObj: Pagination = query.paginate(page, perPage if limit is None else min(perPage, limit), error_out=False)
         return {"pagination": True, "total_items": pagObj.total, "page": pagObj.page, "perPage": pagObj.per_page,
                 collectionName: pagObj.items}
     else:
         return {
             **({"pagination": False} if page > 0 else {}),
-            collectionName: query.all()
+            collectionName: (query if limit is None else query.limit(limit)).all()
         }
 
+def _CachedTotal(query):
+    statement = query.statement.compile()
+    cacheKey = (str(statement), repr(sorted(statement.params.items())))
+    totalsCache = _TotalsCache()
+    total = totalsCache.Get(cacheKey)
+    if total is None:
+        total = query.count()
+        totalsCache.Set(cacheKey, total)
+    return total
+
+def GetRelatedIds(keyColumn, relatedIdColumn, keys, config = None):
+    """
+        Batched loader for the many-to-many relationships: retrieves the related ids of a list (page) of objects in a
+        constant number of queries (one IN query per chunk of keys), instead of one query per object
+
+    :param keyColumn: the association table's column holding the objects' ids (e.g. EntityOrgBindings.entityId)
+    :param relatedIdColumn: the association table's column holding the related objects' ids (e.g. EntityOrgBindings.orgId)
+    :param keys: the objects' ids
+    :param config: config. "orderByColumn" - the related model's column to order by (the related model is joined on
+    relatedIdColumn). If missing, the related ids are ordered ascending
+    :return: a dictionary mapping each of the keys to its (possibly empty) related ids list
+    """
+    config = MergeConfigs(config, {
+        "orderByColumn": None,
+        "chunkSize": 500 # keep the IN bound parameters number under the db limits (i.e. old SQLite versions allow 999)
+    })
+    from Api import g_theApi
+
+    keys = list(keys)
+    relatedIds = {key: [] for key in keys}
+    dbSession = g_theApi.app.Db().session
+    orderByColumn = config["orderByColumn"]
+    for chunkStart in range(0, len(keys), config["chunkSize"]):
+        query = dbSession.query(keyColumn, relatedIdColumn).filter(
+            keyColumn.in_(keys[chunkStart:chunkStart + config["chunkSize"]]))
+        if orderByColumn is not None:
+            query = query.join(orderByColumn.class_, orderByColumn.class_.id == relatedIdColumn).\
+                order_by(orderByColumn, relatedIdColumn)
+        else:
+            query = query.order_by(relatedIdColumn)
+        for key, relatedId in query:
+            relatedIds[key].append(relatedId)
+    return relatedIds
+
 def GetSingle(model, recordId):
     try:
         return model.query.filter(model.id == recordId).one()
@@ -143,13 +347,107 @@ def Post(apiObj, schema, config=None):
     except ValidationError as e:
         abort(400, f"Validation error - {e}")
     except IntegrityError as e:
-        if "UNIQUE constraint failed" in e.args[0]:
+        from Database.Errors import IntegrityErrorKind
+
+        apiObj.app.Db().session.rollback()
+        errorKind = IntegrityErrorKind(e)
+        if errorKind == "unique":
             abort(400, obj.PrettyRepr() + " aready exists")
+        elif errorKind == "foreignKey":
+            abort(400, f"Invalid reference - {e.orig}")
         abort(500, f"Error - {e}")
     except Exception as e:
         abort(500, f"Error - {e}")
     return 500, None
 
+def LoadBatch(apiObj, schema, config=None):
+    """
+        Helper function for loading the records of a batch create resource, in a single validation pass. The payload is
+        either a json array of records or, if the request content type is text/csv, a CSV with a header line naming the
+        records' fields
+
+    :param apiObj: the api object
+    :param schema: the schema used to load the records. It's loaded with many=True
+    :param config: config:
+        * "maxItems" - the maximum number of records in a batch
+        * "listFields" - the fields holding lists. In CSV they are ";" separated values
+    :return: the loaded records list or aborts with 400 http status if the payload is invalid
+    """
+    from flask import request as req
+
+    config = MergeConfigs(config, {
+        "maxItems": None,
+        "listFields": []
+    })
+    if req.mimetype == "text/csv":
+        import csv
+        import io
+
+        try:
+            data = [{
+                key: [value for value in (rowValue or "").split(";") if len(value)] if key in config["listFields"]
+                    else rowValue for key, rowValue in row.items() if key is not None
+            } for row in csv.DictReader(io.StringIO(req.get_data(as_text=True)))]
+        except csv.Error as e:
+            abort(400, f"Invalid CSV - {e}")
+    else:
+        data = apiObj.payload
+    if type(data) != list:
+        abort(400, "The payload must be an array of records")
+    if len(data) == 0:
+        abort(400, "No records provided")
+    if config["maxItems"] is not None and len(data) > int(config["maxItems"]):
+        abort(400, f"Too many records. At most {config['maxItems']} records can be created at once")
+    try:
+        return schema.load(data, many=True)
+    except ValidationError as e:
+        abort(400, f"Validation error - {e}")
+
+def BatchInsert(apiObj, model, records, config=None):
+    """
+        Helper function for inserting a batch of unique named records (such as organizations and entities), through a
+        single bulk insert. The names uniqueness is checked in one query, before inserting. The records are not committed,
+        so that the caller can insert the records' relationships in the same transaction
+
+    :param apiObj: the api object
+    :param model: the records' model. It must have an unique "name" column
+    :param records: the records' dictionaries, holding only the model's columns
+    :param config: config. "limit" - the maximum number of model records, as for Post
+    :return: the records' ids, in the records' order, or aborts with 400/500 http status and an error json
+    """
+    config = MergeConfigs(config, {
+        "limit": None
+    })
+    kinds = model.__kinds__ if hasattr(model, "__kinds__") else "records"
+    from collections import Counter
+
+    names = [record["name"] for record in records]
+    duplicateNames = sorted(name for name, count in Counter(names).items() if count > 1)
+    if len(duplicateNames):
+        abort(400, f"Duplicate names in the batch - {duplicateNames}")
+    limit = config["limit"]
+    if limit is not None and model.query.count() + len(records) > int(limit):
+        abort(500, f"The {kinds} number limit reached")
+    existingNames = [row.name for row in model.query.with_entities(model.name).filter(model.name.in_(names))]
+    if len(existingNames):
+        abort(400, f"The {kinds} already exist - {sorted(existingNames)}")
+
+    dbSession = apiObj.app.Db().session
+    try:
+        dbSession.execute(model.__table__.insert(), records)
+        ids = dict(dbSession.query(model.name, model.id).filter(model.name.in_(names)))
+    except IntegrityError as e:
+        from Database.Errors import IntegrityErrorKind
+
+        dbSession.rollback()
+        if IntegrityErrorKind(e) == "unique": # i.e. a concurrent request created one of the names in the meantime
+            abort(400, f"The {kinds} already exist - {e.orig}")
+        abort(500, f"Error inserting the {kinds} - {e.orig}")
+    except Exception as e:
+        dbSession.rollback()
+        abort(500, f"Error - {e}")
+    return [ids[name] for name in names]
+
 def Patch(apiObj, schema, model, recordId, config=None):
     """
         Helper function for patching an existing object as result of a patch resource
@@ -197,6 +495,13 @@ def Patch(apiObj, schema, model, recordId, config=None):
 
     except ValidationError as e:
         return f"Validation error - {e}", 400
+    except IntegrityError as e:
+        from Database.Errors import IntegrityErrorKind
+
+        apiObj.app.Db().session.rollback()
+        if IntegrityErrorKind(e) == "unique":
+            return f"The {model.__kinds__ if hasattr(model, '__kinds__') else 'record'} already exists - {e.orig}", 400
+        return f"Error - {e}", 500
     except Exception as e:
         return f"Error - {e}", 500
 
@@ -343,25 +648,8 @@ def JwtAuth(httpMethod):
             abort(401, "Malformed authentication header")
         encodedReqJwt = request.headers["Authorization"].split()[1]
 
-        import jwt
-
-        reqJwtHeaders = jwt.get_unverified_header(encodedReqJwt)
-        if "alg" not in reqJwtHeaders and reqJwtHeaders["alg"] != "ES512" or\
-            "typ" not in reqJwtHeaders and reqJwtHeaders["typ"] != "JWT" or \
-            "kid" not in reqJwtHeaders and reqJwtHeaders["kid"] != "lxTkvONAr97dOiitHFVP4-6KHxZIqGfXNC11c6Q-OIU":
-            abort(401, "Invalid JWT headers")
-        reqJwt = {}
-        try:
-            reqJwt = jwt.decode(encodedReqJwt, """-----BEGIN PUBLIC KEY-----
-MIGbMBAGByqGSM49AgEGBSuBBAAjA4GGAAQBbt1qDq8dkPg2KAyDW6eiI0kxotiFukwN3x6lfzPCRXkgk00qzExAlu60f6dS9Rn8B3Dz91LoFtxm++z+W7ztI7cALJao3yVGqhZ/Q6xxPy7HOA1u2qn2YZOinf6HYDydLeoGbaeKJgBGqu/FmImlDOsz/R5xABlNZyJtjlQklNa/nho=
------END PUBLIC KEY-----
-""",                                ["ES512"], {
-                                    "verify_signature": True,
-                                    "verify_aud": False,
-                                    "required": ["exp", "iat", "sub"]
-                                }, issuer="https://www.liny.io/auth/realms/liny")
-        except Exception as e:
-            abort(401, "Error decoding/authenticating JWT - " + str(e))
+        from Utils.JwtVerifier import GetJwtVerifier
+        reqJwt = GetJwtVerifier().Verify(encodedReqJwt)
 
         #ToDO: check "allowed-origins"?!
         from Api import g_theApi
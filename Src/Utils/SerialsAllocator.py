@@ -0,0 +1,103 @@
+import os
+import threading
+
+from Utils.SettingsUtils import EnvOrSetting
+
+g_certsSequenceName = "certs"
+
+
+class SerialsAllocator:
+    """
+        Allocator of the issued certificates' serial numbers. Each process reserves ranges of consecutive serial numbers
+        from the serials table (one short transaction per range) and hands them out from memory, so the parallel
+        issuance, in the same or in different processes, never yields duplicate serial numbers and the batch issuance
+        needs no db round-trip per certificate. The serials left unused when a process exits are simply skipped
+    """
+
+    def __init__(self, app, rangeSize):
+        """
+        :param app: the app object
+        :param rangeSize: the number of serials reserved at once
+        """
+        self.m_app = app
+        self.m_rangeSize = rangeSize
+        self.m_nextSerial = 0
+        self.m_endSerial = 0  # the reserved range's end (exclusive)
+        self.m_lock = threading.Lock()
+
+    def Allocate(self, count=1) -> list:
+        """
+            Allocates serial numbers
+
+        :param count: the serials number
+        :return: the allocated serials list
+        """
+        serials = []
+        with self.m_lock:
+            while len(serials) < count:
+                if self.m_nextSerial >= self.m_endSerial:
+                    self.m_nextSerial, self.m_endSerial = self._ReserveRange(max(self.m_rangeSize, count - len(serials)))
+                takenNo = min(count - len(serials), self.m_endSerial - self.m_nextSerial)
+                serials.extend(range(self.m_nextSerial, self.m_nextSerial + takenNo))
+                self.m_nextSerial += takenNo
+        return serials
+
+    def _ReserveRange(self, size):
+        """
+            Reserves a range of serials, by advancing the sequence's next serial. The advance is conditioned by the read
+            value (compare and swap), so it's retried if another process reserved a range in the meantime. It runs on
+            its own connection, leaving the caller's session transaction untouched
+
+        :param size: the range size
+        :return: the (first serial, end serial) tuple. The end serial is excluded
+        """
+        from sqlalchemy import func, select
+        from sqlalchemy.exc import IntegrityError
+        from Database.Errors import IntegrityErrorKind
+        from Database.Models import SerialsDbModel, CertsDbModel
+
+        serialsTable = SerialsDbModel.__table__
+        engine = self.m_app.Db().engine
+        while True:
+            try:
+                with engine.begin() as conn:
+                    nextSerial = conn.execute(select(serialsTable.c.nextSerial).where(
+                        serialsTable.c.name == g_certsSequenceName)).scalar()
+                    if nextSerial is None:
+                        # the sequence starts after the certificates issued before it existed, whose serial numbers
+                        # never exceeded their ids
+                        nextSerial = (conn.execute(select(func.max(CertsDbModel.id))).scalar() or 0) + 1
+                        conn.execute(serialsTable.insert(), {"name": g_certsSequenceName, "nextSerial": nextSerial + size})
+                        return nextSerial, nextSerial + size
+                    if conn.execute(serialsTable.update().where(serialsTable.c.name == g_certsSequenceName,
+                                                                serialsTable.c.nextSerial == nextSerial).values(
+                            nextSerial=nextSerial + size)).rowcount == 1:
+                        return nextSerial, nextSerial + size
+            except IntegrityError as e:  # another process created the sequence in the meantime
+                if IntegrityErrorKind(e) != "unique":
+                    raise
+
+
+g_serialsAllocator = None
+g_serialsAllocatorPid = None
+g_serialsAllocatorLock = threading.Lock()
+
+
+def GetSerialsAllocator(app) -> SerialsAllocator:
+    """
+        Retrieves the process' serials allocator, creating it if needed. The allocator is recreated in forked
+        processes, so that a reserved range is never handed out by two processes
+
+    :param app: the app object
+    :return: the serials allocator
+    """
+    global g_serialsAllocator, g_serialsAllocatorPid
+    with g_serialsAllocatorLock:
+        if g_serialsAllocator is None or g_serialsAllocatorPid != os.getpid():
+            g_serialsAllocator = SerialsAllocator(app, max(1, int(EnvOrSetting("SERIALS_RANGE_SIZE", defaultValue=64))))
+            g_serialsAllocatorPid = os.getpid()
+        return g_serialsAllocator
+
+
+def AllocateSerials(app, count=1) -> list:
+    return GetSerialsAllocator(app).Allocate(count)